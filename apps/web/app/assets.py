@@ -0,0 +1,293 @@
+from __future__ import annotations
+
+import gzip
+import hashlib
+import json
+import os
+import shutil
+import threading
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Iterator
+
+from fastapi.staticfiles import StaticFiles
+from jinja2 import Environment, pass_context
+from jinja2.runtime import Context
+from starlette.datastructures import Headers
+from starlette.responses import Response
+from starlette.types import Scope
+
+try:
+    import brotli
+except ImportError:  # pragma: no cover - senza brotli si generano solo i .gz
+    brotli = None
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover - su Windows la build non è serializzata
+    fcntl = None
+
+MANIFEST_FILENAME = "manifest.json"
+LOCK_FILENAME = ".build.lock"
+COMPRESSIBLE_SUFFIXES = {".css", ".js", ".svg", ".json", ".txt", ".html", ".pdf", ".xml"}
+ENCODING_SUFFIXES = {"br": ".br", "gzip": ".gz"}
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+REVALIDATE_CACHE_CONTROL = "no-cache"
+
+
+def _file_digest(path: Path) -> str:
+    digest = hashlib.sha256()
+    with path.open("rb") as handle:
+        for chunk in iter(lambda: handle.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class AssetManifest:
+    """Copie con hash nel nome degli asset statici, più varianti .gz/.br.
+
+    `build()` copia ogni file di `static/` in `static/<output_prefix>/` come
+    `nome.<hash>.ext` e scrive `manifest.json`, che mappa il percorso logico
+    (`css/styles.css`) su quello con hash. Le cartelle già indirizzate per
+    contenuto (varianti immagini, miniature Drive) vengono saltate.
+
+    La build tiene un lock su file, perché ogni worker la esegue all'avvio, e
+    non cancella i file della release precedente (`previous` nel manifest):
+    le pagine già in cache nei browser o servite dai worker vecchi durante un
+    riavvio continuano a trovarli.
+    """
+
+    def __init__(
+        self,
+        static_dir: Path,
+        output_prefix: str = "dist",
+        skip_prefixes: tuple[str, ...] = ("img/derived/", "gallery-cache/"),
+        min_compress_ratio: float = 0.9,
+    ) -> None:
+        self.static_dir = static_dir
+        self.output_prefix = output_prefix.strip("/")
+        self.output_dir = static_dir / self.output_prefix
+        self.skip_prefixes = (f"{self.output_prefix}/",) + skip_prefixes
+        self.min_compress_ratio = min_compress_ratio
+        self._lock = threading.Lock()
+        self.files: dict[str, str] = {}
+        self.encodings: dict[str, list[str]] = {}
+        self.previous: list[str] = []
+        # Hash della mappa dei file: entra nella chiave delle pagine in cache,
+        # uguale su tutti i worker che servono la stessa release.
+        self.digest = content_digest(self.files)
+        self.load()
+
+    @property
+    def manifest_path(self) -> Path:
+        return self.output_dir / MANIFEST_FILENAME
+
+    def load(self) -> None:
+        try:
+            data = json.loads(self.manifest_path.read_text(encoding="utf-8"))
+        except (OSError, ValueError):
+            return
+        with self._lock:
+            self.files = dict(data.get("files", {}))
+            self.digest = content_digest(self.files)
+            self.encodings = {k: list(v) for k, v in data.get("encodings", {}).items()}
+            self.previous = list(data.get("previous", []))
+
+    def _save(self) -> None:
+        with self._lock:
+            payload = json.dumps(
+                {"files": self.files, "encodings": self.encodings, "previous": self.previous},
+                sort_keys=True,
+                indent=1,
+            )
+        tmp_path = unique_tmp_path(self.manifest_path)
+        tmp_path.write_text(payload, encoding="utf-8")
+        os.replace(tmp_path, self.manifest_path)
+
+    def resolve(self, path: str) -> str:
+        return self.files.get(path.lstrip("/"), path)
+
+    def is_immutable(self, path: str) -> bool:
+        # I manifest/indici JSON nelle cartelle hashate cambiano a ogni build.
+        return path.startswith(self.skip_prefixes) and not path.endswith(".json")
+
+    def accepted_encodings(self, path: str) -> list[str]:
+        return self.encodings.get(path, [])
+
+    def _sources(self) -> list[tuple[str, Path]]:
+        sources: list[tuple[str, Path]] = []
+        for path in sorted(self.static_dir.rglob("*")):
+            if not path.is_file():
+                continue
+            relative = path.relative_to(self.static_dir).as_posix()
+            if relative.startswith(self.skip_prefixes) or relative.endswith((".tmp", ".part")):
+                continue
+            sources.append((relative, path))
+        return sources
+
+    def build(self, compress: bool = True) -> int:
+        """Aggiorna copie con hash e manifest; restituisce i file nuovi."""
+        with build_lock(self.output_dir):
+            created = self._build()
+        if compress:
+            self.compress()
+        return created
+
+    def _build(self) -> int:
+        # Un altro worker può aver appena finito la build: si parte dal suo manifest.
+        self.load()
+        files: dict[str, str] = {}
+        created = 0
+        for relative, path in self._sources():
+            digest = _file_digest(path)[:12]
+            logical = Path(relative)
+            hashed = (
+                f"{self.output_prefix}/"
+                f"{logical.with_name(f'{logical.stem}.{digest}{logical.suffix}').as_posix()}"
+            )
+            target = self.static_dir / hashed
+            if not target.exists():
+                target.parent.mkdir(parents=True, exist_ok=True)
+                tmp_path = unique_tmp_path(target)
+                shutil.copyfile(path, tmp_path)
+                os.replace(tmp_path, target)
+                created += 1
+            files[relative] = hashed
+        with self._lock:
+            if files != self.files and self.files:
+                self.previous = sorted(set(self.files.values()) - set(files.values()))
+            self.files = files
+            self.digest = content_digest(files)
+            self.encodings = {k: v for k, v in self.encodings.items() if k in files.values()}
+        self._save()
+        self._prune()
+        return created
+
+    def compress(self) -> None:
+        for hashed in list(self.files.values()):
+            target = self.static_dir / hashed
+            if target.suffix.lower() not in COMPRESSIBLE_SUFFIXES or hashed in self.encodings:
+                continue
+            encodings: list[str] = []
+            data: bytes | None = None
+            for encoding, suffix in ENCODING_SUFFIXES.items():
+                if encoding == "br" and brotli is None:
+                    continue
+                sibling = target.with_name(target.name + suffix)
+                if not sibling.exists():
+                    data = target.read_bytes() if data is None else data
+                    if encoding == "br":
+                        compressed = brotli.compress(data, quality=11)
+                    else:
+                        compressed = gzip.compress(data, compresslevel=9, mtime=0)
+                    if len(compressed) > len(data) * self.min_compress_ratio:
+                        continue
+                    tmp_path = unique_tmp_path(sibling)
+                    tmp_path.write_bytes(compressed)
+                    os.replace(tmp_path, sibling)
+                encodings.append(encoding)
+            with self._lock:
+                self.encodings[hashed] = encodings
+        self._save()
+
+    def _prune(self) -> None:
+        hashed_paths = [*self.files.values(), *self.previous]
+        keep = {self.static_dir / hashed for hashed in hashed_paths}
+        keep |= {
+            (self.static_dir / hashed).with_name((self.static_dir / hashed).name + suffix)
+            for hashed in hashed_paths
+            for suffix in ENCODING_SUFFIXES.values()
+        }
+        keep |= {self.manifest_path, self.output_dir / LOCK_FILENAME}
+        for path in self.output_dir.rglob("*"):
+            # I .tmp possono essere scritture in corso di un altro worker.
+            if path.is_file() and path not in keep and path.suffix != ".tmp":
+                path.unlink(missing_ok=True)
+
+
+def content_digest(data: Any) -> str:
+    """SHA-256 della serializzazione JSON canonica di `data`."""
+    payload = json.dumps(data, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+@contextmanager
+def build_lock(directory: Path) -> Iterator[None]:
+    """Serializza tra processi le build che scrivono in `directory`."""
+    directory.mkdir(parents=True, exist_ok=True)
+    with (directory / LOCK_FILENAME).open("a") as handle:
+        if fcntl is not None:
+            fcntl.flock(handle, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(handle, fcntl.LOCK_UN)
+
+
+def unique_tmp_path(path: Path) -> Path:
+    """Nome temporaneo accanto a `path`, diverso per ogni processo e thread."""
+    return path.with_name(f"{path.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+
+
+def _parse_accept_encoding(header: str) -> set[str]:
+    accepted: set[str] = set()
+    for item in header.split(","):
+        token, _, params = item.strip().partition(";")
+        if params.strip().replace(" ", "") in ("q=0", "q=0.0", "q=0.00", "q=0.000"):
+            continue
+        if token:
+            accepted.add(token.strip().lower())
+    return accepted
+
+
+class AssetStaticFiles(StaticFiles):
+    """`StaticFiles` che serve le varianti precompresse e header di cache lunghi."""
+
+    def __init__(self, *args: Any, manifest: AssetManifest, **kwargs: Any) -> None:
+        super().__init__(*args, **kwargs)
+        self.manifest = manifest
+
+    async def get_response(self, path: str, scope: Scope) -> Response:
+        path = path.lstrip("/")
+        encodings = self.manifest.accepted_encodings(path)
+        if encodings:
+            accepted = _parse_accept_encoding(Headers(scope=scope).get("accept-encoding", ""))
+            for encoding in encodings:
+                if encoding not in accepted:
+                    continue
+                response = await super().get_response(path + ENCODING_SUFFIXES[encoding], scope)
+                response.headers["Content-Encoding"] = encoding
+                break
+            else:
+                response = await super().get_response(path, scope)
+            response.headers["Vary"] = "Accept-Encoding"
+        else:
+            response = await super().get_response(path, scope)
+        response.headers["Cache-Control"] = (
+            IMMUTABLE_CACHE_CONTROL if self.manifest.is_immutable(path) else REVALIDATE_CACHE_CONTROL
+        )
+        return response
+
+
+def install_asset_url_for(env: Environment, manifest: AssetManifest) -> None:
+    """Fa risolvere `url_for('static', path=...)` al percorso con hash."""
+    base_url_for = env.globals["url_for"]
+
+    @pass_context
+    def url_for(context: Context, name: str, /, **path_params: Any) -> Any:
+        if name == "static" and "path" in path_params:
+            path_params["path"] = manifest.resolve(path_params["path"])
+        return base_url_for(context, name, **path_params)
+
+    env.globals["url_for"] = url_for
+
+
+if __name__ == "__main__":
+    from .config import settings
+
+    static_root = Path(settings.static_path)
+    if not static_root.is_absolute():
+        static_root = Path(__file__).resolve().parent / static_root
+    created = AssetManifest(static_root).build()
+    print(f"Manifest asset aggiornato ({created} nuovi file)")
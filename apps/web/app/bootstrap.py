@@ -0,0 +1,82 @@
+from __future__ import annotations
+
+import hashlib
+import logging
+from pathlib import Path
+from typing import Callable, Iterable
+
+from sqlalchemy import text
+from sqlalchemy.engine import Connection, Engine
+from sqlalchemy.exc import DBAPIError
+from sqlalchemy.orm import Session
+
+from .database import Base
+from .migrations import run_migrations
+from .seed import DEFAULT_CATALOG_PATH, seed_sample_data
+
+logger = logging.getLogger(__name__)
+
+# Moduli che definiscono schema, migrazioni e caricamento del catalogo: se non
+# cambiano, insieme al file del catalogo, il database preparato dall'avvio
+# precedente è ancora valido.
+FINGERPRINT_SOURCES = tuple(
+    Path(__file__).resolve().parent / name for name in ("models.py", "migrations.py", "seed.py")
+)
+
+
+def startup_fingerprint(paths: Iterable[Path]) -> str:
+    """Hash dei sorgenti di schema e seed; costa meno di una query."""
+    digest = hashlib.blake2b(digest_size=16)
+    for path in paths:
+        digest.update(path.name.encode())
+        digest.update(path.read_bytes())
+    return digest.hexdigest()
+
+
+def _ensure_fingerprint_table(conn: Connection) -> None:
+    conn.execute(
+        text(
+            "CREATE TABLE IF NOT EXISTS startup_fingerprint ("
+            "id INTEGER PRIMARY KEY, fingerprint VARCHAR(64) NOT NULL)"
+        )
+    )
+
+
+def stored_fingerprint(engine: Engine) -> str | None:
+    try:
+        with engine.connect() as conn:
+            return conn.execute(
+                text("SELECT fingerprint FROM startup_fingerprint WHERE id = 1")
+            ).scalar()
+    except DBAPIError:
+        # Database nuovo o precedente all'impronta: la tabella non esiste ancora.
+        return None
+
+
+def prepare_database(
+    engine: Engine,
+    session_factory: Callable[[], Session],
+    catalog_path: Path = DEFAULT_CATALOG_PATH,
+) -> bool:
+    """Porta il database allo schema e ai dati iniziali correnti.
+
+    Se l'impronta salvata coincide con quella dei sorgenti salta `create_all`,
+    le migrazioni e il seed: all'avvio resta una sola SELECT. Restituisce
+    True se il database è stato aggiornato.
+    """
+    fingerprint = startup_fingerprint((*FINGERPRINT_SOURCES, catalog_path))
+    if stored_fingerprint(engine) == fingerprint:
+        return False
+    Base.metadata.create_all(bind=engine)
+    run_migrations(engine)
+    with session_factory() as session:
+        seed_sample_data(session, catalog_path)
+    with engine.begin() as conn:
+        _ensure_fingerprint_table(conn)
+        conn.execute(text("DELETE FROM startup_fingerprint WHERE id = 1"))
+        conn.execute(
+            text("INSERT INTO startup_fingerprint (id, fingerprint) VALUES (1, :fingerprint)"),
+            {"fingerprint": fingerprint},
+        )
+    logger.info("Database preparato (impronta %s)", fingerprint)
+    return True
@@ -0,0 +1,164 @@
+from __future__ import annotations
+
+import threading
+import time
+from dataclasses import dataclass, fields
+from datetime import date, datetime, timezone
+from types import MappingProxyType
+from typing import Callable, Mapping
+
+import anyio
+from sqlalchemy import select, text
+from sqlalchemy.orm import Session
+
+from .models import CatalogVersion, Event, MerchItem
+
+
+@dataclass(frozen=True)
+class EventSnapshot:
+    id: int
+    title: str
+    slug: str
+    description: str | None
+    location: str | None
+    summary: str | None
+    date: date | None
+    hero_quote: str | None
+    teaser: str | None
+
+
+@dataclass(frozen=True)
+class MerchSnapshot:
+    id: int
+    name: str
+    slug: str
+    description: str | None
+    price_cents: int
+    stock: int | None
+    image_url: str | None
+
+
+def _snapshot_columns(cls: type, model: type) -> list[object]:
+    # Solo le colonne dello snapshot e senza entità ORM: con migliaia di
+    # prodotti la ricarica costa meno della metà.
+    return [model.__table__.c[field.name] for field in fields(cls)]
+
+
+@dataclass(frozen=True)
+class CatalogSnapshot:
+    """Eventi e merch in sola lettura, già ordinati e indicizzati per slug."""
+
+    version: int
+    events: tuple[EventSnapshot, ...]
+    events_by_slug: Mapping[str, EventSnapshot]
+    merch: tuple[MerchSnapshot, ...]
+    merch_by_name: tuple[MerchSnapshot, ...]
+    merch_by_slug: Mapping[str, MerchSnapshot]
+    loaded_at: datetime
+
+
+@dataclass
+class CatalogCacheStats:
+    hits: int = 0
+    misses: int = 0
+    version_checks: int = 0
+
+
+def read_catalog_version(session: Session) -> int:
+    return session.scalar(select(CatalogVersion.version).where(CatalogVersion.id == 1)) or 0
+
+
+def bump_catalog_version(session: Session) -> None:
+    """Invalida le cache del catalogo; il commit resta al chiamante.
+
+    Su SQLite i trigger della migrazione 6 lo fanno già a ogni modifica di
+    `events` e `merch_items`: serve solo per scritture che li scavalcano.
+    """
+    session.execute(text("UPDATE catalog_version SET version = version + 1 WHERE id = 1"))
+
+
+def load_catalog(session: Session, version: int) -> CatalogSnapshot:
+    events = tuple(
+        EventSnapshot(*row)
+        for row in session.execute(
+            select(*_snapshot_columns(EventSnapshot, Event)).order_by(
+                Event.date.asc().nulls_last(), Event.id
+            )
+        )
+    )
+    merch = tuple(
+        MerchSnapshot(*row)
+        for row in session.execute(
+            select(*_snapshot_columns(MerchSnapshot, MerchItem)).order_by(MerchItem.id)
+        )
+    )
+    return CatalogSnapshot(
+        version=version,
+        events=events,
+        events_by_slug=MappingProxyType({event.slug: event for event in events}),
+        merch=merch,
+        merch_by_name=tuple(sorted(merch, key=lambda item: item.name)),
+        merch_by_slug=MappingProxyType({item.slug: item for item in merch}),
+        loaded_at=datetime.now(timezone.utc),
+    )
+
+
+class CatalogCache:
+    """Cache read-through del catalogo (eventi e merch) invalidata per versione.
+
+    Il numero di versione in `catalog_version` viene riletto al massimo ogni
+    `check_interval` secondi; se è cambiato si ricarica l'intero snapshot con
+    due query. Tra un controllo e l'altro ogni richiesta è una lettura in
+    memoria, a costo di servire dati vecchi per al più `check_interval`.
+    """
+
+    def __init__(
+        self,
+        session_factory: Callable[[], Session],
+        check_interval: float = 2.0,
+        clock: Callable[[], float] = time.monotonic,
+    ) -> None:
+        self.session_factory = session_factory
+        self.check_interval = check_interval
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._snapshot: CatalogSnapshot | None = None
+        self._checked_at = float("-inf")
+        self.stats = CatalogCacheStats()
+
+    def get(self) -> CatalogSnapshot:
+        snapshot = self._snapshot
+        if snapshot is not None and self._clock() - self._checked_at < self.check_interval:
+            self.stats.hits += 1
+            return snapshot
+        with self._lock:
+            snapshot = self._snapshot
+            if snapshot is not None and self._clock() - self._checked_at < self.check_interval:
+                self.stats.hits += 1
+                return snapshot
+            session = self.session_factory()
+            try:
+                self.stats.version_checks += 1
+                version = read_catalog_version(session)
+                if snapshot is not None and snapshot.version == version:
+                    self.stats.hits += 1
+                else:
+                    self.stats.misses += 1
+                    snapshot = load_catalog(session, version)
+                    self._snapshot = snapshot
+            finally:
+                session.close()
+            self._checked_at = self._clock()
+            return snapshot
+
+    async def aget(self) -> CatalogSnapshot:
+        """Come `get`, ma l'eventuale rilettura dal database avviene in un thread."""
+        snapshot = self._snapshot
+        if snapshot is not None and self._clock() - self._checked_at < self.check_interval:
+            self.stats.hits += 1
+            return snapshot
+        return await anyio.to_thread.run_sync(self.get)
+
+    def invalidate(self) -> None:
+        with self._lock:
+            self._checked_at = float("-inf")
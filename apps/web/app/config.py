@@ -4,6 +4,17 @@ from pydantic import BaseSettings, Field
 class Settings(BaseSettings):
     app_name: str = 'Amaro Sport e Cultura'
     database_url: str = Field('sqlite:///./amaro.db', env='DATABASE_URL')
+    async_database_url: str | None = Field(None, env='ASYNC_DATABASE_URL')
+    sqlite_journal_mode: str = Field('wal', env='SQLITE_JOURNAL_MODE')
+    sqlite_synchronous: str = Field('normal', env='SQLITE_SYNCHRONOUS')
+    sqlite_busy_timeout_ms: int = Field(5000, env='SQLITE_BUSY_TIMEOUT_MS')
+    sqlite_cache_size_kib: int = Field(16384, env='SQLITE_CACHE_SIZE_KIB')
+    sqlite_mmap_size: int = Field(128 * 1024 * 1024, env='SQLITE_MMAP_SIZE')
+    sqlite_temp_store: str = Field('memory', env='SQLITE_TEMP_STORE')
+    db_pool_size: int = Field(10, env='DB_POOL_SIZE')
+    db_max_overflow: int = Field(20, env='DB_MAX_OVERFLOW')
+    db_pool_timeout: float = Field(30, env='DB_POOL_TIMEOUT')
+    db_pool_recycle: int = Field(-1, env='DB_POOL_RECYCLE')
     static_path: str = Field('static', env='STATIC_PATH')
     nexipay_merchant_id: str | None = Field(None, env='NEXI_MERCHANT_ID')
     nexipay_api_key: str | None = Field(None, env='NEXI_API_KEY')
@@ -11,11 +22,42 @@ class Settings(BaseSettings):
     nexipay_endpoint: str = Field(..., env='NEXI_ENDPOINT')
     nexipay_success_url: str = Field(..., env='NEXI_SUCCESS_URL')
     nexipay_failure_url: str = Field(..., env='NEXI_FAILURE_URL')
+    nexipay_node_id: str = Field('', env='NEXI_NODE_ID')
+    nexipay_notify_url: str | None = Field(None, env='NEXI_NOTIFY_URL')
     uploads_path: str = Field('uploads', env='UPLOAD_PATH')
+    upload_max_file_bytes: int = Field(15 * 1024 * 1024, env='UPLOAD_MAX_FILE_BYTES')
+    upload_max_request_bytes: int = Field(40 * 1024 * 1024, env='UPLOAD_MAX_REQUEST_BYTES')
+    catalog_cache_check_interval: float = Field(2.0, env='CATALOG_CACHE_CHECK_INTERVAL')
+    catalog_path: str = Field('catalog.json', env='CATALOG_PATH')
+    catalog_reload_interval: float = Field(2.0, env='CATALOG_RELOAD_INTERVAL')
+    page_cache_max_bytes: int = Field(8 * 1024 * 1024, env='PAGE_CACHE_MAX_BYTES')
+    public_base_url: str | None = Field(None, env='PUBLIC_BASE_URL')
+    metrics_token: str | None = Field(None, env='METRICS_TOKEN')
+    admin_token: str | None = Field(None, env='ADMIN_TOKEN')
+    query_budget: int = Field(20, env='QUERY_BUDGET')
+    profiling_secret: str | None = Field(None, env='PROFILING_SECRET')
+    profiling_sample_rate: float = Field(0.0, env='PROFILING_SAMPLE_RATE')
+    profiling_path: str = Field('profiles', env='PROFILING_PATH')
+    profiling_max_bytes: int = Field(64 * 1024 * 1024, env='PROFILING_MAX_BYTES')
+    merch_reservation_ttl: int = Field(1800, env='MERCH_RESERVATION_TTL')
+    merch_max_quantity: int = Field(10, env='MERCH_MAX_QUANTITY')
+    merch_reservation_sweep_interval: int = Field(60, env='MERCH_RESERVATION_SWEEP_INTERVAL')
     google_drive_api_key: str | None = Field(None, env='GOOGLE_DRIVE_API_KEY')
     drive_events_folder_id: str | None = Field(None, env='GOOGLE_DRIVE_EVENTS_FOLDER_ID')
     drive_gallery_folder_id: str | None = Field(None, env='GOOGLE_DRIVE_GALLERY_FOLDER_ID')
+    drive_api_url: str = Field('https://www.googleapis.com/drive/v3/files', env='GOOGLE_DRIVE_API_URL')
+    drive_cache_ttl: int = Field(300, env='GOOGLE_DRIVE_CACHE_TTL')
+    drive_gallery_cache_ttl: int = Field(1200, env='GOOGLE_DRIVE_GALLERY_CACHE_TTL')
+    drive_cache_cold_wait: float = Field(2.0, env='GOOGLE_DRIVE_CACHE_COLD_WAIT')
+    drive_page_size: int = Field(18, env='GOOGLE_DRIVE_PAGE_SIZE')
+    drive_max_connections: int = Field(20, env='GOOGLE_DRIVE_MAX_CONNECTIONS')
+    drive_thumbnail_url: str = Field('https://drive.google.com/thumbnail', env='GOOGLE_DRIVE_THUMBNAIL_URL')
+    drive_thumbnail_sync_interval: int = Field(900, env='GOOGLE_DRIVE_THUMBNAIL_SYNC_INTERVAL')
     session_secret: str = Field('change-me-session', env='SESSION_SECRET')
+    session_backend: str = Field('database', env='SESSION_BACKEND')
+    session_max_age: int = Field(14 * 24 * 3600, env='SESSION_MAX_AGE')
+    session_memory_max_entries: int = Field(10000, env='SESSION_MEMORY_MAX_ENTRIES')
+    session_gc_interval: int = Field(300, env='SESSION_GC_INTERVAL')
 
     class Config:
         env_file = '.env'
@@ -1,18 +1,110 @@
 from __future__ import annotations
 
-from typing import Generator
+from typing import Any, AsyncGenerator, Generator
 
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event, make_url
+from sqlalchemy.engine import Engine
+from sqlalchemy.ext.asyncio import AsyncEngine, AsyncSession, async_sessionmaker, create_async_engine
 from sqlalchemy.orm import Session, declarative_base, sessionmaker
 
-from .config import settings
+from .config import Settings, settings
 
-connect_args: dict[str, object] = {}
-if settings.database_url.startswith('sqlite'):
-    connect_args['check_same_thread'] = False
+SQLITE_JOURNAL_MODES = {'delete', 'truncate', 'persist', 'memory', 'wal', 'off'}
+SQLITE_SYNCHRONOUS_LEVELS = {'off', 'normal', 'full', 'extra'}
+SQLITE_TEMP_STORES = {'default', 'file', 'memory'}
 
-engine = create_engine(settings.database_url, connect_args=connect_args, future=True)
+
+def _is_memory_sqlite(url: str) -> bool:
+    return url in ('sqlite://', 'sqlite:///:memory:') or 'mode=memory' in url
+
+
+def _checked(value: str, allowed: set[str], name: str) -> str:
+    value = value.lower()
+    if value not in allowed:
+        raise ValueError(f'{name} non valido: {value!r} (ammessi: {", ".join(sorted(allowed))})')
+    return value
+
+
+def sqlite_pragmas(config: Settings) -> list[str]:
+    """PRAGMA applicati a ogni nuova connessione SQLite."""
+    pragmas = [
+        f'PRAGMA busy_timeout = {int(config.sqlite_busy_timeout_ms)}',
+        f'PRAGMA synchronous = {_checked(config.sqlite_synchronous, SQLITE_SYNCHRONOUS_LEVELS, "SQLITE_SYNCHRONOUS")}',
+        f'PRAGMA cache_size = {-abs(int(config.sqlite_cache_size_kib))}',
+        f'PRAGMA mmap_size = {int(config.sqlite_mmap_size)}',
+        f'PRAGMA temp_store = {_checked(config.sqlite_temp_store, SQLITE_TEMP_STORES, "SQLITE_TEMP_STORE")}',
+    ]
+    if not _is_memory_sqlite(config.database_url):
+        journal_mode = _checked(config.sqlite_journal_mode, SQLITE_JOURNAL_MODES, 'SQLITE_JOURNAL_MODE')
+        pragmas.insert(0, f'PRAGMA journal_mode = {journal_mode}')
+    return pragmas
+
+
+def _engine_args(config: Settings) -> tuple[dict[str, object], dict[str, Any]]:
+    connect_args: dict[str, object] = {}
+    engine_args: dict[str, Any] = {}
+    is_sqlite = config.database_url.startswith('sqlite')
+    if is_sqlite:
+        connect_args['check_same_thread'] = False
+        connect_args['timeout'] = config.sqlite_busy_timeout_ms / 1000
+    if not (is_sqlite and _is_memory_sqlite(config.database_url)):
+        engine_args.update(
+            pool_size=config.db_pool_size,
+            max_overflow=config.db_max_overflow,
+            pool_timeout=config.db_pool_timeout,
+            pool_recycle=config.db_pool_recycle,
+            pool_pre_ping=not is_sqlite,
+        )
+    return connect_args, engine_args
+
+
+def _install_sqlite_pragmas(new_engine: Engine, config: Settings) -> None:
+    pragmas = sqlite_pragmas(config)
+
+    @event.listens_for(new_engine, 'connect')
+    def _apply_sqlite_pragmas(dbapi_connection: Any, _record: Any) -> None:
+        cursor = dbapi_connection.cursor()
+        try:
+            for pragma in pragmas:
+                cursor.execute(pragma)
+        finally:
+            cursor.close()
+
+
+def build_engine(config: Settings) -> Engine:
+    connect_args, engine_args = _engine_args(config)
+    new_engine = create_engine(config.database_url, connect_args=connect_args, future=True, **engine_args)
+    if config.database_url.startswith('sqlite'):
+        _install_sqlite_pragmas(new_engine, config)
+    return new_engine
+
+
+def async_database_url(config: Settings) -> str:
+    """`ASYNC_DATABASE_URL` se impostato, altrimenti `DATABASE_URL` con aiosqlite.
+
+    Un database SQLite in memoria non è condiviso tra i due engine.
+    """
+    if config.async_database_url:
+        return config.async_database_url
+    url = make_url(config.database_url)
+    if url.get_backend_name() == 'sqlite' and url.get_driver_name() == 'pysqlite':
+        url = url.set(drivername='sqlite+aiosqlite')
+    return url.render_as_string(hide_password=False)
+
+
+def build_async_engine(config: Settings) -> AsyncEngine:
+    connect_args, engine_args = _engine_args(config)
+    connect_args.pop('check_same_thread', None)
+    new_engine = create_async_engine(async_database_url(config), connect_args=connect_args, **engine_args)
+    if config.database_url.startswith('sqlite'):
+        _install_sqlite_pragmas(new_engine.sync_engine, config)
+    return new_engine
+
+
+engine = build_engine(settings)
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine, future=True)
+async_engine = build_async_engine(settings)
+AsyncSessionLocal = async_sessionmaker(async_engine, autoflush=False, expire_on_commit=False)
 Base = declarative_base()
 
 
@@ -22,3 +114,8 @@ def get_session() -> Generator[Session, None, None]:
         yield session
     finally:
         session.close()
+
+
+async def get_async_session() -> AsyncGenerator[AsyncSession, None]:
+    async with AsyncSessionLocal() as session:
+        yield session
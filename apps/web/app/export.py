@@ -0,0 +1,391 @@
+from __future__ import annotations
+
+import argparse
+import csv
+import io
+import logging
+import re
+import sys
+import zipfile
+from datetime import date, datetime
+from pathlib import Path
+from typing import Any, Callable, Iterable, Iterator
+from xml.sax.saxutils import escape
+
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+
+from .models import Member, MemberDocument
+
+logger = logging.getLogger(__name__)
+
+EXPORT_FORMATS = ("csv", "xlsx", "zip")
+MEDIA_TYPES = {
+    "csv": "text/csv; charset=utf-8",
+    "xlsx": "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+    "zip": "application/zip",
+}
+# Colonne dell'export, nell'ordine del file: intestazione e attributo di `Member`.
+EXPORT_COLUMNS = (
+    ("ID", "id"),
+    ("Nome", "first_name"),
+    ("Cognome", "last_name"),
+    ("Email", "email"),
+    ("Data di nascita", "birth_date"),
+    ("Luogo di nascita", "birth_place"),
+    ("Residenza", "residence"),
+    ("Codice fiscale", "codice_fiscale"),
+    ("Tipo tessera", "membership_type"),
+    ("Tipo documento", "document_type"),
+    ("Numero documento", "document_number"),
+    ("Tessera sanitaria", "tessera_sanitaria"),
+    ("Certificato medico", "medical_certificate"),
+    ("Scadenza certificato", "medical_certificate_expiry"),
+    ("Stato pagamento", "payment_status"),
+    ("Iscritto il", "created_at"),
+)
+BATCH_SIZE = 1000
+CHUNK_SIZE = 64 * 1024
+FILE_CHUNK_SIZE = 1024 * 1024
+
+_FORMULA_PREFIXES = ("=", "+", "-", "@", "\t", "\r")
+
+SessionFactory = Callable[[], Session]
+
+
+def member_rows(
+    session: Session, payment_status: str | None = None, batch_size: int = BATCH_SIZE
+) -> Iterator[tuple[Any, ...]]:
+    """Righe dei soci in ordine di id, lette a blocchi di `batch_size`.
+
+    Con `yield_per` il driver restituisce le righe man mano (cursore lato
+    server dove disponibile) e nessuna entità ORM resta in memoria.
+    """
+    statement = select(*(getattr(Member, attribute) for _header, attribute in EXPORT_COLUMNS))
+    if payment_status:
+        statement = statement.where(Member.payment_status == payment_status)
+    yield from session.execute(
+        statement.order_by(Member.id).execution_options(yield_per=batch_size)
+    )
+
+
+def _text(value: Any) -> str:
+    if value is None:
+        return ""
+    if isinstance(value, datetime):
+        return value.isoformat(sep=" ", timespec="seconds")
+    if isinstance(value, date):
+        return value.isoformat()
+    text = str(value)
+    # I campi vengono dal modulo pubblico: niente formule quando il CSV si apre in Excel.
+    if text.startswith(_FORMULA_PREFIXES):
+        return "'" + text
+    return text
+
+
+def _csv_chunks(rows: Iterable[tuple[Any, ...]]) -> Iterator[str]:
+    buffer = io.StringIO()
+    # `;` e BOM: Excel in italiano apre il file con le colonne già separate.
+    writer = csv.writer(buffer, delimiter=";")
+    buffer.write("\ufeff")
+    writer.writerow([header for header, _attribute in EXPORT_COLUMNS])
+    yield buffer.getvalue()
+    buffer.seek(0)
+    buffer.truncate()
+    for row in rows:
+        writer.writerow([_text(value) for value in row])
+        if buffer.tell() >= CHUNK_SIZE:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue()
+
+
+class _ZipSink(io.RawIOBase):
+    """Destinazione non posizionabile di `ZipFile`: accumula i byte scritti
+    finché il generatore non li restituisce con `drain`."""
+
+    def __init__(self) -> None:
+        self._chunks: list[bytes] = []
+        self._size = 0
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, data: Any) -> int:
+        self._chunks.append(bytes(data))
+        self._size += len(data)
+        return len(data)
+
+    @property
+    def pending(self) -> int:
+        return self._size
+
+    def drain(self) -> Iterator[bytes]:
+        if self._chunks:
+            data = b"".join(self._chunks)
+            self._chunks.clear()
+            self._size = 0
+            yield data
+
+
+def _zip_entry(
+    archive: zipfile.ZipFile, sink: _ZipSink, name: str, chunks: Iterable[bytes], compress: bool
+) -> Iterator[bytes]:
+    info = zipfile.ZipInfo(name, date_time=datetime.now().timetuple()[:6])
+    info.compress_type = zipfile.ZIP_DEFLATED if compress else zipfile.ZIP_STORED
+    with archive.open(info, "w") as entry:
+        # L'intestazione locale esce subito, prima dei dati del file.
+        yield from sink.drain()
+        for chunk in chunks:
+            entry.write(chunk)
+            if sink.pending >= CHUNK_SIZE:
+                yield from sink.drain()
+    yield from sink.drain()
+
+
+_XLSX_STATIC = {
+    "[Content_Types].xml": (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+        '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+        '<Default Extension="xml" ContentType="application/xml"/>'
+        '<Override PartName="/xl/workbook.xml" '
+        'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>'
+        '<Override PartName="/xl/worksheets/sheet1.xml" '
+        'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>'
+        '<Override PartName="/xl/styles.xml" '
+        'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.styles+xml"/>'
+        "</Types>"
+    ),
+    "_rels/.rels": (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+        '<Relationship Id="rId1" '
+        'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument" '
+        'Target="xl/workbook.xml"/>'
+        "</Relationships>"
+    ),
+    "xl/workbook.xml": (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<workbook xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main" '
+        'xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships">'
+        '<sheets><sheet name="Soci" sheetId="1" r:id="rId1"/></sheets>'
+        "</workbook>"
+    ),
+    "xl/_rels/workbook.xml.rels": (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+        '<Relationship Id="rId1" '
+        'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/worksheet" '
+        'Target="worksheets/sheet1.xml"/>'
+        '<Relationship Id="rId2" '
+        'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/styles" '
+        'Target="styles.xml"/>'
+        "</Relationships>"
+    ),
+    # Stili: 0 normale, 1 data (formato 14), 2 data e ora (formato 22).
+    "xl/styles.xml": (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<styleSheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main">'
+        '<fonts count="1"><font><sz val="11"/><name val="Calibri"/></font></fonts>'
+        '<fills count="1"><fill><patternFill patternType="none"/></fill></fills>'
+        '<borders count="1"><border/></borders>'
+        '<cellStyleXfs count="1"><xf/></cellStyleXfs>'
+        '<cellXfs count="3"><xf xfId="0"/>'
+        '<xf numFmtId="14" xfId="0" applyNumberFormat="1"/>'
+        '<xf numFmtId="22" xfId="0" applyNumberFormat="1"/>'
+        "</cellXfs>"
+        '<cellStyles count="1"><cellStyle name="Normal" xfId="0" builtinId="0"/></cellStyles>'
+        "</styleSheet>"
+    ),
+}
+_XLSX_EPOCH = datetime(1899, 12, 30)
+# Caratteri di controllo non ammessi in XML 1.0.
+_XML_INVALID = re.compile("[\x00-\x08\x0b\x0c\x0e-\x1f]")
+
+
+_XLSX_COLUMNS = [chr(ord("A") + index) for index in range(len(EXPORT_COLUMNS))]
+
+
+def _xlsx_cell(ref: str, value: Any) -> str:
+    if value is None:
+        return ""
+    if isinstance(value, bool):
+        return f'<c r="{ref}" t="b"><v>{int(value)}</v></c>'
+    if isinstance(value, (int, float)):
+        return f'<c r="{ref}"><v>{value}</v></c>'
+    if isinstance(value, datetime):
+        serial = (value.replace(tzinfo=None) - _XLSX_EPOCH).total_seconds() / 86400
+        return f'<c r="{ref}" s="2"><v>{serial:.6f}</v></c>'
+    if isinstance(value, date):
+        return f'<c r="{ref}" s="1"><v>{(value - _XLSX_EPOCH.date()).days}</v></c>'
+    text = escape(_XML_INVALID.sub("", str(value)))
+    return f'<c r="{ref}" t="inlineStr"><is><t xml:space="preserve">{text}</t></is></c>'
+
+
+def _xlsx_row(number: int, values: Iterable[Any]) -> str:
+    cells = "".join(
+        _xlsx_cell(f"{column}{number}", value) for column, value in zip(_XLSX_COLUMNS, values)
+    )
+    return f'<row r="{number}">{cells}</row>'
+
+
+def _sheet_chunks(rows: Iterable[tuple[Any, ...]]) -> Iterator[bytes]:
+    header = _xlsx_row(1, (header for header, _attribute in EXPORT_COLUMNS))
+    yield (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<worksheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main">'
+        f"<sheetData>{header}"
+    ).encode()
+    parts: list[str] = []
+    size = 0
+    for number, row in enumerate(rows, start=2):
+        line = _xlsx_row(number, row)
+        parts.append(line)
+        size += len(line)
+        if size >= CHUNK_SIZE:
+            yield "".join(parts).encode()
+            parts.clear()
+            size = 0
+    parts.append("</sheetData></worksheet>")
+    yield "".join(parts).encode()
+
+
+def export_csv(session_factory: SessionFactory, payment_status: str | None = None) -> Iterator[bytes]:
+    """CSV dei soci a blocchi; l'intestazione esce prima di interrogare il database."""
+    with session_factory() as session:
+        for chunk in _csv_chunks(member_rows(session, payment_status)):
+            yield chunk.encode("utf-8")
+
+
+def export_xlsx(session_factory: SessionFactory, payment_status: str | None = None) -> Iterator[bytes]:
+    """Foglio Excel scritto in streaming: righe con stringhe inline, senza
+    tabella delle stringhe condivise, così niente va tenuto in memoria."""
+    sink = _ZipSink()
+    with zipfile.ZipFile(sink, "w", compression=zipfile.ZIP_DEFLATED) as archive:
+        for name, content in _XLSX_STATIC.items():
+            archive.writestr(name, content)
+        yield from sink.drain()
+        with session_factory() as session:
+            yield from _zip_entry(
+                archive,
+                sink,
+                "xl/worksheets/sheet1.xml",
+                _sheet_chunks(member_rows(session, payment_status)),
+                compress=True,
+            )
+    yield from sink.drain()
+
+
+def _safe_name(value: str) -> str:
+    return re.sub(r"[^\w.\- ]+", "_", value).strip(" .") or "file"
+
+
+def _file_chunks(path: Path) -> Iterator[bytes]:
+    with path.open("rb") as handle:
+        while chunk := handle.read(FILE_CHUNK_SIZE):
+            yield chunk
+
+
+def export_zip(
+    session_factory: SessionFactory, uploads_dir: Path, payment_status: str | None = None
+) -> Iterator[bytes]:
+    """ZIP con `soci.csv` e i documenti di ogni socio in `documenti/<id>-<cognome>/`.
+
+    I documenti sono già compressi (PDF, JPEG) e vengono salvati senza
+    ricomprimerli, letti e inviati a blocchi da 1 MiB. I file mancanti su
+    disco finiscono in `documenti_mancanti.txt`. La memoria non dipende dai
+    byte dei documenti; cresce solo della voce della directory centrale
+    (qualche centinaio di byte per file), scritta in fondo all'archivio.
+    """
+    sink = _ZipSink()
+    missing: list[str] = []
+    with zipfile.ZipFile(sink, "w") as archive:
+        with session_factory() as session:
+            yield from _zip_entry(
+                archive,
+                sink,
+                "soci.csv",
+                (chunk.encode("utf-8") for chunk in _csv_chunks(member_rows(session, payment_status))),
+                compress=True,
+            )
+            statement = (
+                select(
+                    MemberDocument.id,
+                    MemberDocument.member_id,
+                    Member.last_name,
+                    MemberDocument.original_name,
+                    MemberDocument.stored_filename,
+                )
+                .join(Member, Member.id == MemberDocument.member_id)
+                .order_by(MemberDocument.member_id, MemberDocument.id)
+            )
+            if payment_status:
+                statement = statement.where(Member.payment_status == payment_status)
+            for document_id, member_id, last_name, original_name, stored_filename in session.execute(
+                statement.execution_options(yield_per=BATCH_SIZE)
+            ):
+                path = uploads_dir / stored_filename
+                name = (
+                    f"documenti/{member_id}-{_safe_name(last_name)}/"
+                    f"{document_id}-{_safe_name(original_name)}"
+                )
+                if not path.is_file():
+                    missing.append(f"{name}\t{stored_filename}")
+                    continue
+                yield from _zip_entry(archive, sink, name, _file_chunks(path), compress=False)
+        if missing:
+            logger.warning("Export soci: %s documenti mancanti su disco", len(missing))
+            archive.writestr("documenti_mancanti.txt", "\n".join(missing) + "\n")
+    yield from sink.drain()
+
+
+def export_filename(export_format: str, today: date | None = None) -> str:
+    return f"soci-{(today or date.today()).isoformat()}.{export_format}"
+
+
+def export_members(
+    export_format: str,
+    session_factory: SessionFactory,
+    uploads_dir: Path,
+    payment_status: str | None = None,
+) -> Iterator[bytes]:
+    if export_format == "csv":
+        return export_csv(session_factory, payment_status)
+    if export_format == "xlsx":
+        return export_xlsx(session_factory, payment_status)
+    if export_format == "zip":
+        return export_zip(session_factory, uploads_dir, payment_status)
+    raise ValueError(f"Formato non valido: {export_format!r} (ammessi: {', '.join(EXPORT_FORMATS)})")
+
+
+def main(argv: list[str] | None = None) -> None:
+    from .config import settings
+    from .database import SessionLocal
+
+    parser = argparse.ArgumentParser(description="Esporta l'elenco dei soci")
+    parser.add_argument("format", choices=EXPORT_FORMATS)
+    parser.add_argument("-o", "--output", type=Path, help="default: soci-<data>.<formato>, `-` per stdout")
+    parser.add_argument("--status", help="solo i soci con questo stato di pagamento, es. paid")
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO)
+
+    uploads_dir = (Path(__file__).resolve().parent / settings.uploads_path).resolve()
+    chunks = export_members(args.format, SessionLocal, uploads_dir, args.status)
+    if args.output == Path("-"):
+        for chunk in chunks:
+            sys.stdout.buffer.write(chunk)
+        return
+    output = args.output or Path(export_filename(args.format))
+    written = 0
+    with output.open("wb") as handle:
+        for chunk in chunks:
+            handle.write(chunk)
+            written += len(chunk)
+    print(f"{output}: {written} byte")
+
+
+if __name__ == "__main__":
+    main()
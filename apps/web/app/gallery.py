@@ -0,0 +1,312 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+import time
+from dataclasses import dataclass
+from collections import OrderedDict
+from typing import TYPE_CHECKING, Any, Awaitable, Callable, Iterable
+
+from .metrics import observe_drive_call
+
+if TYPE_CHECKING:
+    import httpx
+
+logger = logging.getLogger(__name__)
+
+DRIVE_FILES_URL = "https://www.googleapis.com/drive/v3/files"
+
+MAX_PAGE_SIZE = 100
+
+DriveImage = dict[str, str]
+PageKey = tuple[str, str | None]
+
+
+@dataclass(frozen=True)
+class DrivePage:
+    images: list[DriveImage]
+    next_cursor: str | None = None
+
+
+def _image_from_file(file: dict[str, Any]) -> DriveImage | None:
+    file_id = file.get("id")
+    if not file_id:
+        return None
+    return {
+        "id": file_id,
+        "url": f"https://drive.google.com/thumbnail?id={file_id}&sz=w800",
+        "caption": file.get("name") or "Foto",
+        "web_url": file.get("webViewLink") or "",
+        "version": file.get("md5Checksum") or file.get("modifiedTime") or "",
+    }
+
+
+def _page_params(
+    folder_id: str, api_key: str, cursor: str | None, page_size: int
+) -> dict[str, Any]:
+    params: dict[str, Any] = {
+        "q": f"'{folder_id}' in parents and trashed=false and mimeType contains 'image/'",
+        "orderBy": "createdTime desc",
+        "fields": "nextPageToken,files(id,name,description,webViewLink,modifiedTime,md5Checksum)",
+        "pageSize": max(1, min(page_size, MAX_PAGE_SIZE)),
+        "includeItemsFromAllDrives": True,
+        "supportsAllDrives": True,
+        "key": api_key,
+    }
+    if cursor:
+        params["pageToken"] = cursor
+    return params
+
+
+def _page_from_payload(payload: dict[str, Any], page_size: int) -> DrivePage:
+    images: list[DriveImage] = []
+    for file in payload.get("files", []):
+        image = _image_from_file(file)
+        if image is None:
+            continue
+        images.append(image)
+        if len(images) >= page_size:
+            break
+    return DrivePage(images=images, next_cursor=payload.get("nextPageToken") or None)
+
+
+def list_drive_page(
+    folder_id: str,
+    api_key: str,
+    cursor: str | None = None,
+    page_size: int = 18,
+    api_url: str = DRIVE_FILES_URL,
+    timeout: float = 6,
+) -> DrivePage:
+    """Legge una pagina della cartella Drive; solleva in caso di errore.
+
+    `cursor` è il `nextPageToken` restituito dalla pagina precedente.
+    """
+    import requests
+
+    params = _page_params(folder_id, api_key, cursor, page_size)
+    with observe_drive_call("list"):
+        response = requests.get(api_url, params=params, timeout=timeout)
+        response.raise_for_status()
+    return _page_from_payload(response.json(), page_size)
+
+
+class DriveClient:
+    """Client asincrono per l'elenco dei file Drive, con connessioni riusate.
+
+    Al più `max_connections` richieste verso Drive sono in volo; le altre
+    attendono una connessione libera senza occupare thread. Il client HTTP
+    viene creato al primo uso, nell'event loop che lo userà.
+    """
+
+    def __init__(
+        self,
+        api_key: str,
+        api_url: str = DRIVE_FILES_URL,
+        page_size: int = 18,
+        timeout: float = 6,
+        max_connections: int = 20,
+    ) -> None:
+        self.api_key = api_key
+        self.api_url = api_url
+        self.page_size = page_size
+        self.timeout = timeout
+        self.max_connections = max_connections
+        self._client: httpx.AsyncClient | None = None
+
+    def _http(self) -> httpx.AsyncClient:
+        if self._client is None:
+            import httpx
+
+            self._client = httpx.AsyncClient(
+                timeout=self.timeout,
+                limits=httpx.Limits(
+                    max_connections=self.max_connections,
+                    max_keepalive_connections=self.max_connections,
+                ),
+            )
+        return self._client
+
+    async def list_page(self, folder_id: str, cursor: str | None = None) -> DrivePage:
+        params = _page_params(folder_id, self.api_key, cursor, self.page_size)
+        with observe_drive_call("list"):
+            response = await self._http().get(self.api_url, params=params)
+            response.raise_for_status()
+        return _page_from_payload(response.json(), self.page_size)
+
+    async def aclose(self) -> None:
+        client, self._client = self._client, None
+        if client is not None:
+            await client.aclose()
+
+
+class GalleryUnavailable(Exception):
+    """Drive non ha risposto in tempo per una pagina che non è in cache."""
+
+
+@dataclass
+class _CacheEntry:
+    page: DrivePage
+    fetched_at: float
+    ttl: float
+
+    def is_fresh(self, now: float) -> bool:
+        return now - self.fetched_at < self.ttl
+
+
+@dataclass
+class GalleryCacheStats:
+    hits: int = 0
+    stale_hits: int = 0
+    misses: int = 0
+    refreshes: int = 0
+    errors: int = 0
+    evictions: int = 0
+
+
+class GalleryCache:
+    """Cache delle pagine Drive, per cartella e cursore, con stale-while-revalidate.
+
+    Una pagina fresca viene servita direttamente; una pagina scaduta viene
+    servita comunque mentre un task in background la aggiorna. Solo al primo
+    accesso (cache vuota) la richiesta attende, al massimo `cold_wait` secondi,
+    il fetch concorrente delle cartelle mancanti. Se Drive fallisce su una
+    pagina mai letta non viene salvato nulla: la pagina manca dal risultato e
+    il fetch si riprova dopo `error_ttl`. Le pagine meno usate vengono
+    scartate oltre `max_entries`. Va usata da un solo event loop.
+    """
+
+    def __init__(
+        self,
+        fetcher: Callable[[str, str | None], Awaitable[DrivePage]],
+        default_ttl: float = 300,
+        error_ttl: float = 30,
+        cold_wait: float = 2.0,
+        max_entries: int = 512,
+        clock: Callable[[], float] = time.monotonic,
+    ) -> None:
+        self._fetcher = fetcher
+        self.default_ttl = default_ttl
+        self.error_ttl = error_ttl
+        self.cold_wait = cold_wait
+        self.max_entries = max_entries
+        self._clock = clock
+        self._entries: OrderedDict[PageKey, _CacheEntry] = OrderedDict()
+        self._inflight: dict[PageKey, asyncio.Task[DrivePage]] = {}
+        # Il cursore arriva dal client: anche questa mappa è limitata a max_entries.
+        self._retry_after: OrderedDict[PageKey, float] = OrderedDict()
+        self.stats = GalleryCacheStats()
+
+    def _store(self, key: PageKey, entry: _CacheEntry) -> None:
+        self._entries[key] = entry
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.stats.evictions += 1
+
+    async def _fetch(self, key: PageKey, ttl: float) -> DrivePage:
+        try:
+            page = await self._fetcher(*key)
+        except Exception as exc:
+            logger.warning("Google Drive non raggiungibile (%s): %s", key[0], exc)
+            self.stats.errors += 1
+            entry = self._entries.get(key)
+            if entry is None:
+                # Niente pagina vuota in cache: per il client sarebbe la fine
+                # dell'album e il resto dell'archivio diventerebbe irraggiungibile.
+                self._retry_after[key] = self._clock() + self.error_ttl
+                self._retry_after.move_to_end(key)
+                while len(self._retry_after) > self.max_entries:
+                    self._retry_after.popitem(last=False)
+                raise GalleryUnavailable(key[0]) from exc
+            # Tiene la copia stale ma riprova dopo error_ttl.
+            entry.fetched_at = self._clock() - entry.ttl + self.error_ttl
+            return entry.page
+        self._retry_after.pop(key, None)
+        self.stats.refreshes += 1
+        self._store(key, _CacheEntry(page, self._clock(), ttl))
+        return page
+
+    def _schedule(self, key: PageKey, ttl: float) -> asyncio.Task[DrivePage]:
+        task = self._inflight.get(key)
+        if task is None:
+            task = asyncio.get_running_loop().create_task(self._fetch(key, ttl))
+            self._inflight[key] = task
+            task.add_done_callback(lambda _t: self._clear_inflight(key, _t))
+        return task
+
+    def _clear_inflight(self, key: PageKey, task: asyncio.Task[DrivePage]) -> None:
+        if self._inflight.get(key) is task:
+            del self._inflight[key]
+        if not task.cancelled():
+            # Segna l'errore come letto anche per i prefetch che nessuno attende.
+            task.exception()
+
+    async def get_pages(
+        self, keys: Iterable[tuple[PageKey, float | None]], timeout: float | None = None
+    ) -> dict[PageKey, DrivePage]:
+        now = self._clock()
+        result: dict[PageKey, DrivePage] = {}
+        pending: dict[PageKey, asyncio.Task[DrivePage]] = {}
+        for key, ttl in keys:
+            ttl = ttl or self.default_ttl
+            entry = self._entries.get(key)
+            if entry is None:
+                self.stats.misses += 1
+                retry_at = self._retry_after.get(key)
+                if retry_at is None or retry_at <= now:
+                    self._retry_after.pop(key, None)
+                    pending[key] = self._schedule(key, ttl)
+                continue
+            self._entries.move_to_end(key)
+            if entry.is_fresh(now):
+                self.stats.hits += 1
+            else:
+                self.stats.stale_hits += 1
+                self._schedule(key, ttl)
+            result[key] = entry.page
+        if pending:
+            # asyncio.wait non cancella i task: le pagine che scadono mancano
+            # dal risultato, ma il fetch prosegue e riempie la cache.
+            await asyncio.wait(
+                pending.values(), timeout=self.cold_wait if timeout is None else timeout
+            )
+            for key, task in pending.items():
+                if task.done() and not task.cancelled() and task.exception() is None:
+                    result[key] = task.result()
+        return result
+
+    async def get_many(
+        self, folders: Iterable[tuple[str, float | None]]
+    ) -> dict[str, DrivePage]:
+        """Prime pagine delle cartelle; quelle non disponibili mancano dal risultato."""
+        pages = await self.get_pages(((folder_id, None), ttl) for folder_id, ttl in folders)
+        return {folder_id: page for (folder_id, _cursor), page in pages.items()}
+
+    async def get_page(
+        self,
+        folder_id: str,
+        cursor: str | None = None,
+        ttl: float | None = None,
+        timeout: float | None = None,
+    ) -> DrivePage:
+        """Solleva `GalleryUnavailable` se la pagina non è in cache e Drive
+        non risponde entro `timeout`."""
+        key = (folder_id, cursor or None)
+        page = (await self.get_pages([(key, ttl)], timeout=timeout)).get(key)
+        if page is None:
+            raise GalleryUnavailable(folder_id)
+        return page
+
+    def prefetch(self, folders: Iterable[tuple[str, float | None]]) -> None:
+        for folder_id, ttl in folders:
+            self._schedule((folder_id, None), ttl or self.default_ttl)
+
+    def clear(self) -> None:
+        self._entries.clear()
+        self._retry_after.clear()
+
+    def close(self) -> None:
+        for task in list(self._inflight.values()):
+            task.cancel()
+        self._inflight.clear()
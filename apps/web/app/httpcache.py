@@ -0,0 +1,141 @@
+from __future__ import annotations
+
+from datetime import datetime, timezone
+from email.utils import format_datetime, parsedate_to_datetime
+from pathlib import Path
+from typing import AsyncIterator
+from urllib.parse import quote
+
+import anyio
+from fastapi import HTTPException, Request, status
+from starlette.responses import FileResponse, Response, StreamingResponse
+
+RANGE_CHUNK_SIZE = 64 * 1024
+
+
+def http_date(value: datetime) -> str:
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return format_datetime(value.astimezone(timezone.utc), usegmt=True)
+
+
+def _parse_http_date(value: str | None) -> datetime | None:
+    if not value:
+        return None
+    try:
+        parsed = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return parsed if parsed.tzinfo else parsed.replace(tzinfo=timezone.utc)
+
+
+def etag_matches(header: str | None, etag: str) -> bool:
+    if not header:
+        return False
+    if header.strip() == "*":
+        return True
+    bare = etag.removeprefix("W/")
+    return any(tag.strip().removeprefix("W/") == bare for tag in header.split(","))
+
+
+def is_not_modified(request: Request, etag: str | None, last_modified: datetime | None) -> bool:
+    """Valuta `If-None-Match` (che ha la precedenza) e `If-Modified-Since`."""
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None:
+        return etag is not None and etag_matches(if_none_match, etag)
+    since = _parse_http_date(request.headers.get("if-modified-since"))
+    if since is None or last_modified is None:
+        return False
+    if last_modified.tzinfo is None:
+        last_modified = last_modified.replace(tzinfo=timezone.utc)
+    return last_modified.replace(microsecond=0) <= since
+
+
+def not_modified_response(headers: dict[str, str]) -> Response:
+    return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+
+
+def parse_range(
+    request: Request, size: int, etag: str | None, last_modified: datetime | None
+) -> tuple[int, int] | None:
+    """Restituisce l'intervallo (inclusivo) richiesto da `Range`, se applicabile.
+
+    Si gestisce un solo intervallo `bytes=`; richieste multi-range o con
+    `If-Range` non più valido ricevono il file intero.
+    """
+    header = request.headers.get("range")
+    if not header:
+        return None
+    if_range = request.headers.get("if-range")
+    if if_range:
+        if if_range.strip().startswith(("W/", '"')):
+            if etag is None or etag.startswith("W/") or if_range.strip() != etag:
+                return None
+        elif last_modified is None or http_date(last_modified) != if_range.strip():
+            return None
+    unit, _, spec = header.partition("=")
+    if unit.strip().lower() != "bytes" or "," in spec:
+        return None
+    first, _, last = spec.strip().partition("-")
+    try:
+        if first:
+            start = int(first)
+            end = int(last) if last else size - 1
+        else:
+            suffix = int(last)
+            if suffix <= 0:
+                raise ValueError
+            start, end = max(size - suffix, 0), size - 1
+    except ValueError:
+        return None
+    if start >= size or start > end:
+        raise HTTPException(
+            status_code=status.HTTP_416_REQUESTED_RANGE_NOT_SATISFIABLE,
+            detail="Intervallo non valido",
+            headers={"Content-Range": f"bytes */{size}"},
+        )
+    return start, min(end, size - 1)
+
+
+def attachment_header(filename: str) -> str:
+    quoted = quote(filename)
+    if quoted != filename:
+        return f"attachment; filename*=utf-8''{quoted}"
+    return f'attachment; filename="{filename}"'
+
+
+async def _iter_file_range(path: Path, start: int, end: int) -> AsyncIterator[bytes]:
+    remaining = end - start + 1
+    async with await anyio.open_file(path, "rb") as handle:
+        await handle.seek(start)
+        while remaining > 0:
+            chunk = await handle.read(min(RANGE_CHUNK_SIZE, remaining))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            yield chunk
+
+
+def file_response(
+    request: Request,
+    path: Path,
+    size: int,
+    media_type: str,
+    headers: dict[str, str],
+    etag: str | None,
+    last_modified: datetime | None,
+) -> Response:
+    """`FileResponse` con supporto a una singola `Range` (206)."""
+    headers = {**headers, "Accept-Ranges": "bytes"}
+    byte_range = parse_range(request, size, etag, last_modified)
+    if byte_range is None:
+        return FileResponse(path, media_type=media_type, headers=headers)
+    start, end = byte_range
+    headers["Content-Range"] = f"bytes {start}-{end}/{size}"
+    headers["Content-Length"] = str(end - start + 1)
+    return StreamingResponse(
+        _iter_file_range(path, start, end),
+        status_code=status.HTTP_206_PARTIAL_CONTENT,
+        media_type=media_type,
+        headers=headers,
+    )
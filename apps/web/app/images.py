@@ -0,0 +1,268 @@
+from __future__ import annotations
+
+import hashlib
+import json
+import logging
+import os
+import threading
+from pathlib import Path
+from typing import Any, Iterable
+
+from jinja2 import Environment, pass_context
+from jinja2.runtime import Context
+from markupsafe import Markup, escape
+
+from .assets import build_lock, content_digest, unique_tmp_path
+
+try:
+    from PIL import Image
+except ImportError:  # pragma: no cover - Pillow è opzionale in sviluppo
+    Image = None
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_WIDTHS: tuple[int, ...] = (320, 640, 960, 1280)
+RASTER_SUFFIXES = {".jpg", ".jpeg", ".png"}
+FORMATS: dict[str, dict[str, Any]] = {
+    "webp": {"save": {"format": "WEBP", "quality": 78, "method": 5}},
+    "jpg": {"save": {"format": "JPEG", "quality": 80, "optimize": True, "progressive": True}},
+}
+MANIFEST_FILENAME = "manifest.json"
+
+
+def _file_sha256(path: Path) -> str:
+    digest = hashlib.sha256()
+    with path.open("rb") as handle:
+        for chunk in iter(lambda: handle.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class ImagePipeline:
+    """Genera varianti ridimensionate (WebP/JPEG) delle immagini statiche.
+
+    Le varianti finiscono in `static/<output_prefix>/` con l'hash della
+    sorgente nel nome; `manifest.json` registra mtime, dimensione e hash della
+    sorgente, così una modifica al file originale rigenera le varianti.
+
+    Come per `AssetManifest`, la build tiene un lock su file (ogni worker la
+    lancia all'avvio), scrive ogni file su un nome temporaneo e lo rinomina,
+    e le varianti sostituite restano in `previous` fino alla build successiva
+    che cambia qualcosa: le pagine in cache che le usano continuano a
+    funzionare per una release.
+    """
+
+    def __init__(
+        self,
+        static_dir: Path,
+        output_prefix: str = "img/derived",
+        widths: Iterable[int] = DEFAULT_WIDTHS,
+    ) -> None:
+        self.static_dir = static_dir
+        self.output_prefix = output_prefix.strip("/")
+        self.output_dir = static_dir / self.output_prefix
+        self.widths = tuple(sorted(set(widths)))
+        self._lock = threading.Lock()
+        self._build_lock = threading.Lock()
+        self._manifest: dict[str, dict[str, Any]] = {}
+        # Hash di ciò che finisce nell'HTML (varianti e dimensioni, non mtime):
+        # entra nella chiave delle pagine in cache, uguale su tutti i worker.
+        self.digest = content_digest({})
+        self.previous: list[str] = []
+        self._superseded: list[str] = []
+        self._load_manifest()
+
+    @property
+    def available(self) -> bool:
+        return Image is not None
+
+    def _load_manifest(self) -> None:
+        try:
+            data = json.loads((self.output_dir / MANIFEST_FILENAME).read_text(encoding="utf-8"))
+        except (OSError, ValueError):
+            return
+        if not isinstance(data, dict):
+            return
+        if "sources" not in data:
+            # Formato precedente: solo la mappa delle sorgenti.
+            data = {"sources": data}
+        with self._lock:
+            self._manifest = dict(data["sources"])
+            self.previous = list(data.get("previous", []))
+        self._update_digest()
+
+    def _update_digest(self) -> None:
+        with self._lock:
+            rendered = {
+                source: {key: entry.get(key) for key in ("width", "height", "variants")}
+                for source, entry in self._manifest.items()
+            }
+        self.digest = content_digest(rendered)
+
+    def _save_manifest(self) -> None:
+        self.output_dir.mkdir(parents=True, exist_ok=True)
+        target = self.output_dir / MANIFEST_FILENAME
+        tmp_path = unique_tmp_path(target)
+        with self._lock:
+            payload = json.dumps(
+                {"sources": self._manifest, "previous": self.previous}, sort_keys=True, indent=1
+            )
+        tmp_path.write_text(payload, encoding="utf-8")
+        os.replace(tmp_path, target)
+
+    def variants(self, source: str) -> dict[str, Any] | None:
+        with self._lock:
+            return self._manifest.get(source)
+
+    def discover(self, prefix: str = "img") -> list[str]:
+        root = self.static_dir / prefix
+        sources: list[str] = []
+        for path in sorted(root.rglob("*")):
+            if path.suffix.lower() not in RASTER_SUFFIXES:
+                continue
+            if self.output_dir in path.parents:
+                continue
+            sources.append(path.relative_to(self.static_dir).as_posix())
+        return sources
+
+    def ensure(self, source: str) -> bool:
+        """Rigenera le varianti di `source` se la sorgente è cambiata."""
+        path = self.static_dir / source
+        stat = path.stat()
+        with self._lock:
+            entry = self._manifest.get(source)
+        if entry and entry["mtime"] == stat.st_mtime and entry["size"] == stat.st_size:
+            return False
+        sha256 = _file_sha256(path)
+        if entry and entry["sha256"] == sha256:
+            with self._lock:
+                entry.update(mtime=stat.st_mtime, size=stat.st_size)
+            return False
+
+        new_entry = self._render(source, path, sha256)
+        new_entry.update(mtime=stat.st_mtime, size=stat.st_size)
+        with self._lock:
+            self._manifest[source] = new_entry
+        if entry:
+            kept = self._outputs(new_entry)
+            self._superseded.extend(rel for rel in self._outputs(entry) if rel not in kept)
+        return True
+
+    def _render(self, source: str, path: Path, sha256: str) -> dict[str, Any]:
+        stem = Path(source).with_suffix("").as_posix().replace("/", "-")
+        target_dir = self.output_dir / sha256[:2]
+        target_dir.mkdir(parents=True, exist_ok=True)
+        outputs: dict[str, list[list[Any]]] = {fmt: [] for fmt in FORMATS}
+        with Image.open(path) as original:
+            original.load()
+            width, height = original.size
+            widths = [w for w in self.widths if w < width] + [width]
+            for target_width in widths:
+                target_height = max(1, round(height * target_width / width))
+                resized = (
+                    original
+                    if target_width == width
+                    else original.resize((target_width, target_height), Image.LANCZOS)
+                )
+                if resized.mode not in ("RGB", "RGBA"):
+                    resized = resized.convert("RGBA")
+                for fmt, options in FORMATS.items():
+                    name = f"{stem}-{sha256[:10]}-{target_width}.{fmt}"
+                    image = resized
+                    if fmt == "jpg" and image.mode == "RGBA":
+                        # Il JPEG non ha trasparenza: appiattisce su bianco.
+                        image = Image.new("RGB", resized.size, (255, 255, 255))
+                        image.paste(resized, mask=resized.getchannel("A"))
+                    tmp_path = unique_tmp_path(target_dir / name)
+                    image.save(tmp_path, **options["save"])
+                    os.replace(tmp_path, target_dir / name)
+                    outputs[fmt].append([target_width, f"{self.output_prefix}/{sha256[:2]}/{name}"])
+        return {"sha256": sha256, "width": width, "height": height, "variants": outputs}
+
+    @staticmethod
+    def _outputs(entry: dict[str, Any]) -> set[str]:
+        return {rel for items in entry.get("variants", {}).values() for _w, rel in items}
+
+    def _prune_previous(self) -> None:
+        # Le varianti della release prima di quella appena sostituita.
+        with self._lock:
+            current = set().union(*map(self._outputs, self._manifest.values()))
+        for relative in self.previous:
+            if relative not in current:
+                (self.static_dir / relative).unlink(missing_ok=True)
+
+    def build(self, sources: Iterable[str] | None = None) -> int:
+        if not self.available:
+            logger.warning("Pillow non installato: varianti immagini non generate")
+            return 0
+        changed = 0
+        with self._build_lock, build_lock(self.output_dir):
+            # Un altro worker può aver appena finito la build: si parte dal suo manifest.
+            self._load_manifest()
+            self._superseded = []
+            for source in sources if sources is not None else self.discover():
+                try:
+                    changed += self.ensure(source)
+                except Exception as exc:
+                    logger.warning("Varianti non generate per %s: %s", source, exc)
+            if self._superseded:
+                self._prune_previous()
+                self.previous = sorted(set(self._superseded))
+            self._save_manifest()
+        self._update_digest()
+        return changed
+
+    def build_in_background(self, sources: Iterable[str] | None = None) -> threading.Thread:
+        thread = threading.Thread(
+            target=self.build, args=(sources,), name="image-pipeline", daemon=True
+        )
+        thread.start()
+        return thread
+
+
+def register_image_helpers(env: Environment, pipeline: ImagePipeline) -> None:
+    @pass_context
+    def responsive_image(
+        context: Context,
+        source: str,
+        alt: str = "",
+        sizes: str = "100vw",
+        css_class: str | None = None,
+        loading: str = "lazy",
+    ) -> Markup:
+        url_for = context["url_for"]
+
+        def static_url(path: str) -> str:
+            return str(url_for(context, "static", path=path))
+
+        attrs = f'alt="{escape(alt)}" loading="{escape(loading)}" decoding="async"'
+        if css_class:
+            attrs += f' class="{escape(css_class)}"'
+        entry = pipeline.variants(source)
+        if not entry:
+            return Markup(f'<img src="{escape(static_url(source))}" {attrs} />')
+
+        def srcset(fmt: str) -> str:
+            return ", ".join(f"{static_url(rel)} {width}w" for width, rel in entry["variants"][fmt])
+
+        fallback = entry["variants"]["jpg"][-1][1]
+        return Markup(
+            "<picture>"
+            f'<source type="image/webp" srcset="{escape(srcset("webp"))}" sizes="{escape(sizes)}" />'
+            f'<img src="{escape(static_url(fallback))}" srcset="{escape(srcset("jpg"))}" '
+            f'sizes="{escape(sizes)}" width="{entry["width"]}" height="{entry["height"]}" {attrs} />'
+            "</picture>"
+        )
+
+    env.globals["responsive_image"] = responsive_image
+
+
+if __name__ == "__main__":
+    from .config import settings
+
+    static_root = Path(settings.static_path)
+    if not static_root.is_absolute():
+        static_root = Path(__file__).resolve().parent / static_root
+    logging.basicConfig(level=logging.INFO)
+    count = ImagePipeline(static_root).build()
+    print(f"Varianti rigenerate per {count} immagini")
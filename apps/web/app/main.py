@@ -1,42 +1,76 @@
 from __future__ import annotations
 
 import logging
-import shutil
 import hashlib
 import secrets
+import threading
+from dataclasses import asdict
+from functools import lru_cache
 from datetime import date, datetime
 from pathlib import Path
-from typing import Sequence
-from uuid import uuid4
+from typing import Hashable, Mapping, Sequence
 
-from fastapi import Depends, FastAPI, File, Form, HTTPException, Request, UploadFile, status
-from fastapi.responses import FileResponse, HTMLResponse, RedirectResponse, Response
-from fastapi.staticfiles import StaticFiles
+from fastapi import Depends, FastAPI, Form, HTTPException, Request, status
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import HTMLResponse, JSONResponse, RedirectResponse, Response, StreamingResponse
 from fastapi.templating import Jinja2Templates
-import requests
-from sqlalchemy import inspect, text
-from sqlalchemy.orm import Session
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session, selectinload
+from starlette.datastructures import URL
 from starlette.middleware.sessions import SessionMiddleware
 
+from .assets import AssetManifest, AssetStaticFiles, install_asset_url_for
+from .bootstrap import prepare_database
+from .catalog import CatalogCache, CatalogSnapshot
 from .config import settings
-from .database import Base, SessionLocal, engine, get_session
-from .models import Event, Member, MerchItem, MemberDocument
+from .database import SessionLocal, async_engine, engine, get_async_session, get_session
+from .export import EXPORT_FORMATS, MEDIA_TYPES, export_filename, export_members
+from .httpcache import attachment_header, file_response, http_date, is_not_modified, not_modified_response
+from .gallery import (
+    MAX_PAGE_SIZE,
+    DriveClient,
+    DriveImage,
+    GalleryCache,
+    GalleryUnavailable,
+    list_drive_page,
+)
+from .images import ImagePipeline, register_image_helpers
+from .metrics import CONTENT_TYPE as METRICS_CONTENT_TYPE, MetricsMiddleware, instrument_queries, registry
+from .models import Member, MemberDocument, Payment
 from .nexi import NexiPaymentContext, NexiXpayClient
-from .seed import seed_sample_data
+from .orders import OutOfStock, ReservationSweeper, reserve as reserve_order
+from .pagecache import PageCache, page_etag, template_fingerprint
+from .profiling import ProfileStore, ProfilingMiddleware
+from .seed import CatalogFileWatcher
+from .payments import (
+    AMOUNT_MISMATCH,
+    UNKNOWN,
+    apply_outcome,
+    create_payment,
+    find_payment,
+    find_pending_payment,
+)
+from .sessions import ServerSessionMiddleware, SessionSweeper, create_session_store
+from .storage import BlobStore
+from .thumbnails import ThumbnailMirror, ThumbnailSyncJob
+from .uploads import StreamedUpload, UploadError, UploadTooLarge, stream_multipart
 
 GALLERY_IMAGES: list[dict[str, str]] = [
 ]
 
-DRIVE_COLLECTIONS: list[dict[str, str | None]] = [
+DRIVE_COLLECTIONS: list[dict[str, object]] = [
     {
         "title": "Eventi su Drive",
         "description": "Foto degli eventi.",
         "folder_id": settings.drive_events_folder_id,
+        "ttl": settings.drive_cache_ttl,
     },
     {
         "title": "Galleria generale",
         "description": "",
         "folder_id": settings.drive_gallery_folder_id,
+        "ttl": settings.drive_gallery_cache_ttl,
     },
 ]
 
@@ -46,6 +80,11 @@ MEMBERSHIP_TYPES = [
     "Sostenitore",
 ]
 
+# Le pagine pubbliche si rivalidano a ogni visita (ETag/Last-Modified); quelle
+# con un socio in sessione non vanno mai in cache, né nel browser né nei proxy.
+PUBLIC_PAGE_HEADERS = {"Cache-Control": "public, no-cache", "Vary": "Cookie"}
+PRIVATE_PAGE_HEADERS = {"Cache-Control": "private, no-store", "Vary": "Cookie"}
+
 BASE_DIR = Path(__file__).resolve().parent
 static_dir = Path(settings.static_path)
 if not static_dir.is_absolute():
@@ -53,40 +92,147 @@ if not static_dir.is_absolute():
 
 templates_dir = BASE_DIR / "templates"
 
+asset_manifest = AssetManifest(static_dir)
+
 app = FastAPI(title=settings.app_name)
-app.mount("/static", StaticFiles(directory=static_dir), name="static")
+app.mount(
+    "/static",
+    AssetStaticFiles(directory=static_dir, manifest=asset_manifest),
+    name="static",
+)
 templates = Jinja2Templates(directory=templates_dir)
+templates_fingerprint = template_fingerprint(templates_dir)
 templates.env.globals["current_year"] = datetime.utcnow().year
+install_asset_url_for(templates.env, asset_manifest)
+image_pipeline = ImagePipeline(static_dir)
+register_image_helpers(templates.env, image_pipeline)
 logger = logging.getLogger(__name__)
-app.add_middleware(SessionMiddleware, secret_key=settings.session_secret, session_cookie="amaro_session")
+session_store = create_session_store(
+    settings.session_backend, SessionLocal, settings.session_memory_max_entries
+)
+if session_store is None:
+    app.add_middleware(
+        SessionMiddleware,
+        secret_key=settings.session_secret,
+        session_cookie="amaro_session",
+        max_age=settings.session_max_age,
+    )
+else:
+    app.add_middleware(
+        ServerSessionMiddleware,
+        store=session_store,
+        session_cookie="amaro_session",
+        max_age=settings.session_max_age,
+        # Gli asset non usano la sessione: niente SELECT su web_sessions per ogni file.
+        exclude_paths=("/static/",),
+    )
+if settings.profiling_secret or settings.profiling_sample_rate > 0:
+    app.add_middleware(
+        ProfilingMiddleware,
+        store=ProfileStore(
+            (BASE_DIR / settings.profiling_path).resolve(), settings.profiling_max_bytes
+        ),
+        secret=settings.profiling_secret,
+        sample_rate=settings.profiling_sample_rate,
+    )
+# Aggiunto per ultimo, quindi il più esterno: misura anche il caricamento della sessione.
+app.add_middleware(MetricsMiddleware, query_budget=settings.query_budget)
+instrument_queries()
 
 UPLOADS_DIR = (BASE_DIR / settings.uploads_path).resolve()
 UPLOADS_DIR.mkdir(parents=True, exist_ok=True)
-
-try:
-    nexi_client = NexiXpayClient.from_settings(settings)
-except ValueError as exc:
-    logger.warning("Nexi/XPay client unavailable: %s", exc)
-    nexi_client = None
+blob_store = BlobStore(UPLOADS_DIR)
+catalog_cache = CatalogCache(SessionLocal, check_interval=settings.catalog_cache_check_interval)
+CATALOG_PATH = (BASE_DIR / settings.catalog_path).resolve()
+catalog_watcher = CatalogFileWatcher(
+    CATALOG_PATH,
+    SessionLocal,
+    interval=settings.catalog_reload_interval,
+    on_reload=catalog_cache.invalidate,
+)
+page_cache = PageCache(settings.page_cache_max_bytes)
+reservation_sweeper = ReservationSweeper(
+    SessionLocal, interval=settings.merch_reservation_sweep_interval
+)
+session_sweeper = (
+    SessionSweeper(session_store, interval=settings.session_gc_interval) if session_store else None
+)
+
+drive_client = DriveClient(
+    settings.google_drive_api_key or "",
+    api_url=settings.drive_api_url,
+    page_size=settings.drive_page_size,
+    max_connections=settings.drive_max_connections,
+)
+gallery_cache = GalleryCache(
+    drive_client.list_page,
+    default_ttl=settings.drive_cache_ttl,
+    cold_wait=settings.drive_cache_cold_wait,
+)
+thumbnail_mirror = ThumbnailMirror(
+    static_dir / "gallery-cache", thumbnail_url=settings.drive_thumbnail_url
+)
+thumbnail_sync = ThumbnailSyncJob(
+    thumbnail_mirror,
+    lambda: [folder_id for folder_id, _ttl in _drive_folders()],
+    lambda folder_id, cursor: list_drive_page(
+        folder_id,
+        settings.google_drive_api_key,
+        cursor=cursor,
+        page_size=MAX_PAGE_SIZE,
+        api_url=settings.drive_api_url,
+    ),
+    interval=settings.drive_thumbnail_sync_interval,
+)
 
 
 @app.on_event("startup")
-def on_startup() -> None:
-    Base.metadata.create_all(bind=engine)
-    ensure_member_schema()
-    ensure_merch_schema()
-    session = SessionLocal()
-    try:
-        seed_sample_data(session)
-    finally:
-        session.close()
+async def on_startup() -> None:
+    prepare_database(engine, SessionLocal, CATALOG_PATH)
+    catalog_watcher.mark_loaded()
+    if settings.catalog_reload_interval > 0:
+        catalog_watcher.start()
+    asset_manifest.build(compress=False)
+    threading.Thread(target=asset_manifest.compress, name="asset-compress", daemon=True).start()
+    image_pipeline.build_in_background()
+    if settings.merch_reservation_sweep_interval > 0:
+        reservation_sweeper.start()
+    if session_sweeper and settings.session_gc_interval > 0:
+        session_sweeper.start()
+    if settings.google_drive_api_key:
+        gallery_cache.prefetch(_drive_folders())
+        if settings.drive_thumbnail_sync_interval > 0:
+            thumbnail_sync.start()
+
+
+@app.on_event("shutdown")
+async def on_shutdown() -> None:
+    reservation_sweeper.stop()
+    catalog_watcher.stop()
+    if session_sweeper:
+        session_sweeper.stop()
+    thumbnail_sync.stop()
+    gallery_cache.close()
+    await drive_client.aclose()
+    await async_engine.dispose()
 
 
 def format_price(cents: int) -> str:
     return f"{cents / 100:.2f}"
 
 
+@lru_cache(maxsize=1)
+def _nexi_client() -> NexiXpayClient | None:
+    # Creato al primo pagamento e non all'import, per non rallentare l'avvio.
+    try:
+        return NexiXpayClient.from_settings(settings)
+    except ValueError as exc:
+        logger.warning("Nexi/XPay client unavailable: %s", exc)
+        return None
+
+
 def _require_nexi_client() -> NexiXpayClient:
+    nexi_client = _nexi_client()
     if not nexi_client:
         raise HTTPException(
             status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
@@ -96,7 +242,7 @@ def _require_nexi_client() -> NexiXpayClient:
 
 
 def _save_uploaded_documents(
-    member_id: int, uploads: Sequence[UploadFile] | None
+    session: Session, member_id: int, uploads: Sequence[StreamedUpload] | None
 ) -> list[MemberDocument]:
     saved: list[MemberDocument] = []
     if not uploads:
@@ -104,17 +250,13 @@ def _save_uploaded_documents(
     for upload in uploads:
         if not upload.filename:
             continue
-        stored_filename = f"{member_id}_{uuid4().hex}_{Path(upload.filename).name}"
-        destination = UPLOADS_DIR / stored_filename
-        upload.file.seek(0)
-        with destination.open("wb") as out:
-            shutil.copyfileobj(upload.file, out)
-        upload.file.close()
+        stored_filename = blob_store.put(session, upload.temp_path, upload.sha256, upload.size)
         saved.append(
             MemberDocument(
                 member_id=member_id,
-                original_name=Path(upload.filename).name,
+                original_name=upload.filename,
                 stored_filename=stored_filename,
+                blob_sha256=upload.sha256,
                 content_type=upload.content_type,
             )
         )
@@ -125,77 +267,27 @@ def _normalize(value: str | None) -> str | None:
     return value.strip() if value else None
 
 
-def fetch_drive_images(folder_id: str | None, api_key: str | None, limit: int = 18) -> list[dict[str, str]]:
-    if not folder_id or not api_key:
-        return []
+def _drive_folders() -> list[tuple[str, float | None]]:
+    folders: list[tuple[str, float | None]] = []
+    for collection in DRIVE_COLLECTIONS:
+        folder_id = collection.get("folder_id")
+        if isinstance(folder_id, str) and folder_id:
+            ttl = collection.get("ttl")
+            folders.append((folder_id, float(ttl) if isinstance(ttl, (int, float)) else None))
+    return folders
 
-    params = {
-        "q": f"'{folder_id}' in parents and trashed=false and mimeType contains 'image/'",
-        "orderBy": "createdTime desc",
-        "fields": "files(id,name,description,webViewLink)",
-        "pageSize": limit,
-        "includeItemsFromAllDrives": True,
-        "supportsAllDrives": True,
-        "key": api_key,
-    }
-    try:
-        response = requests.get(
-            "https://www.googleapis.com/drive/v3/files", params=params, timeout=6
-        )
-        response.raise_for_status()
-    except Exception as exc:  # pragma: no cover - best-effort integration
-        logger.warning("Google Drive non raggiungibile: %s", exc)
-        return []
-
-    payload = response.json()
-    images: list[dict[str, str]] = []
-    for file in payload.get("files", []):
-        file_id = file.get("id")
-        if not file_id:
-            continue
-        images.append(
-            {
-                "url": f"https://drive.google.com/thumbnail?id={file_id}&sz=w800",
-                "caption": file.get("name") or "Foto",
-                "web_url": file.get("webViewLink") or "",
-            }
-        )
-        if len(images) >= limit:
-            break
-    return images
-
-
-def ensure_member_schema() -> None:
-    inspector = inspect(engine)
-    columns = {col["name"] for col in inspector.get_columns("members")}
-    required_columns: dict[str, str] = {
-        "first_name": "TEXT",
-        "last_name": "TEXT",
-        "birth_date": "DATE",
-        "birth_place": "TEXT",
-        "residence": "TEXT",
-        "codice_fiscale": "TEXT",
-        "document_type": "TEXT",
-        "document_number": "TEXT",
-        "document_id": "TEXT",
-        "tessera_sanitaria": "TEXT",
-        "medical_certificate": "TEXT",
-        "medical_certificate_expiry": "DATE",
-        "access_code": "TEXT",
-        "password_hash": "TEXT",
-    }
-    with engine.begin() as conn:
-        for column, ddl in required_columns.items():
-            if column not in columns:
-                conn.execute(text(f"ALTER TABLE members ADD COLUMN {column} {ddl}"))
+
+def _localize_images(images: list[DriveImage]) -> list[DriveImage]:
+    return thumbnail_mirror.localize(
+        images, lambda path: app.url_path_for("static", path=path)
+    )
 
 
-def ensure_merch_schema() -> None:
-    inspector = inspect(engine)
-    columns = {col["name"] for col in inspector.get_columns("merch_items")}
-    if "image_url" not in columns:
-        with engine.begin() as conn:
-            conn.execute(text("ALTER TABLE merch_items ADD COLUMN image_url VARCHAR(255)"))
+def _drive_folder_ttl(folder_id: str) -> float | None:
+    for configured_id, ttl in _drive_folders():
+        if configured_id == folder_id:
+            return ttl
+    raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Album non trovato")
 
 
 def _hash_password(raw: str) -> str:
@@ -211,124 +303,199 @@ def _verify_password(raw: str, hashed: str | None) -> bool:
     return bool(hashed) and _hash_password(raw) == hashed
 
 
-def _member_from_session(request: Request, session: Session) -> Member | None:
+async def _member_from_session(request: Request, session: AsyncSession) -> Member | None:
     member_id = request.session.get("member_id")
     if not member_id:
         return None
-    return session.get(Member, member_id)
+    return await session.get(Member, member_id, options=[selectinload(Member.documents)])
 
 
-def _set_pending_payment(request: Request, payload: dict[str, object]) -> None:
-    request.session["pending_payment"] = payload
+def _set_pending_payment(request: Request, payment: Payment) -> None:
+    # Nel cookie resta solo il codTrans: i dettagli sono nella tabella payments.
+    request.session["pending_payment"] = payment.cod_trans
 
 
-def _pop_pending_payment(request: Request) -> dict[str, object] | None:
+def _resolve_payment(
+    request: Request, session: Session, verified_cod_trans: str | None
+) -> Payment | None:
+    """Trova il pagamento del ritorno da Nexi.
+
+    I `codTrans` sono sequenziali e indovinabili: quello in query vale solo
+    se firmato da Nexi (`verified_cod_trans`), altrimenti si usa il
+    pagamento in sospeso della sessione.
+    """
     pending = request.session.pop("pending_payment", None)
-    return pending if isinstance(pending, dict) else None
-
-
-def _build_payment_result_context(
-    pending: dict[str, object] | None, session: Session, success: bool
-) -> dict[str, object]:
-    return_url = "/"
-    retry_url: str | None = None
-    label: str | None = None
-
-    if isinstance(pending, dict):
-        pending_return = pending.get("return_url")
-        if isinstance(pending_return, str) and pending_return:
-            return_url = pending_return
-        pending_retry = pending.get("retry_url")
-        if isinstance(pending_retry, str) and pending_retry:
-            retry_url = pending_retry
-        pending_label = pending.get("label")
-        if isinstance(pending_label, str) and pending_label:
-            label = pending_label
-
-        if success and pending.get("kind") == "membership":
-            member_id = pending.get("member_id")
-            if isinstance(member_id, str) and member_id.isdigit():
-                member_id = int(member_id)
-            if isinstance(member_id, int):
-                member = session.get(Member, member_id)
-                if member:
-                    member.payment_status = "paid"
-                    reference = pending.get("reference")
-                    if isinstance(reference, str) and reference:
-                        member.payment_reference = reference
-                    session.commit()
+    cod_trans = verified_cod_trans or pending
+    if not isinstance(cod_trans, str) or not cod_trans:
+        return None
+    return find_payment(session, cod_trans)
+
+
+def _apply_nexi_outcome(session: Session, params: Mapping[str, str]) -> str:
+    amount = params.get("importo", "")
+    return apply_outcome(
+        session,
+        params["codTrans"],
+        params.get("esito", ""),
+        amount_cents=int(amount) if amount.isdigit() else -1,
+        auth_code=params.get("codAut"),
+    )
+
+
+def _apply_browser_outcome(request: Request, session: Session) -> str | None:
+    """Il ritorno del browser porta gli stessi campi firmati della notifica:
+    se il MAC è valido l'esito viene applicato e si restituisce il `codTrans`,
+    altrimenti la pagina mostra solo lo stato registrato (fa fede la notifica
+    server-to-server)."""
+    params = dict(request.query_params)
+    nexi_client = _nexi_client()
+    if nexi_client and nexi_client.verify_outcome(params):
+        _apply_nexi_outcome(session, params)
+        return params["codTrans"]
+    return None
 
+
+def _build_payment_result_context(payment: Payment | None) -> dict[str, object]:
+    if payment is None:
+        return {"return_url": "/", "retry_url": None, "label": None}
     return {
-        "return_url": return_url,
-        "retry_url": retry_url,
-        "label": label,
+        "return_url": payment.return_url or "/",
+        "retry_url": payment.retry_url,
+        "label": payment.label,
     }
 
 
-@app.get("/", response_class=HTMLResponse)
-def home(request: Request, session: Session = Depends(get_session)) -> HTMLResponse:
-    events = (
-        session.query(Event)
-        .order_by(Event.date.asc().nulls_last())
-        .limit(6)
-        .all()
+def _render_page(
+    request: Request,
+    name: str,
+    context: dict[str, object],
+    key: tuple[Hashable, ...] = (),
+    catalog: CatalogSnapshot | None = None,
+) -> Response:
+    """Renderizza `name` con validatori HTTP e cache dell'HTML per gli anonimi.
+
+    `key` identifica i dati usati oltre al catalogo (es. lo slug). Template,
+    URL base, versione del catalogo e hash dei manifest di asset e immagini
+    entrano nella chiave: da essa si ricava l'ETag, uguale su tutti i worker,
+    così un `If-None-Match` valido riceve 304 senza renderizzare. Con un socio in sessione la pagina non è
+    né validabile né memorizzabile.
+
+    L'URL base è `PUBLIC_BASE_URL`, non l'header Host del client: la pagina
+    viene renderizzata con quello, quindi un Host arbitrario non può finire
+    negli URL dell'HTML condiviso. Senza `PUBLIC_BASE_URL` l'HTML non va in
+    cache.
+    """
+    if request.session.get("member_id"):
+        if page_cache.enabled:
+            page_cache.stats.bypasses += 1
+        response = templates.TemplateResponse(name, {"request": request, **context})
+        response.headers.update(PRIVATE_PAGE_HEADERS)
+        return response
+    cacheable = page_cache.enabled and bool(settings.public_base_url)
+    if settings.public_base_url:
+        request = _canonical_request(request, settings.public_base_url)
+    cache_key = (
+        name,
+        *key,
+        catalog.version if catalog else None,
+        str(request.base_url),
+        asset_manifest.digest,
+        image_pipeline.digest,
     )
-    merch_preview = session.query(MerchItem).order_by(MerchItem.id).limit(3).all()
-    return templates.TemplateResponse(
+    etag = page_etag(cache_key, templates_fingerprint)
+    last_modified = templates_fingerprint.modified_at
+    if catalog is not None:
+        last_modified = max(last_modified, catalog.loaded_at)
+    headers = {"ETag": etag, "Last-Modified": http_date(last_modified), **PUBLIC_PAGE_HEADERS}
+    if is_not_modified(request, etag, last_modified):
+        return not_modified_response(headers)
+    body = page_cache.get(cache_key) if cacheable else None
+    if body is not None:
+        return HTMLResponse(body, headers=headers)
+    response = templates.TemplateResponse(name, {"request": request, **context}, headers=headers)
+    if cacheable:
+        page_cache.put(cache_key, bytes(response.body))
+    return response
+
+
+def _canonical_request(request: Request, base_url: str) -> Request:
+    """Copia di `request` con schema, host e root path presi da `base_url`."""
+    url = URL(base_url)
+    headers = [(name, value) for name, value in request.scope["headers"] if name != b"host"]
+    headers.append((b"host", url.netloc.encode("latin-1")))
+    scope = {
+        **request.scope,
+        "scheme": url.scheme,
+        "headers": headers,
+        "root_path": url.path.rstrip("/"),
+        "app_root_path": url.path.rstrip("/"),
+    }
+    return Request(scope, request.receive)
+
+
+@app.get("/", response_class=HTMLResponse)
+async def home(request: Request) -> Response:
+    catalog = await catalog_cache.aget()
+    return _render_page(
+        request,
         "home.html",
         {
-            "request": request,
-            "events": events,
-            "merch_preview": merch_preview,
+            "events": catalog.events[:6],
+            "merch_preview": catalog.merch[:3],
             "membership_fee": settings.membership_fee_eur,
             "settings": settings,
             "price_fn": format_price,
         },
+        catalog=catalog,
     )
 
 
 @app.get("/eventi/{slug}", response_class=HTMLResponse)
-def read_event(
-    request: Request, slug: str, session: Session = Depends(get_session)
-) -> HTMLResponse:
-    event = session.query(Event).filter_by(slug=slug).first()
+async def read_event(request: Request, slug: str) -> Response:
+    catalog = await catalog_cache.aget()
+    event = catalog.events_by_slug.get(slug)
     if not event:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Evento non trovato")
-    return templates.TemplateResponse(
+    return _render_page(
+        request,
         "event_detail.html",
-        {"request": request, "event": event, "settings": settings},
+        {"event": event, "settings": settings},
+        key=(slug,),
+        catalog=catalog,
     )
 
 
 @app.get("/merch", response_class=HTMLResponse)
-def merch_listing(request: Request, session: Session = Depends(get_session)) -> HTMLResponse:
-    items = session.query(MerchItem).order_by(MerchItem.name.asc()).all()
-    return templates.TemplateResponse(
+async def merch_listing(request: Request) -> Response:
+    catalog = await catalog_cache.aget()
+    return _render_page(
+        request,
         "merch.html",
         {
-            "request": request,
-            "merch": items,
+            "merch": catalog.merch_by_name,
             "settings": settings,
             "price_fn": format_price,
         },
+        catalog=catalog,
     )
 
 
 @app.get("/merch/{slug}", response_class=HTMLResponse)
-def merch_detail(
-    request: Request, slug: str, session: Session = Depends(get_session)
-) -> HTMLResponse:
-    item = session.query(MerchItem).filter_by(slug=slug).first()
+async def merch_detail(request: Request, slug: str) -> Response:
+    catalog = await catalog_cache.aget()
+    item = catalog.merch_by_slug.get(slug)
     if not item:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Prodotto non trovato")
-    return templates.TemplateResponse(
+    return _render_page(
+        request,
         "merch_item.html",
         {
-            "request": request,
             "item": item,
             "settings": settings,
             "price_fn": format_price,
         },
+        key=(slug,),
+        catalog=catalog,
     )
 
 
@@ -339,26 +506,45 @@ def merch_checkout(
     quantity: int = Form(1),
     session: Session = Depends(get_session),
 ) -> HTMLResponse:
-    item = session.query(MerchItem).filter_by(slug=slug).first()
+    item = catalog_cache.get().merch_by_slug.get(slug)
     if not item:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Prodotto non trovato")
 
-    quantity = max(1, min(quantity, item.stock or 1))
+    quantity = max(1, quantity)
+    if quantity > settings.merch_max_quantity:
+        # Vale anche per i prodotti senza stock tracciato, che non hanno altro limite.
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Quantità massima per ordine: {settings.merch_max_quantity}",
+        )
     total_cents = item.price_cents * quantity
-    payment_reference = f"merch-{item.slug}-{reqid()}"
-    _set_pending_payment(
-        request,
-        {
-            "kind": "merch",
-            "reference": payment_reference,
-            "return_url": f"/merch/{item.slug}",
-            "retry_url": f"/merch/{item.slug}",
-            "label": f"Ordine merch: {item.name} x{quantity}",
-        },
+    client = _require_nexi_client()
+    try:
+        order = reserve_order(session, item, quantity, ttl=settings.merch_reservation_ttl)
+    except OutOfStock:
+        session.rollback()
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT, detail="Disponibilità insufficiente"
+        ) from None
+    pending = create_payment(
+        session,
+        client.new_cod_trans,
+        kind="merch",
+        amount_cents=total_cents,
+        merch_item_id=item.id,
+        quantity=quantity,
+        label=f"Ordine merch: {item.name} x{quantity}",
+        return_url=f"/merch/{item.slug}",
+        retry_url=f"/merch/{item.slug}",
     )
-    payment = _require_nexi_client().prepare_payment(
+    order.payment_id = pending.id
+    session.commit()
+    # Lo stock è cambiato: questo processo ricarica subito il catalogo.
+    catalog_cache.invalidate()
+    _set_pending_payment(request, pending)
+    payment = client.prepare_payment(
         amount_cents=total_cents,
-        order_id=payment_reference,
+        order_id=pending.cod_trans,
         description=f"{item.name} × {quantity}",
         email=None,
     )
@@ -377,21 +563,23 @@ def merch_checkout(
 
 
 @app.get("/galleria", response_class=HTMLResponse)
-def gallery(request: Request) -> HTMLResponse:
+async def gallery(request: Request) -> HTMLResponse:
     drive_albums: list[dict[str, object]] = []
     if settings.google_drive_api_key:
+        pages = await gallery_cache.get_many(_drive_folders())
         for collection in DRIVE_COLLECTIONS:
             folder_id = collection.get("folder_id")
-            if not folder_id:
+            if not folder_id or folder_id not in pages:
                 continue
-            images = fetch_drive_images(folder_id, settings.google_drive_api_key)
+            page = pages[folder_id]
             drive_albums.append(
                 {
                     "title": collection.get("title"),
                     "description": collection.get("description"),
                     "folder_id": folder_id,
                     "folder_url": f"https://drive.google.com/drive/folders/{folder_id}",
-                    "images": images,
+                    "images": _localize_images(page.images),
+                    "next_cursor": page.next_cursor,
                 }
             )
     return templates.TemplateResponse(
@@ -405,17 +593,77 @@ def gallery(request: Request) -> HTMLResponse:
     )
 
 
-@app.get("/associazione", response_class=HTMLResponse)
-def association(request: Request) -> HTMLResponse:
-    return templates.TemplateResponse(
-        "associazione.html",
-        {
-            "request": request,
-            "settings": settings,
+def _require_bearer(request: Request, token: str | None, unconfigured: str) -> None:
+    """Endpoint interni: senza token configurato restano chiusi (503)."""
+    if not token:
+        raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail=unconfigured)
+    if not secrets.compare_digest(
+        request.headers.get("authorization", "").encode(), f"Bearer {token}".encode()
+    ):
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Token non valido")
+
+
+@app.get("/metrics")
+async def metrics(request: Request) -> Response:
+    _require_bearer(request, settings.metrics_token, "Metriche non configurate")
+    return Response(registry.render(), media_type=METRICS_CONTENT_TYPE)
+
+
+@app.get("/admin/soci/export")
+async def export_members_view(
+    request: Request, format: str = "csv", payment_status: str | None = None
+) -> StreamingResponse:
+    _require_bearer(request, settings.admin_token, "Export soci non configurato")
+    if format not in EXPORT_FORMATS:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Formato non valido")
+    # Generatore sincrono: Starlette lo consuma nel threadpool, un blocco alla volta.
+    return StreamingResponse(
+        export_members(format, SessionLocal, UPLOADS_DIR, payment_status),
+        media_type=MEDIA_TYPES[format],
+        headers={
+            "Content-Disposition": attachment_header(export_filename(format)),
+            "Cache-Control": "no-store",
         },
     )
 
 
+@app.get("/api/cache/stats")
+async def cache_stats(request: Request) -> JSONResponse:
+    _require_bearer(request, settings.metrics_token, "Metriche non configurate")
+    catalog = await catalog_cache.aget()
+    return JSONResponse(
+        {
+            "catalog": {"version": catalog.version, **asdict(catalog_cache.stats)},
+            "pages": asdict(page_cache.stats),
+            "gallery": asdict(gallery_cache.stats),
+        }
+    )
+
+
+@app.get("/api/galleria/{folder_id}")
+async def gallery_page(folder_id: str, cursor: str | None = None) -> JSONResponse:
+    if not settings.google_drive_api_key:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Album non trovato")
+    ttl = _drive_folder_ttl(folder_id)
+    try:
+        page = await gallery_cache.get_page(folder_id, cursor, ttl=ttl, timeout=10)
+    except GalleryUnavailable:
+        # Il client tiene il cursore e propone "Riprova".
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Google Drive non raggiungibile",
+            headers={"Retry-After": str(int(gallery_cache.error_ttl))},
+        ) from None
+    return JSONResponse(
+        {"images": _localize_images(page.images), "next_cursor": page.next_cursor}
+    )
+
+
+@app.get("/associazione", response_class=HTMLResponse)
+async def association(request: Request) -> Response:
+    return _render_page(request, "associazione.html", {"settings": settings})
+
+
 @app.get("/tesseramento", response_class=HTMLResponse)
 def membership_form(
     request: Request, success: bool | None = False
@@ -433,70 +681,109 @@ def membership_form(
     )
 
 
-@app.post("/tesseramento")
-def membership_submit(
-    request: Request,
-    first_name: str = Form(...),
-    last_name: str = Form(...),
-    email: str = Form(...),
-    birth_date: date = Form(...),
-    birth_place: str = Form(...),
-    residence: str = Form(...),
-    codice_fiscale: str = Form(...),
-    document_type: str = Form(...),
-    document_number: str = Form(...),
-    document_id: str | None = Form(None),
-    tessera_sanitaria: str = Form(...),
-    medical_certificate: str = Form(...),
-    medical_certificate_expiry: date = Form(...),
-    membership_type: str = Form(...),
-    message: str | None = Form(None),
-    documents: list[UploadFile] = File(...),
-    session: Session = Depends(get_session),
-) -> RedirectResponse:
-    for field_value in [
-        document_type,
-        document_number,
-        tessera_sanitaria,
-        medical_certificate,
-    ]:
-        if not _normalize(field_value):
-            raise HTTPException(
-                status_code=status.HTTP_400_BAD_REQUEST,
-                detail="Documento obbligatorio mancante (CI, tessera sanitaria o certificato medico).",
-            )
+MEMBERSHIP_REQUIRED_FIELDS = (
+    "first_name",
+    "last_name",
+    "email",
+    "birth_date",
+    "birth_place",
+    "residence",
+    "codice_fiscale",
+    "document_type",
+    "document_number",
+    "tessera_sanitaria",
+    "medical_certificate",
+    "medical_certificate_expiry",
+    "membership_type",
+)
+
+
+def _form_date(fields: dict[str, str], name: str) -> date:
+    try:
+        return date.fromisoformat(fields[name].strip())
+    except ValueError:
+        raise HTTPException(
+            status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+            detail=f"Data non valida: {name}",
+        ) from None
+
 
+def _create_member(
+    session: Session, fields: dict[str, str], uploads: Sequence[StreamedUpload]
+) -> tuple[int, str]:
     password_plain, password_hash = _generate_member_password()
+    first_name = fields["first_name"].strip()
+    last_name = fields["last_name"].strip()
     member = Member(
-        name=f"{first_name.strip()} {last_name.strip()}",
-        first_name=first_name.strip(),
-        last_name=last_name.strip(),
-        email=email.strip(),
-        birth_date=birth_date,
-        birth_place=_normalize(birth_place),
-        residence=_normalize(residence),
-        codice_fiscale=_normalize(codice_fiscale),
-        document_type=_normalize(document_type),
-        document_number=_normalize(document_number),
-        document_id=_normalize(document_id),
-        tessera_sanitaria=_normalize(tessera_sanitaria),
-        medical_certificate=_normalize(medical_certificate),
-        medical_certificate_expiry=medical_certificate_expiry,
-        membership_type=membership_type,
-        message=_normalize(message),
+        name=f"{first_name} {last_name}",
+        first_name=first_name,
+        last_name=last_name,
+        email=fields["email"].strip(),
+        birth_date=_form_date(fields, "birth_date"),
+        birth_place=_normalize(fields["birth_place"]),
+        residence=_normalize(fields["residence"]),
+        codice_fiscale=_normalize(fields["codice_fiscale"]),
+        document_type=_normalize(fields["document_type"]),
+        document_number=_normalize(fields["document_number"]),
+        document_id=_normalize(fields.get("document_id")),
+        tessera_sanitaria=_normalize(fields["tessera_sanitaria"]),
+        medical_certificate=_normalize(fields["medical_certificate"]),
+        medical_certificate_expiry=_form_date(fields, "medical_certificate_expiry"),
+        membership_type=fields["membership_type"],
+        message=_normalize(fields.get("message")),
         access_code=password_plain,
         password_hash=password_hash,
     )
     session.add(member)
     session.flush()
-    saved_docs = _save_uploaded_documents(member.id, documents)
+    saved_docs = _save_uploaded_documents(session, member.id, uploads)
     if saved_docs:
         session.add_all(saved_docs)
     session.commit()
-    request.session["member_id"] = member.id
+    return member.id, password_plain
+
+
+@app.post("/tesseramento")
+async def membership_submit(
+    request: Request, session: Session = Depends(get_session)
+) -> RedirectResponse:
+    try:
+        form = await stream_multipart(
+            request,
+            UPLOADS_DIR,
+            max_file_bytes=settings.upload_max_file_bytes,
+            max_request_bytes=settings.upload_max_request_bytes,
+        )
+    except UploadTooLarge as exc:
+        raise HTTPException(
+            status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE, detail=str(exc)
+        ) from None
+    except UploadError as exc:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(exc)) from None
+
+    try:
+        missing = [name for name in MEMBERSHIP_REQUIRED_FIELDS if name not in form.fields]
+        if missing or "documents" not in form.files:
+            raise HTTPException(
+                status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+                detail=f"Campi obbligatori mancanti: {', '.join(missing or ['documents'])}",
+            )
+        for name in ("document_type", "document_number", "tessera_sanitaria", "medical_certificate"):
+            if not _normalize(form.fields[name]):
+                raise HTTPException(
+                    status_code=status.HTTP_400_BAD_REQUEST,
+                    detail="Documento obbligatorio mancante (CI, tessera sanitaria o certificato medico).",
+                )
+        member_id, password_plain = await run_in_threadpool(
+            _create_member, session, form.fields, form.files["documents"]
+        )
+    finally:
+        await run_in_threadpool(form.cleanup)
+
+    request.session["member_id"] = member_id
     request.session["member_password_hint"] = password_plain
     return RedirectResponse(
-        url=f"/tesseramento/pagamento/{member.id}", status_code=status.HTTP_303_SEE_OTHER
+        url=f"/tesseramento/pagamento/{member_id}", status_code=status.HTTP_303_SEE_OTHER
     )
 
 
@@ -510,21 +797,25 @@ def membership_payment(
             status_code=status.HTTP_404_NOT_FOUND,
             detail="Richiesta di tesseramento non trovata",
         )
-    payment_reference = f"member-{member.id}-{reqid()}"
-    _set_pending_payment(
-        request,
-        {
-            "kind": "membership",
-            "member_id": member.id,
-            "reference": payment_reference,
-            "return_url": "/area-tesserati",
-            "retry_url": f"/tesseramento/pagamento/{member.id}",
-            "label": f"Tesseramento {member.first_name} {member.last_name}",
-        },
-    )
-    payment_context: NexiPaymentContext = _require_nexi_client().prepare_payment(
-        amount_cents=settings.membership_fee_eur * 100,
-        order_id=payment_reference,
+    client = _require_nexi_client()
+    amount_cents = settings.membership_fee_eur * 100
+    pending = find_pending_payment(session, "membership", member.id, amount_cents)
+    if pending is None:
+        pending = create_payment(
+            session,
+            client.new_cod_trans,
+            kind="membership",
+            amount_cents=amount_cents,
+            member_id=member.id,
+            label=f"Tesseramento {member.first_name} {member.last_name}",
+            return_url="/area-tesserati",
+            retry_url=f"/tesseramento/pagamento/{member.id}",
+        )
+        session.commit()
+    _set_pending_payment(request, pending)
+    payment_context: NexiPaymentContext = client.prepare_payment(
+        amount_cents=amount_cents,
+        order_id=pending.cod_trans,
         description=f"Tesseramento {(member.name or '').strip() or f'{member.first_name} {member.last_name}'}",
         email=member.email,
     )
@@ -550,8 +841,9 @@ def membership_payment(
 def nexi_success(
     request: Request, session: Session = Depends(get_session)
 ) -> HTMLResponse:
-    pending = _pop_pending_payment(request)
-    context = _build_payment_result_context(pending, session, success=True)
+    verified_cod_trans = _apply_browser_outcome(request, session)
+    payment = _resolve_payment(request, session, verified_cod_trans)
+    context = _build_payment_result_context(payment)
     return templates.TemplateResponse(
         "payment_result.html",
         {
@@ -567,8 +859,9 @@ def nexi_success(
 def nexi_failure(
     request: Request, session: Session = Depends(get_session)
 ) -> HTMLResponse:
-    pending = _pop_pending_payment(request)
-    context = _build_payment_result_context(pending, session, success=False)
+    verified_cod_trans = _apply_browser_outcome(request, session)
+    payment = _resolve_payment(request, session, verified_cod_trans)
+    context = _build_payment_result_context(payment)
     return templates.TemplateResponse(
         "payment_result.html",
         {
@@ -580,9 +873,34 @@ def nexi_failure(
     )
 
 
+@app.post("/nexi/notifica")
+async def nexi_notification(request: Request, session: Session = Depends(get_session)) -> Response:
+    """Notifica server-to-server (`urlpost`) con l'esito della transazione.
+
+    Nexi la ripete finché non riceve 200: le ripetizioni e gli esiti fuori
+    ordine sono gestiti da `apply_outcome`, che applica ogni transizione una
+    sola volta.
+    """
+    client = _require_nexi_client()
+    form = await request.form()
+    params = {key: value for key, value in form.items() if isinstance(value, str)}
+    if not client.verify_outcome(params):
+        logger.warning("Notifica Nexi con MAC non valido (codTrans=%s)", params.get("codTrans"))
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="MAC non valido")
+    result = await run_in_threadpool(_apply_nexi_outcome, session, params)
+    if result == UNKNOWN:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Transazione non trovata")
+    if result == AMOUNT_MISMATCH:
+        logger.error("Notifica Nexi con importo diverso (codTrans=%s)", params["codTrans"])
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail="Importo non corrispondente")
+    return Response(content="OK", media_type="text/plain")
+
+
 @app.get("/area-tesserati", response_class=HTMLResponse)
-def member_area(request: Request, session: Session = Depends(get_session)) -> HTMLResponse:
-    member = _member_from_session(request, session)
+async def member_area(
+    request: Request, session: AsyncSession = Depends(get_async_session)
+) -> HTMLResponse:
+    member = await _member_from_session(request, session)
     documents: list[MemberDocument] = list(member.documents) if member else []
     return templates.TemplateResponse(
         "member_area.html",
@@ -597,17 +915,14 @@ def member_area(request: Request, session: Session = Depends(get_session)) -> HT
 
 
 @app.post("/area-tesserati/login", response_model=None)
-def member_login(
+async def member_login(
     request: Request,
     email: str = Form(...),
     password: str = Form(...),
-    session: Session = Depends(get_session),
+    session: AsyncSession = Depends(get_async_session),
 ) -> Response:
-    member = (
-        session.query(Member)
-        .filter(Member.email == email.strip())
-        .order_by(Member.id.desc())
-        .first()
+    member = await session.scalar(
+        select(Member).where(Member.email == email.strip()).order_by(Member.id.desc()).limit(1)
     )
     if not member or not _verify_password(password.strip(), member.password_hash):
         return templates.TemplateResponse(
@@ -627,37 +942,49 @@ def member_login(
 
 
 @app.post("/area-tesserati/logout")
-def member_logout(request: Request) -> RedirectResponse:
+async def member_logout(request: Request) -> RedirectResponse:
     request.session.pop("member_id", None)
     request.session.pop("member_password_hint", None)
     return RedirectResponse(url="/area-tesserati", status_code=status.HTTP_303_SEE_OTHER)
 
 
 @app.get("/tesseramento/documenti/{document_id}")
-def download_document(
-    document_id: int, request: Request, session: Session = Depends(get_session)
-) -> FileResponse:
-    document = session.get(MemberDocument, document_id)
+async def download_document(
+    document_id: int, request: Request, session: AsyncSession = Depends(get_async_session)
+) -> Response:
+    document = await session.get(MemberDocument, document_id)
     if not document:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND, detail="Documento non trovato"
         )
-    member = _member_from_session(request, session)
-    if not member or member.id != document.member_id:
+    member_id = request.session.get("member_id")
+    if not member_id or member_id != document.member_id:
         raise HTTPException(
             status_code=status.HTTP_403_FORBIDDEN, detail="Non sei autorizzato a questo file"
         )
+    # Il blob è immutabile: ETag e Last-Modified vengono dalla riga, senza I/O su disco.
+    etag = f'"{document.blob_sha256}"' if document.blob_sha256 else None
+    last_modified = document.uploaded_at
+    headers = {"Cache-Control": "private, no-cache", "Vary": "Cookie"}
+    if etag:
+        headers["ETag"] = etag
+    if last_modified:
+        headers["Last-Modified"] = http_date(last_modified)
+    if is_not_modified(request, etag, last_modified):
+        return not_modified_response(headers)
+
     path = UPLOADS_DIR / document.stored_filename
-    if not path.exists():
-        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="File mancante")
-    return FileResponse(
+    try:
+        size = path.stat().st_size
+    except FileNotFoundError:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="File mancante") from None
+    headers["Content-Disposition"] = attachment_header(document.original_name)
+    return file_response(
+        request,
         path,
+        size,
         media_type=document.content_type or "application/octet-stream",
-        filename=document.original_name,
+        headers=headers,
+        etag=etag,
+        last_modified=last_modified,
     )
-
-
-def reqid() -> str:
-    from uuid import uuid4
-
-    return uuid4().hex[:12]
@@ -0,0 +1,322 @@
+from __future__ import annotations
+
+import logging
+import threading
+import time
+from abc import ABC, abstractmethod
+from bisect import bisect_left
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass
+from typing import Any, Iterator, TypeVar
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+logger = logging.getLogger(__name__)
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+# Il metodo arriva dal client: fuori da questi va in `other`, così le serie restano poche.
+HTTP_METHODS = frozenset({"GET", "HEAD", "POST", "PUT", "PATCH", "DELETE", "OPTIONS"})
+
+LabelValues = tuple[str, ...]
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: tuple[str, ...], values: LabelValues, extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+class _Metric(ABC):
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple[str, ...] = ()) -> None:
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self._lock = threading.Lock()
+
+    def _key(self, labels: dict[str, str]) -> LabelValues:
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name}: etichette attese {self.labelnames}, ricevute {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    @abstractmethod
+    def _samples(self) -> Iterator[str]:
+        ...
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        with self._lock:
+            lines.extend(self._samples())
+        return "\n".join(lines)
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple[str, ...] = ()) -> None:
+        super().__init__(name, documentation, labelnames)
+        self._values: dict[LabelValues, float] = {} if labelnames else {(): 0}
+
+    def inc(self, amount: float = 1, **labels: str) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels: str) -> float:
+        with self._lock:
+            return self._values.get(self._key(labels), 0)
+
+    def _samples(self) -> Iterator[str]:
+        for key, value in sorted(self._values.items()):
+            yield f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}"
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: tuple[str, ...] = (),
+        buckets: tuple[float, ...] = LATENCY_BUCKETS,
+    ) -> None:
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets) + (float("inf"),)
+        # Per etichetta: conteggi per bucket (non cumulativi) e somma dei valori.
+        self._values: dict[LabelValues, tuple[list[int], list[float]]] = {}
+
+    def observe(self, value: float, **labels: str) -> None:
+        key = self._key(labels)
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            counts, total = self._values.setdefault(key, ([0] * len(self.buckets), [0.0]))
+            counts[index] += 1
+            total[0] += value
+
+    def _samples(self) -> Iterator[str]:
+        for key, (counts, total) in sorted(self._values.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets, counts):
+                cumulative += count
+                labels = _format_labels(self.labelnames, key, f'le="{_format_value(bound)}"')
+                yield f"{self.name}_bucket{labels} {cumulative}"
+            labels = _format_labels(self.labelnames, key)
+            yield f"{self.name}_sum{labels} {_format_value(total[0])}"
+            yield f"{self.name}_count{labels} {cumulative}"
+
+
+MetricT = TypeVar("MetricT", bound=_Metric)
+
+
+class Registry:
+    """Metriche del processo in formato testo Prometheus (versione 0.0.4).
+
+    Ogni worker espone solo le proprie: con più processi le somma Prometheus.
+    """
+
+    def __init__(self) -> None:
+        self._metrics: dict[str, _Metric] = {}
+
+    def register(self, metric: MetricT) -> MetricT:
+        if metric.name in self._metrics:
+            raise ValueError(f"Metrica già registrata: {metric.name}")
+        self._metrics[metric.name] = metric
+        return metric
+
+    def render(self) -> str:
+        return "\n".join(metric.render() for metric in self._metrics.values()) + "\n"
+
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+registry = Registry()
+HTTP_REQUEST_DURATION = registry.register(
+    Histogram(
+        "http_request_duration_seconds",
+        "Durata delle richieste HTTP per route.",
+        ("method", "route", "status"),
+    )
+)
+DB_QUERIES = registry.register(
+    Counter("db_queries_total", "Query SQL eseguite.")
+)
+DB_QUERY_DURATION = registry.register(
+    Histogram("db_query_duration_seconds", "Durata delle singole query SQL.")
+)
+DB_QUERIES_PER_REQUEST = registry.register(
+    Histogram(
+        "db_queries_per_request",
+        "Query SQL eseguite per richiesta HTTP.",
+        ("route",),
+        buckets=QUERY_COUNT_BUCKETS,
+    )
+)
+DB_TIME_PER_REQUEST = registry.register(
+    Histogram(
+        "db_time_per_request_seconds",
+        "Tempo passato in query SQL per richiesta HTTP.",
+        ("route",),
+    )
+)
+QUERY_BUDGET_EXCEEDED = registry.register(
+    Counter(
+        "db_query_budget_exceeded_total",
+        "Richieste che hanno superato il budget di query.",
+        ("route",),
+    )
+)
+UPLOADS = registry.register(
+    Counter("uploads_total", "File caricati e scritti su disco.")
+)
+UPLOAD_BYTES = registry.register(
+    Counter("upload_bytes_written_total", "Byte di upload scritti su disco.")
+)
+DRIVE_REQUESTS = registry.register(
+    Counter(
+        "drive_requests_total",
+        "Chiamate a Google Drive per tipo ed esito.",
+        ("kind", "outcome"),
+    )
+)
+DRIVE_REQUEST_DURATION = registry.register(
+    Histogram(
+        "drive_request_duration_seconds",
+        "Durata delle chiamate a Google Drive.",
+        ("kind",),
+    )
+)
+
+
+@contextmanager
+def observe_drive_call(kind: str) -> Iterator[None]:
+    """Conta e cronometra una chiamata a Drive (`kind`: `list` o `thumbnail`)."""
+    started = time.perf_counter()
+    outcome = "error"
+    try:
+        yield
+        outcome = "ok"
+    finally:
+        DRIVE_REQUEST_DURATION.observe(time.perf_counter() - started, kind=kind)
+        DRIVE_REQUESTS.inc(kind=kind, outcome=outcome)
+
+
+@dataclass
+class QueryStats:
+    count: int = 0
+    seconds: float = 0.0
+
+
+_request_queries: ContextVar[QueryStats | None] = ContextVar("request_queries", default=None)
+
+
+def _before_cursor_execute(conn: Any, _cursor: Any, *_args: Any) -> None:
+    conn.info.setdefault("query_started", []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn: Any, _cursor: Any, *_args: Any) -> None:
+    started = conn.info.get("query_started")
+    if not started:
+        return
+    elapsed = time.perf_counter() - started.pop()
+    DB_QUERIES.inc()
+    DB_QUERY_DURATION.observe(elapsed)
+    stats = _request_queries.get()
+    if stats is not None:
+        stats.count += 1
+        stats.seconds += elapsed
+
+
+def _handle_error(context: Any) -> None:
+    connection = context.connection
+    if connection is not None and connection.info.get("query_started"):
+        connection.info["query_started"].pop()
+
+
+def instrument_queries() -> None:
+    """Aggancia i contatori di query a tutti gli engine, sincroni e async."""
+    if not event.contains(Engine, "before_cursor_execute", _before_cursor_execute):
+        event.listen(Engine, "before_cursor_execute", _before_cursor_execute)
+        event.listen(Engine, "after_cursor_execute", _after_cursor_execute)
+        event.listen(Engine, "handle_error", _handle_error)
+
+
+def route_template(scope: Scope) -> str:
+    """Il percorso della route (`/merch/{slug}`), non quello richiesto."""
+    route = scope.get("route")
+    if route is not None:
+        return getattr(route, "path", "unmatched")
+    root_path = scope.get("root_path", "")
+    app_root_path = scope.get("app_root_path", "")
+    if root_path != app_root_path:
+        return root_path[len(app_root_path):] + "/{path}"
+    return "unmatched"
+
+
+class MetricsMiddleware:
+    """Registra durata, query SQL e stato di ogni richiesta per route.
+
+    Le query vengono contate tramite una `ContextVar`, che segue la richiesta
+    anche nel threadpool delle route sincrone. Oltre `query_budget` query si
+    scrive un warning, così un N+1 si nota nei log.
+    """
+
+    def __init__(self, app: ASGIApp, query_budget: int = 20) -> None:
+        self.app = app
+        self.query_budget = query_budget
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        stats = QueryStats()
+        token = _request_queries.set(stats)
+        status_code = 500
+        started = time.perf_counter()
+
+        async def send_wrapper(message: Message) -> None:
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            _request_queries.reset(token)
+            route = route_template(scope)
+            HTTP_REQUEST_DURATION.observe(
+                time.perf_counter() - started,
+                method=scope["method"] if scope["method"] in HTTP_METHODS else "other",
+                route=route,
+                status=str(status_code),
+            )
+            DB_QUERIES_PER_REQUEST.observe(stats.count, route=route)
+            DB_TIME_PER_REQUEST.observe(stats.seconds, route=route)
+            if self.query_budget and stats.count > self.query_budget:
+                QUERY_BUDGET_EXCEEDED.inc(route=route)
+                logger.warning(
+                    "%s %s ha eseguito %s query (budget %s, %.1f ms in SQL)",
+                    scope["method"],
+                    route,
+                    stats.count,
+                    self.query_budget,
+                    stats.seconds * 1000,
+                )
@@ -0,0 +1,191 @@
+from __future__ import annotations
+
+import argparse
+import logging
+from typing import Callable
+
+from sqlalchemy import inspect, text
+from sqlalchemy.engine import Connection, Engine
+from sqlalchemy.exc import IntegrityError
+
+logger = logging.getLogger(__name__)
+
+Migration = tuple[int, str, Callable[[Connection], None]]
+
+
+def _add_missing_columns(conn: Connection, table: str, columns: dict[str, str]) -> None:
+    existing = {col["name"] for col in inspect(conn).get_columns(table)}
+    for column, ddl in columns.items():
+        if column not in existing:
+            conn.execute(text(f"ALTER TABLE {table} ADD COLUMN {column} {ddl}"))
+
+
+def _member_profile_columns(conn: Connection) -> None:
+    _add_missing_columns(
+        conn,
+        "members",
+        {
+            "first_name": "TEXT",
+            "last_name": "TEXT",
+            "birth_date": "DATE",
+            "birth_place": "TEXT",
+            "residence": "TEXT",
+            "codice_fiscale": "TEXT",
+            "document_type": "TEXT",
+            "document_number": "TEXT",
+            "document_id": "TEXT",
+            "tessera_sanitaria": "TEXT",
+            "medical_certificate": "TEXT",
+            "medical_certificate_expiry": "DATE",
+            "access_code": "TEXT",
+            "password_hash": "TEXT",
+        },
+    )
+
+
+def _merch_image_url(conn: Connection) -> None:
+    _add_missing_columns(conn, "merch_items", {"image_url": "VARCHAR(255)"})
+
+
+def _document_blob_column(conn: Connection) -> None:
+    _add_missing_columns(conn, "member_documents", {"blob_sha256": "VARCHAR(64)"})
+
+
+def _lookup_indexes(conn: Connection) -> None:
+    # Login: WHERE email = ? ORDER BY id DESC LIMIT 1 si risolve sull'indice.
+    conn.execute(text("CREATE INDEX IF NOT EXISTS ix_members_email_id ON members (email, id)"))
+    conn.execute(
+        text(
+            "CREATE INDEX IF NOT EXISTS ix_member_documents_member_id "
+            "ON member_documents (member_id)"
+        )
+    )
+
+
+def _payment_outcome_columns(conn: Connection) -> None:
+    _add_missing_columns(
+        conn,
+        "payments",
+        {"outcome": "VARCHAR(20)", "auth_code": "VARCHAR(40)", "notified_at": "TIMESTAMP"},
+    )
+
+
+def _catalog_version(conn: Connection) -> None:
+    conn.execute(
+        text(
+            "CREATE TABLE IF NOT EXISTS catalog_version ("
+            "id INTEGER PRIMARY KEY, version INTEGER NOT NULL DEFAULT 1)"
+        )
+    )
+    conn.execute(
+        text(
+            "INSERT INTO catalog_version (id, version) "
+            "SELECT 1, 1 WHERE NOT EXISTS (SELECT 1 FROM catalog_version WHERE id = 1)"
+        )
+    )
+    if conn.dialect.name != "sqlite":
+        return
+    # Ogni scrittura su eventi e merch (seed, modifiche a mano, stock) invalida
+    # la cache del catalogo, anche se fatta fuori dall'applicazione.
+    for table in ("events", "merch_items"):
+        for operation in ("INSERT", "UPDATE", "DELETE"):
+            conn.execute(
+                text(
+                    f"CREATE TRIGGER IF NOT EXISTS trg_{table}_{operation.lower()}_catalog "
+                    f"AFTER {operation} ON {table} BEGIN "
+                    "UPDATE catalog_version SET version = version + 1 WHERE id = 1; END"
+                )
+            )
+
+
+def _untracked_merch_stock(conn: Connection) -> None:
+    # Lo stock 0 del vecchio seed voleva dire "non gestito": i prodotti che non
+    # hanno mai avuto un ordine passano a NULL, così restano acquistabili.
+    conn.execute(
+        text(
+            "UPDATE merch_items SET stock = NULL WHERE stock = 0 AND NOT EXISTS "
+            "(SELECT 1 FROM orders WHERE orders.merch_item_id = merch_items.id)"
+        )
+    )
+
+
+# `create_all` crea le tabelle nuove già aggiornate; le migrazioni portano allo
+# stesso punto i database esistenti. Sono idempotenti, così due processi avviati
+# insieme non si intralciano. Le nuove versioni vanno solo aggiunte in coda.
+MIGRATIONS: tuple[Migration, ...] = (
+    (1, "member_profile_columns", _member_profile_columns),
+    (2, "merch_image_url", _merch_image_url),
+    (3, "document_blob_column", _document_blob_column),
+    (4, "lookup_indexes", _lookup_indexes),
+    (5, "payment_outcome_columns", _payment_outcome_columns),
+    (6, "catalog_version", _catalog_version),
+    (7, "untracked_merch_stock", _untracked_merch_stock),
+)
+LATEST_VERSION = MIGRATIONS[-1][0]
+
+
+def _ensure_version_table(conn: Connection) -> None:
+    conn.execute(
+        text(
+            "CREATE TABLE IF NOT EXISTS schema_version ("
+            "version INTEGER PRIMARY KEY, "
+            "name VARCHAR(80) NOT NULL, "
+            "applied_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP)"
+        )
+    )
+
+
+def current_version(conn: Connection) -> int:
+    return conn.execute(text("SELECT MAX(version) FROM schema_version")).scalar() or 0
+
+
+def run_migrations(engine: Engine) -> list[int]:
+    """Applica le migrazioni mancanti e restituisce le versioni applicate.
+
+    Con lo schema aggiornato costa una sola query sulla tabella delle versioni.
+    """
+    with engine.begin() as conn:
+        _ensure_version_table(conn)
+        version = current_version(conn)
+    if version >= LATEST_VERSION:
+        return []
+    applied: list[int] = []
+    for number, name, migrate in MIGRATIONS:
+        if number <= version:
+            continue
+        try:
+            with engine.begin() as conn:
+                if current_version(conn) >= number:
+                    continue
+                migrate(conn)
+                conn.execute(
+                    text("INSERT INTO schema_version (version, name) VALUES (:version, :name)"),
+                    {"version": number, "name": name},
+                )
+        except IntegrityError:
+            # Un altro processo ha registrato la stessa versione nel frattempo.
+            continue
+        logger.info("Migrazione %s (%s) applicata", number, name)
+        applied.append(number)
+    return applied
+
+
+def main() -> None:
+    from . import models  # noqa: F401 - registra le tabelle su Base
+    from .database import Base, engine
+
+    parser = argparse.ArgumentParser(description="Migrazioni dello schema")
+    parser.add_argument("command", choices=["upgrade", "status"], nargs="?", default="upgrade")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    if args.command == "upgrade":
+        Base.metadata.create_all(bind=engine)
+        applied = run_migrations(engine)
+        print(f"Migrazioni applicate: {applied or 'nessuna'}")
+    with engine.begin() as conn:
+        _ensure_version_table(conn)
+        print(f"Versione schema: {current_version(conn)} (ultima: {LATEST_VERSION})")
+
+
+if __name__ == "__main__":
+    main()
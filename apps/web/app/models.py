@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Date, DateTime, ForeignKey, Integer, String, Text, func
+from sqlalchemy import Column, Date, DateTime, ForeignKey, Index, Integer, String, Text, func
 from sqlalchemy.orm import Mapped, relationship
 
 from .database import Base
@@ -18,6 +18,13 @@ class Event(Base):
     teaser: Mapped[str | None] = Column(String(240))
 
 
+class CatalogVersion(Base):
+    __tablename__ = "catalog_version"
+
+    id: Mapped[int] = Column(Integer, primary_key=True)
+    version: Mapped[int] = Column(Integer, nullable=False, default=1)
+
+
 class MerchItem(Base):
     __tablename__ = "merch_items"
 
@@ -26,7 +33,8 @@ class MerchItem(Base):
     slug: Mapped[str] = Column(String(140), unique=True, nullable=False)
     description: Mapped[str | None] = Column(Text)
     price_cents: Mapped[int] = Column(Integer, default=0)
-    stock: Mapped[int] = Column(Integer, default=0)
+    # NULL: disponibilità non tracciata, il prodotto si può sempre ordinare.
+    stock: Mapped[int | None] = Column(Integer)
     image_url: Mapped[str | None] = Column(String(255))
 
 
@@ -61,16 +69,84 @@ class Member(Base):
         "MemberDocument", back_populates="member", cascade="all, delete-orphan"
     )
 
+    __table_args__ = (Index("ix_members_email_id", "email", "id"),)
+
+
+class DocumentBlob(Base):
+    __tablename__ = "document_blobs"
+
+    sha256: Mapped[str] = Column(String(64), primary_key=True)
+    size: Mapped[int] = Column(Integer, nullable=False)
+    ref_count: Mapped[int] = Column(Integer, nullable=False, default=0)
+    created_at: Mapped[DateTime] = Column(
+        DateTime(timezone=True), server_default=func.now()
+    )
+
 
 class MemberDocument(Base):
     __tablename__ = "member_documents"
 
     id: Mapped[int] = Column(Integer, primary_key=True)
-    member_id: Mapped[int] = Column(ForeignKey("members.id"), nullable=False)
+    member_id: Mapped[int] = Column(ForeignKey("members.id"), nullable=False, index=True)
     original_name: Mapped[str] = Column(String(255), nullable=False)
     stored_filename: Mapped[str] = Column(String(255), nullable=False)
+    blob_sha256: Mapped[str | None] = Column(ForeignKey("document_blobs.sha256"))
     content_type: Mapped[str | None] = Column(String(120))
     uploaded_at: Mapped[DateTime] = Column(
         DateTime(timezone=True), server_default=func.now()
     )
     member: Mapped["Member"] = relationship("Member", back_populates="documents")
+
+
+class Payment(Base):
+    __tablename__ = "payments"
+
+    id: Mapped[int] = Column(Integer, primary_key=True)
+    cod_trans: Mapped[str] = Column(String(30), nullable=False, unique=True)
+    kind: Mapped[str] = Column(String(20), nullable=False)
+    status: Mapped[str] = Column(String(20), nullable=False, default="pending")
+    amount_cents: Mapped[int] = Column(Integer, nullable=False)
+    currency: Mapped[str] = Column(String(3), nullable=False, default="EUR")
+    member_id: Mapped[int | None] = Column(ForeignKey("members.id"), index=True)
+    merch_item_id: Mapped[int | None] = Column(ForeignKey("merch_items.id"))
+    quantity: Mapped[int] = Column(Integer, nullable=False, default=1)
+    label: Mapped[str | None] = Column(String(240))
+    return_url: Mapped[str | None] = Column(String(255))
+    retry_url: Mapped[str | None] = Column(String(255))
+    outcome: Mapped[str | None] = Column(String(20))
+    auth_code: Mapped[str | None] = Column(String(40))
+    notified_at: Mapped[DateTime | None] = Column(DateTime(timezone=True))
+    created_at: Mapped[DateTime] = Column(
+        DateTime(timezone=True), server_default=func.now()
+    )
+    updated_at: Mapped[DateTime] = Column(
+        DateTime(timezone=True), server_default=func.now(), onupdate=func.now()
+    )
+
+
+class Order(Base):
+    __tablename__ = "orders"
+
+    id: Mapped[int] = Column(Integer, primary_key=True)
+    merch_item_id: Mapped[int] = Column(ForeignKey("merch_items.id"), nullable=False, index=True)
+    payment_id: Mapped[int | None] = Column(ForeignKey("payments.id"), unique=True)
+    quantity: Mapped[int] = Column(Integer, nullable=False)
+    amount_cents: Mapped[int] = Column(Integer, nullable=False)
+    status: Mapped[str] = Column(String(20), nullable=False, default="reserved")
+    expires_at: Mapped[DateTime] = Column(DateTime(timezone=True), nullable=False)
+    created_at: Mapped[DateTime] = Column(
+        DateTime(timezone=True), server_default=func.now()
+    )
+    updated_at: Mapped[DateTime] = Column(
+        DateTime(timezone=True), server_default=func.now(), onupdate=func.now()
+    )
+
+    __table_args__ = (Index("ix_orders_status_expires_at", "status", "expires_at"),)
+
+
+class WebSession(Base):
+    __tablename__ = "web_sessions"
+
+    id: Mapped[str] = Column(String(64), primary_key=True)
+    data: Mapped[str] = Column(Text, nullable=False)
+    expires_at: Mapped[DateTime] = Column(DateTime(timezone=True), nullable=False, index=True)
@@ -1,9 +1,20 @@
 from __future__ import annotations
 
 from dataclasses import dataclass
-from datetime import datetime
-from typing import Any
+from datetime import datetime, timezone
+from typing import Any, Callable, Mapping
 import hashlib
+import hmac
+import os
+import socket
+import threading
+import time
+import zlib
+
+COD_TRANS_MAX_LENGTH = 30
+# Campi firmati nell'esito (notifica server-to-server e ritorno del browser).
+OUTCOME_MAC_FIELDS = ("codTrans", "esito", "importo", "divisa", "data", "orario", "codAut")
+_BASE36 = "0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZ"
 
 
 @dataclass(frozen=True)
@@ -12,6 +23,60 @@ class NexiPaymentContext:
     redirect_url: str
 
 
+def _default_node_id() -> str:
+    """Tre caratteri base36 derivati da host e PID (un worker = un nodo)."""
+    value = zlib.crc32(f"{socket.gethostname()}:{os.getpid()}".encode("utf-8")) % 36**3
+    return "".join(_BASE36[value // 36**power % 36] for power in (2, 1, 0))
+
+
+class TransactionCodeGenerator:
+    """Genera `codTrans` univoci e crescenti nel processo.
+
+    Formato: prefisso + timestamp UTC al millisecondo + nodo (3 caratteri) +
+    sequenza (4 cifre), es. `PS20260417153012345K7Q0000`: 26 caratteri
+    alfanumerici, entro i 30 ammessi da Nexi. Se l'orologio torna indietro o
+    la sequenza si esaurisce nello stesso millisecondo si prosegue dall'ultimo
+    valore emesso, quindi i codici restano ordinati anche come stringhe.
+    """
+
+    SEQUENCE_DIGITS = 4
+
+    def __init__(
+        self,
+        prefix: str = "PS",
+        node_id: str | None = None,
+        clock: Callable[[], float] = time.time,
+    ) -> None:
+        node_id = (node_id or _default_node_id()).upper()
+        code_chars = prefix + node_id
+        if len(node_id) != 3 or not (code_chars.isascii() and code_chars.isalnum()):
+            raise ValueError("Transaction code prefix and node id must be alphanumeric")
+        if len(prefix) + 17 + len(node_id) + self.SEQUENCE_DIGITS > COD_TRANS_MAX_LENGTH:
+            raise ValueError("Transaction code prefix too long")
+        self.prefix = prefix
+        self.node_id = node_id
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._last_ms = 0
+        self._sequence = 0
+
+    def __call__(self) -> str:
+        with self._lock:
+            now_ms = int(self._clock() * 1000)
+            if now_ms > self._last_ms:
+                self._last_ms, self._sequence = now_ms, 0
+            else:
+                self._sequence += 1
+                if self._sequence >= 10**self.SEQUENCE_DIGITS:
+                    self._last_ms, self._sequence = self._last_ms + 1, 0
+            millis, sequence = self._last_ms, self._sequence
+        stamp = datetime.fromtimestamp(millis // 1000, tz=timezone.utc).strftime("%Y%m%d%H%M%S")
+        return (
+            f"{self.prefix}{stamp}{millis % 1000:03d}{self.node_id}"
+            f"{sequence:0{self.SEQUENCE_DIGITS}d}"
+        )
+
+
 class NexiXpayClient:
     def __init__(
         self,
@@ -21,6 +86,8 @@ class NexiXpayClient:
         success_url: str,
         failure_url: str,
         currency: str = "EUR",
+        node_id: str | None = None,
+        notify_url: str | None = None,
     ) -> None:
         if not merchant_id or not api_key:
             raise ValueError("Nexi/XPay credentials missing")
@@ -30,6 +97,8 @@ class NexiXpayClient:
         self.success_url = success_url
         self.failure_url = failure_url
         self.currency = currency
+        self.notify_url = notify_url
+        self.new_cod_trans = TransactionCodeGenerator(node_id=node_id)
 
     @classmethod
     def from_settings(cls, settings: Any) -> "NexiXpayClient":
@@ -39,6 +108,8 @@ class NexiXpayClient:
             endpoint=settings.nexipay_endpoint,
             success_url=settings.nexipay_success_url,
             failure_url=settings.nexipay_failure_url,
+            node_id=settings.nexipay_node_id or None,
+            notify_url=settings.nexipay_notify_url,
         )
 
     def prepare_payment(
@@ -48,14 +119,17 @@ class NexiXpayClient:
         Costruisce i parametri per il flusso Nexi/XPay verso DispatcherServlet.
 
         amount_cents: importo in centesimi (5000 = 50,00 EUR).
-        order_id: usato come codTrans.
+        order_id: usato come codTrans (vedi `new_cod_trans`), alfanumerico e
+            lungo al massimo 30 caratteri.
         description, email: accettati per compatibilitA , non usati direttamente.
         """
         if amount_cents <= 0:
             raise ValueError("Amount must be greater than zero")
+        valid_chars = order_id.isascii() and order_id.isalnum()
+        if not valid_chars or not 2 <= len(order_id) <= COD_TRANS_MAX_LENGTH:
+            raise ValueError("order_id must be 2-30 alphanumeric characters")
 
-        # Codice transazione nel formato richiesto da Nexi.
-        cod_trans = "PS" + datetime.utcnow().strftime("%Y%m%d%H%M%S")
+        cod_trans = order_id
         divisa = self.currency
         importo = amount_cents
 
@@ -71,9 +145,21 @@ class NexiXpayClient:
             "url_back": self.failure_url,
             "mac": mac,
         }
+        if self.notify_url:
+            payload["urlpost"] = self.notify_url
         if email:
             payload["mail"] = email
 
         redirect_url = self.endpoint
         return NexiPaymentContext(payload=payload, redirect_url=redirect_url)
 
+    def outcome_mac(self, params: Mapping[str, str]) -> str:
+        mac_str = "".join(f"{name}={params.get(name, '')}" for name in OUTCOME_MAC_FIELDS)
+        return hashlib.sha1((mac_str + self.api_key).encode("utf-8")).hexdigest()
+
+    def verify_outcome(self, params: Mapping[str, str]) -> bool:
+        """Verifica il `mac` dell'esito inviato da Nexi (confronto a tempo costante)."""
+        received = params.get("mac")
+        if not received or not params.get("codTrans"):
+            return False
+        return hmac.compare_digest(received.lower(), self.outcome_mac(params))
@@ -0,0 +1,215 @@
+from __future__ import annotations
+
+import argparse
+import logging
+import threading
+from datetime import datetime, timedelta, timezone
+from typing import Callable
+
+from sqlalchemy import func, or_, select, update
+from sqlalchemy.orm import Session
+
+from .catalog import bump_catalog_version
+from .models import MerchItem, Order
+
+logger = logging.getLogger(__name__)
+
+
+class OutOfStock(Exception):
+    """Disponibilità insufficiente per la quantità richiesta."""
+
+
+def _utcnow() -> datetime:
+    return datetime.now(timezone.utc)
+
+
+def _take_stock(session: Session, item_id: int, quantity: int) -> bool:
+    # Decremento atomico: la condizione sullo stock e la scrittura sono un'unica
+    # UPDATE, quindi due checkout concorrenti non possono vendere lo stesso pezzo.
+    # Con stock NULL (non tracciato) la riga passa e NULL - quantity resta NULL.
+    result = session.execute(
+        update(MerchItem)
+        .where(MerchItem.id == item_id, or_(MerchItem.stock.is_(None), MerchItem.stock >= quantity))
+        .values(stock=MerchItem.stock - quantity)
+    )
+    return bool(result.rowcount)
+
+
+def _return_stock(session: Session, item_id: int, quantity: int) -> None:
+    session.execute(
+        update(MerchItem)
+        .where(MerchItem.id == item_id)
+        .values(stock=MerchItem.stock + quantity)
+    )
+
+
+def restock(session: Session, slug: str, add: int | None = None, set_to: int | None = None) -> int | None:
+    """Rifornisce un prodotto e restituisce il nuovo stock; il commit resta al chiamante.
+
+    `add` somma i pezzi arrivati allo stock attuale, in modo atomico rispetto
+    ai checkout in corso; `set_to` lo sovrascrive; senza nessuno dei due lo
+    stock diventa NULL (non tracciato). Solleva `LookupError` se lo slug non
+    esiste. Il catalogo da file non tocca lo stock dei prodotti esistenti:
+    questa è la strada per cambiarlo.
+    """
+    if add is not None and set_to is not None:
+        raise ValueError("Indicare solo uno tra `add` e `set_to`")
+    if (add is not None and add <= 0) or (set_to is not None and set_to < 0):
+        raise ValueError("Quantità non valida")
+    # Su uno stock non tracciato i pezzi arrivati partono da zero.
+    value = func.coalesce(MerchItem.stock, 0) + add if add is not None else set_to
+    result = session.execute(update(MerchItem).where(MerchItem.slug == slug).values(stock=value))
+    if not result.rowcount:
+        raise LookupError(slug)
+    if session.get_bind().dialect.name != "sqlite":
+        bump_catalog_version(session)
+    return session.scalar(select(MerchItem.stock).where(MerchItem.slug == slug))
+
+
+def reserve(
+    session: Session, item: MerchItem, quantity: int, ttl: float, payment_id: int | None = None
+) -> Order:
+    """Scala lo stock e registra un ordine `reserved` fino a `now + ttl`.
+
+    Solleva `OutOfStock` se i pezzi non bastano; il commit resta al chiamante.
+    """
+    if quantity <= 0:
+        raise ValueError("La quantità deve essere positiva")
+    if not _take_stock(session, item.id, quantity):
+        raise OutOfStock(item.slug)
+    order = Order(
+        merch_item_id=item.id,
+        payment_id=payment_id,
+        quantity=quantity,
+        amount_cents=item.price_cents * quantity,
+        status="reserved",
+        expires_at=_utcnow() + timedelta(seconds=ttl),
+    )
+    session.add(order)
+    session.flush()
+    return order
+
+
+def confirm(session: Session, payment_id: int) -> None:
+    """Segna come pagato l'ordine del pagamento; il commit resta al chiamante.
+
+    Se la prenotazione era già scaduta lo stock viene ripreso; in mancanza di
+    pezzi l'ordine resta pagato e va gestito a mano.
+    """
+    order = session.execute(
+        select(Order.id, Order.merch_item_id, Order.quantity, Order.status).where(
+            Order.payment_id == payment_id
+        )
+    ).first()
+    if order is None or order.status == "paid":
+        return
+    if order.status == "released" and not _take_stock(session, order.merch_item_id, order.quantity):
+        logger.error("Ordine %s pagato dopo la scadenza: stock insufficiente", order.id)
+    session.execute(
+        update(Order)
+        .where(Order.id == order.id, Order.status == order.status)
+        .values(status="paid", updated_at=func.now())
+    )
+
+
+def release(session: Session, payment_id: int) -> bool:
+    """Libera la prenotazione del pagamento fallito; il commit resta al chiamante."""
+    order = session.execute(
+        select(Order.id, Order.merch_item_id, Order.quantity).where(
+            Order.payment_id == payment_id, Order.status == "reserved"
+        )
+    ).first()
+    return order is not None and _release(session, order.id, order.merch_item_id, order.quantity)
+
+
+def _release(session: Session, order_id: int, item_id: int, quantity: int) -> bool:
+    result = session.execute(
+        update(Order)
+        .where(Order.id == order_id, Order.status == "reserved")
+        .values(status="released", updated_at=func.now())
+    )
+    if not result.rowcount:
+        return False
+    _return_stock(session, item_id, quantity)
+    return True
+
+
+def release_expired(session: Session, now: datetime | None = None, batch_size: int = 200) -> int:
+    """Libera le prenotazioni scadute a blocchi, un commit per blocco."""
+    now = now or _utcnow()
+    released = 0
+    while True:
+        expired = session.execute(
+            select(Order.id, Order.merch_item_id, Order.quantity)
+            .where(Order.status == "reserved", Order.expires_at < now)
+            .order_by(Order.expires_at)
+            .limit(batch_size)
+        ).all()
+        if not expired:
+            return released
+        for order in expired:
+            released += _release(session, order.id, order.merch_item_id, order.quantity)
+        session.commit()
+
+
+class ReservationSweeper:
+    """Thread in background che restituisce allo stock le prenotazioni scadute."""
+
+    def __init__(self, session_factory: Callable[[], Session], interval: float) -> None:
+        self.session_factory = session_factory
+        self.interval = interval
+        self._stop = threading.Event()
+        self._thread: threading.Thread | None = None
+
+    def run_once(self) -> int:
+        session = self.session_factory()
+        try:
+            released = release_expired(session)
+        except Exception as exc:
+            session.rollback()
+            logger.warning("Pulizia prenotazioni merch interrotta: %s", exc)
+            return 0
+        finally:
+            session.close()
+        if released:
+            logger.info("Prenotazioni merch scadute liberate: %s", released)
+        return released
+
+    def _loop(self) -> None:
+        while not self._stop.wait(self.interval):
+            self.run_once()
+
+    def start(self) -> None:
+        if self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._loop, name="merch-reservations", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+
+
+def main() -> None:
+    from .database import SessionLocal
+
+    parser = argparse.ArgumentParser(description="Stock dei prodotti merch")
+    parser.add_argument("slug")
+    group = parser.add_mutually_exclusive_group(required=True)
+    group.add_argument("--add", type=int, help="pezzi arrivati, sommati allo stock attuale")
+    group.add_argument("--set", dest="set_to", type=int, help="nuovo stock")
+    group.add_argument("--untracked", action="store_true", help="stock non tracciato (NULL)")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    with SessionLocal() as session:
+        try:
+            stock = restock(session, args.slug, add=args.add, set_to=args.set_to)
+        except LookupError:
+            parser.error(f"prodotto non trovato: {args.slug}")
+        except ValueError as exc:
+            parser.error(str(exc))
+        session.commit()
+    print(f"{args.slug}: stock {'non tracciato' if stock is None else stock}")
+
+
+if __name__ == "__main__":
+    main()
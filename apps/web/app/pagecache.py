@@ -0,0 +1,102 @@
+from __future__ import annotations
+
+import hashlib
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Hashable
+
+
+@dataclass(frozen=True)
+class TemplateFingerprint:
+    digest: str
+    modified_at: datetime
+
+
+def template_fingerprint(directory: Path) -> TemplateFingerprint:
+    """Hash e data di modifica più recente di tutti i template in `directory`.
+
+    Si calcola una volta all'avvio: i template includono ed estendono altri
+    file, quindi conta l'intera cartella e non il singolo template.
+    """
+    digest = hashlib.blake2b(digest_size=16)
+    latest = 0.0
+    for path in sorted(directory.rglob("*")):
+        if not path.is_file():
+            continue
+        digest.update(path.relative_to(directory).as_posix().encode())
+        digest.update(path.read_bytes())
+        latest = max(latest, path.stat().st_mtime)
+    return TemplateFingerprint(
+        digest=digest.hexdigest(), modified_at=datetime.fromtimestamp(latest, timezone.utc)
+    )
+
+
+def page_etag(key: Hashable, fingerprint: TemplateFingerprint) -> str:
+    """ETag debole derivato dalla chiave della pagina, senza renderizzarla."""
+    digest = hashlib.blake2b(repr(key).encode(), digest_size=12, key=fingerprint.digest.encode())
+    return f'W/"{digest.hexdigest()}"'
+
+
+@dataclass
+class PageCacheStats:
+    hits: int = 0
+    misses: int = 0
+    bypasses: int = 0
+    evictions: int = 0
+    entries: int = 0
+    bytes: int = 0
+
+
+class PageCache:
+    """Cache LRU delle pagine già renderizzate, limitata in byte.
+
+    La chiave deve contenere tutto ciò da cui dipende l'HTML (template,
+    parametri, versione dei dati): una versione nuova produce chiavi nuove e le
+    pagine vecchie escono per LRU. Le pagine più grandi di `max_entry_bytes`
+    non vengono memorizzate; con `max_bytes=0` la cache è disattivata.
+    """
+
+    def __init__(self, max_bytes: int, max_entry_bytes: int | None = None) -> None:
+        self.max_bytes = max_bytes
+        self.max_entry_bytes = max_entry_bytes or max(max_bytes // 8, 1)
+        self._entries: OrderedDict[Hashable, bytes] = OrderedDict()
+        self._lock = threading.Lock()
+        self.stats = PageCacheStats()
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_bytes > 0
+
+    def get(self, key: Hashable) -> bytes | None:
+        with self._lock:
+            body = self._entries.get(key)
+            if body is None:
+                self.stats.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.stats.hits += 1
+            return body
+
+    def put(self, key: Hashable, body: bytes) -> None:
+        if not self.enabled or len(body) > self.max_entry_bytes:
+            return
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self.stats.bytes -= len(previous)
+            self._entries[key] = body
+            self.stats.bytes += len(body)
+            while self.stats.bytes > self.max_bytes:
+                _key, evicted = self._entries.popitem(last=False)
+                self.stats.bytes -= len(evicted)
+                self.stats.evictions += 1
+            self.stats.entries = len(self._entries)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self.stats.bytes = 0
+            self.stats.entries = 0
@@ -0,0 +1,182 @@
+from __future__ import annotations
+
+from typing import Any, Callable
+
+from sqlalchemy import func, select, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from . import orders
+from .models import Member, Payment
+
+PAYMENT_KINDS = ("merch", "membership")
+CREATE_ATTEMPTS = 5
+
+# Stati da cui si può arrivare a ciascun esito: `paid` è definitivo, mentre un
+# `failed` può ancora diventare `paid` (es. KO seguito da un nuovo tentativo OK
+# sullo stesso codTrans, o notifiche arrivate fuori ordine).
+TRANSITIONS: dict[str, tuple[str, ...]] = {
+    "paid": ("pending", "failed"),
+    "failed": ("pending",),
+}
+PAID_OUTCOMES = {"OK"}
+FAILED_OUTCOMES = {"KO", "ANNULLO", "ERRORE"}
+
+APPLIED = "applied"
+DUPLICATE = "duplicate"
+IGNORED = "ignored"
+UNKNOWN = "unknown"
+AMOUNT_MISMATCH = "amount_mismatch"
+
+
+class PaymentCodeCollision(RuntimeError):
+    """Nessun `codTrans` libero dopo `CREATE_ATTEMPTS` tentativi."""
+
+
+def create_payment(
+    session: Session,
+    new_cod_trans: Callable[[], str],
+    kind: str,
+    amount_cents: int,
+    **fields: Any,
+) -> Payment:
+    """Registra un pagamento `pending` con un `codTrans` nuovo.
+
+    Il vincolo `UNIQUE` su `cod_trans` è l'ultima difesa contro due worker
+    con lo stesso nodo: in caso di conflitto si genera un altro codice dentro
+    un savepoint. Il commit resta al chiamante.
+    """
+    if kind not in PAYMENT_KINDS:
+        raise ValueError(f"Tipo di pagamento sconosciuto: {kind}")
+    for _attempt in range(CREATE_ATTEMPTS):
+        payment = Payment(
+            cod_trans=new_cod_trans(),
+            kind=kind,
+            status="pending",
+            amount_cents=amount_cents,
+            **fields,
+        )
+        try:
+            with session.begin_nested():
+                session.add(payment)
+        except IntegrityError:
+            continue
+        return payment
+    raise PaymentCodeCollision("Impossibile generare un codTrans univoco")
+
+
+def find_payment(session: Session, cod_trans: str) -> Payment | None:
+    return session.scalars(select(Payment).where(Payment.cod_trans == cod_trans)).first()
+
+
+def find_pending_payment(
+    session: Session, kind: str, member_id: int, amount_cents: int
+) -> Payment | None:
+    """Ultimo pagamento ancora `pending` del socio per lo stesso importo.
+
+    Ricaricare la pagina di pagamento riusa il suo `codTrans` invece di
+    registrarne uno nuovo a ogni visita.
+    """
+    return session.scalars(
+        select(Payment)
+        .where(
+            Payment.kind == kind,
+            Payment.member_id == member_id,
+            Payment.amount_cents == amount_cents,
+            Payment.status == "pending",
+        )
+        .order_by(Payment.id.desc())
+        .limit(1)
+    ).first()
+
+
+def outcome_target(outcome: str) -> str | None:
+    """Stato del pagamento corrispondente a un `esito` Nexi (None se da ignorare)."""
+    outcome = outcome.strip().upper()
+    if outcome in PAID_OUTCOMES:
+        return "paid"
+    if outcome in FAILED_OUTCOMES:
+        return "failed"
+    return None
+
+
+def transition_payment(
+    session: Session,
+    payment_id: int,
+    target: str,
+    outcome: str,
+    auth_code: str | None = None,
+) -> bool:
+    """UPDATE condizionata sullo stato corrente; il commit resta al chiamante."""
+    result = session.execute(
+        update(Payment)
+        .where(Payment.id == payment_id, Payment.status.in_(TRANSITIONS[target]))
+        .values(
+            status=target,
+            outcome=outcome.strip().upper(),
+            auth_code=auth_code or None,
+            notified_at=func.now(),
+            updated_at=func.now(),
+        )
+    )
+    return bool(result.rowcount)
+
+
+def settle_payment(session: Session, payment: Any, target: str) -> None:
+    """Effetti di una transizione riuscita su socio e ordine merch.
+
+    `payment` è una riga con `id`, `cod_trans`, `kind` e `member_id`; il commit
+    resta al chiamante.
+    """
+    if payment.kind == "membership" and payment.member_id and target == "paid":
+        session.execute(
+            update(Member)
+            .where(Member.id == payment.member_id)
+            .values(payment_status="paid", payment_reference=payment.cod_trans)
+        )
+    elif payment.kind == "merch":
+        if target == "paid":
+            orders.confirm(session, payment.id)
+        else:
+            orders.release(session, payment.id)
+
+
+def apply_outcome(
+    session: Session,
+    cod_trans: str,
+    outcome: str,
+    amount_cents: int | None = None,
+    auth_code: str | None = None,
+) -> str:
+    """Applica l'esito Nexi (`esito`) al pagamento, una sola volta.
+
+    Le notifiche ripetute trovano lo stato già aggiornato con una SELECT e non
+    aprono transazioni di scrittura; la UPDATE condizionata sullo stato
+    garantisce che, tra due notifiche concorrenti, una sola faccia effetto.
+    """
+    target = outcome_target(outcome)
+    if target is None:
+        return IGNORED
+    current = session.execute(
+        select(
+            Payment.id,
+            Payment.cod_trans,
+            Payment.status,
+            Payment.amount_cents,
+            Payment.kind,
+            Payment.member_id,
+        ).where(Payment.cod_trans == cod_trans)
+    ).first()
+    if current is None:
+        return UNKNOWN
+    if amount_cents is not None and amount_cents != current.amount_cents:
+        return AMOUNT_MISMATCH
+    if current.status not in TRANSITIONS[target]:
+        return DUPLICATE
+
+    if not transition_payment(session, current.id, target, outcome, auth_code):
+        session.rollback()
+        return DUPLICATE
+    settle_payment(session, current, target)
+    session.commit()
+    return APPLIED
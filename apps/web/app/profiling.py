@@ -0,0 +1,342 @@
+from __future__ import annotations
+
+import argparse
+import json
+import logging
+import random
+import re
+import secrets
+import sys
+import threading
+import time
+from collections import Counter
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from pathlib import Path
+from types import CodeType, FrameType
+from typing import Any, Iterable
+
+import anyio
+from starlette.datastructures import MutableHeaders
+from starlette.requests import HTTPConnection
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from .metrics import route_template
+
+logger = logging.getLogger(__name__)
+
+PROFILE_HEADER = "x-profile"
+PROFILE_ID_HEADER = "X-Profile-Id"
+MAX_STACK_DEPTH = 200
+
+
+def _frame_label(frame: FrameType) -> str:
+    code = frame.f_code
+    return f"{code.co_name} ({Path(code.co_filename).name}:{code.co_firstlineno})"
+
+
+def _owns_frame(frame: FrameType, scope: Scope, entry: CodeType) -> bool:
+    """Il frame appartiene alla richiesta `scope`?
+
+    Nel thread dell'event loop cerca il `__call__` del middleware che serve
+    quella richiesta; nei thread del threadpool (route sincrone) il frame
+    della route, che riceve la stessa `request`.
+    """
+    # f_locals solo sui frame candidati: leggerlo costa una copia delle variabili.
+    if frame.f_code is entry:
+        return frame.f_locals.get("scope") is scope
+    if "request" not in frame.f_code.co_varnames:
+        return False
+    request = frame.f_locals.get("request")
+    return isinstance(request, HTTPConnection) and request.scope is scope
+
+
+class StackSampler:
+    """Campiona ogni `interval` secondi gli stack dei thread che servono una richiesta.
+
+    A differenza di cProfile vede anche il threadpool delle route sincrone;
+    gli stack vengono salvati in formato "collapsed" (una riga per stack,
+    frame separati da `;`, seguiti dal numero di campioni).
+    """
+
+    def __init__(self, scope: Scope, entry: CodeType, interval: float) -> None:
+        self.scope = scope
+        self.entry = entry
+        self.interval = interval
+        self.stacks: Counter[str] = Counter()
+        self.samples = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="request-profiler", daemon=True)
+
+    def _sample(self) -> None:
+        own = threading.get_ident()
+        for ident, frame in sys._current_frames().items():
+            if ident == own:
+                continue
+            stack: list[FrameType] = []
+            current: FrameType | None = frame
+            while current is not None and len(stack) < MAX_STACK_DEPTH:
+                stack.append(current)
+                current = current.f_back
+            # Dalla radice: si parte dal frame della richiesta e si scarta il resto.
+            for index in range(len(stack) - 1, -1, -1):
+                if _owns_frame(stack[index], self.scope, self.entry):
+                    labels = [_frame_label(item) for item in reversed(stack[: index + 1])]
+                    self.stacks[";".join(labels)] += 1
+                    self.samples += 1
+                    break
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval):
+            self._sample()
+
+    def start(self) -> None:
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        self._thread.join()
+
+
+@dataclass
+class ProfileRecord:
+    id: str
+    method: str
+    route: str
+    path: str
+    status: int
+    duration_ms: float
+    samples: int
+    interval_ms: float
+    created_at: str
+
+
+class ProfileStore:
+    """Cartella dei profili: `<id>.folded` più `<id>.json` con i metadati.
+
+    Dopo ogni scrittura i file più vecchi vengono cancellati finché la
+    cartella non scende sotto `max_bytes`.
+    """
+
+    def __init__(self, directory: Path, max_bytes: int) -> None:
+        self.directory = directory
+        self.max_bytes = max_bytes
+
+    def write(self, record: ProfileRecord, stacks: Counter[str]) -> None:
+        self.directory.mkdir(parents=True, exist_ok=True)
+        folded = "".join(f"{stack} {count}\n" for stack, count in stacks.most_common())
+        (self.directory / f"{record.id}.folded").write_text(folded, encoding="utf-8")
+        (self.directory / f"{record.id}.json").write_text(
+            json.dumps(record.__dict__), encoding="utf-8"
+        )
+        self.rotate()
+
+    def rotate(self) -> int:
+        files = []
+        for path in self.directory.glob("*.*"):
+            try:
+                stat = path.stat()
+            except FileNotFoundError:
+                continue
+            files.append((stat.st_mtime, stat.st_size, path))
+        total = sum(size for _mtime, size, _path in files)
+        removed = 0
+        for _mtime, size, path in sorted(files):
+            if total <= self.max_bytes:
+                break
+            path.unlink(missing_ok=True)
+            total -= size
+            removed += 1
+        return removed
+
+    def records(self) -> list[ProfileRecord]:
+        records = []
+        for path in sorted(self.directory.glob("*.json")):
+            try:
+                records.append(ProfileRecord(**json.loads(path.read_text(encoding="utf-8"))))
+            except (OSError, ValueError, TypeError):
+                continue
+        return records
+
+    def stacks(self, record: ProfileRecord) -> Counter[str]:
+        stacks: Counter[str] = Counter()
+        try:
+            lines = (self.directory / f"{record.id}.folded").read_text(encoding="utf-8").splitlines()
+        except FileNotFoundError:
+            return stacks
+        for line in lines:
+            stack, _, count = line.rpartition(" ")
+            if stack and count.isdigit():
+                stacks[stack] += int(count)
+        return stacks
+
+
+def _profile_id(method: str, route: str) -> str:
+    slug = re.sub(r"[^A-Za-z0-9]+", "-", route).strip("-") or "root"
+    stamp = datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%S%f")
+    return f"{stamp}-{method.lower()}-{slug}-{secrets.token_hex(3)}"
+
+
+class ProfilingMiddleware:
+    """Profila su richiesta singole chiamate HTTP, su opt-in.
+
+    Una richiesta viene profilata se porta l'header `X-Profile` uguale a
+    `secret`, oppure con probabilità `sample_rate`. Una sola richiesta alla
+    volta: le altre passano senza profilazione. Il profilo finisce in
+    `store` e l'id viene restituito nell'header `X-Profile-Id`. Se il
+    middleware non è installato il costo è nullo.
+    """
+
+    def __init__(
+        self,
+        app: ASGIApp,
+        store: ProfileStore,
+        secret: str | None = None,
+        sample_rate: float = 0.0,
+        interval: float = 0.001,
+    ) -> None:
+        self.app = app
+        self.store = store
+        self.secret = secret
+        self.sample_rate = sample_rate
+        self.interval = interval
+        self._busy = threading.Lock()
+
+    def _wanted(self, scope: Scope) -> bool:
+        if self.secret:
+            header = HTTPConnection(scope).headers.get(PROFILE_HEADER)
+            if header is not None and secrets.compare_digest(header.encode(), self.secret.encode()):
+                return True
+        return self.sample_rate > 0 and random.random() < self.sample_rate
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http" or not self._wanted(scope) or not self._busy.acquire(blocking=False):
+            await self.app(scope, receive, send)
+            return
+        try:
+            await self._profile(scope, receive, send)
+        finally:
+            self._busy.release()
+
+    async def _profile(self, scope: Scope, receive: Receive, send: Send) -> None:
+        status_code = 500
+        profile_id = ""
+
+        async def send_wrapper(message: Message) -> None:
+            nonlocal status_code, profile_id
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+                profile_id = _profile_id(scope["method"], route_template(scope))
+                MutableHeaders(scope=message)[PROFILE_ID_HEADER] = profile_id
+            await send(message)
+
+        sampler = StackSampler(scope, ProfilingMiddleware.__call__.__code__, self.interval)
+        started = time.perf_counter()
+        sampler.start()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            sampler.stop()
+            duration = time.perf_counter() - started
+            record = ProfileRecord(
+                id=profile_id or _profile_id(scope["method"], route_template(scope)),
+                method=scope["method"],
+                route=route_template(scope),
+                path=scope["path"],
+                status=status_code,
+                duration_ms=round(duration * 1000, 2),
+                samples=sampler.samples,
+                interval_ms=self.interval * 1000,
+                created_at=datetime.now(timezone.utc).isoformat(),
+            )
+            try:
+                await anyio.to_thread.run_sync(self.store.write, record, sampler.stacks)
+            except OSError as exc:
+                logger.warning("Profilo %s non salvato: %s", record.id, exc)
+
+
+def _leaf(stack: str) -> str:
+    return stack.rsplit(";", 1)[-1]
+
+
+def aggregate(store: ProfileStore, route: str | None = None, top: int = 10) -> list[dict[str, Any]]:
+    """Riepilogo per route: durate e funzioni con più campioni (self e totali)."""
+    by_route: dict[tuple[str, str], list[ProfileRecord]] = {}
+    for record in store.records():
+        if route is None or record.route == route:
+            by_route.setdefault((record.method, record.route), []).append(record)
+
+    report = []
+    for (method, route_path), records in sorted(by_route.items()):
+        self_samples: Counter[str] = Counter()
+        total_samples: Counter[str] = Counter()
+        samples = 0
+        for record in records:
+            for stack, count in store.stacks(record).items():
+                samples += count
+                self_samples[_leaf(stack)] += count
+                for frame in set(stack.split(";")):
+                    total_samples[frame] += count
+        durations = sorted(record.duration_ms for record in records)
+        report.append(
+            {
+                "method": method,
+                "route": route_path,
+                "profiles": len(records),
+                "samples": samples,
+                "median_ms": durations[len(durations) // 2],
+                "max_ms": durations[-1],
+                "self": [
+                    {"frame": frame, "pct": round(100 * count / samples, 1)}
+                    for frame, count in self_samples.most_common(top)
+                ]
+                if samples
+                else [],
+                "total": [
+                    {"frame": frame, "pct": round(100 * count / samples, 1)}
+                    for frame, count in total_samples.most_common(top)
+                ]
+                if samples
+                else [],
+            }
+        )
+    return report
+
+
+def merge(store: ProfileStore, route: str | None = None) -> Iterable[str]:
+    """Unisce gli stack di più profili in un unico file collapsed."""
+    stacks: Counter[str] = Counter()
+    for record in store.records():
+        if route is None or record.route == route:
+            stacks.update(store.stacks(record))
+    for stack, count in stacks.most_common():
+        yield f"{stack} {count}\n"
+
+
+def main(argv: list[str] | None = None) -> None:
+    from .config import settings
+
+    parser = argparse.ArgumentParser(description="Riepiloga i profili salvati da ProfilingMiddleware.")
+    parser.add_argument("command", choices=("report", "merge"))
+    parser.add_argument(
+        "--dir", type=Path, default=Path(__file__).resolve().parent / settings.profiling_path
+    )
+    parser.add_argument("--route", help="solo questa route, es. /merch/{slug}")
+    parser.add_argument("--top", type=int, default=10)
+    parser.add_argument("-o", "--output", type=Path, help="file di destinazione per merge")
+    args = parser.parse_args(argv)
+
+    store = ProfileStore(args.dir, max_bytes=settings.profiling_max_bytes)
+    if args.command == "report":
+        print(json.dumps(aggregate(store, args.route, args.top), indent=2, ensure_ascii=False))
+        return
+    lines = merge(store, args.route)
+    if args.output:
+        with args.output.open("w", encoding="utf-8") as out:
+            out.writelines(lines)
+    else:
+        sys.stdout.writelines(lines)
+
+
+if __name__ == "__main__":
+    main()
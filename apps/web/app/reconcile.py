@@ -0,0 +1,429 @@
+from __future__ import annotations
+
+import argparse
+import codecs
+import csv
+import io
+import json
+import logging
+import os
+from dataclasses import asdict, dataclass, field
+from decimal import Decimal, InvalidOperation
+from pathlib import Path
+from typing import BinaryIO, Iterator, Mapping
+
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+
+from .models import Payment
+from .nexi import OUTCOME_MAC_FIELDS, NexiXpayClient
+from .payments import TRANSITIONS, outcome_target, settle_payment, transition_payment
+
+logger = logging.getLogger(__name__)
+
+# Intestazioni accettate per ogni colonna dell'estratto conto XPay (minuscole).
+COLUMN_ALIASES: dict[str, tuple[str, ...]] = {
+    "cod_trans": ("codtrans", "codice transazione", "cod. transazione", "cod_trans"),
+    "outcome": ("esito", "stato", "outcome"),
+    "amount": ("importo", "amount"),
+    "auth_code": ("codaut", "codice autorizzazione", "cod. autorizzazione", "auth_code"),
+}
+# Etichette del back-office ricondotte agli `esito` della notifica.
+OUTCOME_ALIASES = {
+    "AUTORIZZATO": "OK",
+    "AUTORIZZATA": "OK",
+    "CONTABILIZZATO": "OK",
+    "CONTABILIZZATA": "OK",
+    "NEGATO": "KO",
+    "NEGATA": "KO",
+    "RIFIUTATO": "KO",
+    "ANNULLATO": "ANNULLO",
+}
+REPORT_FIELDS = [
+    "line",
+    "cod_trans",
+    "reason",
+    "statement_outcome",
+    "statement_amount",
+    "local_status",
+    "local_amount",
+]
+
+
+@dataclass
+class ReconcileStats:
+    rows: int = 0
+    matched: int = 0
+    updated: int = 0
+    unchanged: int = 0
+    mismatches: int = 0
+    batches: int = 0
+
+
+@dataclass
+class Checkpoint:
+    """Posizione (in byte) dopo l'ultimo batch committato."""
+
+    source: str
+    size: int
+    mtime: float
+    header: list[str]
+    delimiter: str
+    offset: int
+    line: int
+    report_offset: int = 0
+    stats: ReconcileStats = field(default_factory=ReconcileStats)
+
+    def save(self, path: Path) -> None:
+        tmp_path = path.with_name(path.name + ".tmp")
+        tmp_path.write_text(json.dumps(asdict(self)), encoding="utf-8")
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path: Path) -> "Checkpoint | None":
+        try:
+            data = json.loads(path.read_text(encoding="utf-8"))
+        except (OSError, ValueError):
+            return None
+        data["stats"] = ReconcileStats(**data.get("stats", {}))
+        return cls(**data)
+
+
+@dataclass(frozen=True)
+class StatementRow:
+    line: int
+    cod_trans: str
+    outcome: str
+    amount_cents: int | None
+    auth_code: str
+    raw: Mapping[str, str]
+
+
+def parse_amount(value: str) -> int | None:
+    """`50,00`/`50.00` sono euro, `5000` senza separatori sono centesimi (come Nexi)."""
+    value = value.strip().replace("€", "").replace(" ", "")
+    if not value:
+        return None
+    try:
+        if "," in value or "." in value:
+            if "," in value:
+                value = value.replace(".", "").replace(",", ".")
+            return int((Decimal(value) * 100).to_integral_value())
+        return int(value)
+    except (InvalidOperation, ValueError):
+        return None
+
+
+def _iter_records(handle: BinaryIO) -> Iterator[tuple[int, bytes]]:
+    """Restituisce (offset di fine, byte) per ogni record CSV.
+
+    Si legge in binario per poter riprendere da un offset; un record continua
+    sulla riga successiva finché ha virgolette aperte. La decodifica è del
+    chiamante, così una riga con byte non validi non ferma tutto il file.
+    """
+    pending = b""
+    for raw in handle:
+        pending += raw
+        if pending.count(b'"') % 2:
+            continue
+        yield handle.tell(), pending
+        pending = b""
+    if pending:
+        yield handle.tell(), pending
+
+
+def _undecodable_row(line: int) -> StatementRow:
+    return StatementRow(
+        line=line, cod_trans="", outcome="", amount_cents=None, auth_code="", raw={}
+    )
+
+
+def _mac_params(raw: Mapping[str, str]) -> dict[str, str]:
+    # Se l'export include il MAC dell'esito lo si verifica come per la notifica.
+    params = {name: raw.get(name.lower(), "").strip() for name in OUTCOME_MAC_FIELDS}
+    params["mac"] = raw.get("mac", "").strip()
+    return params
+
+
+class StatementReconciler:
+    """Allinea `payments` all'estratto conto XPay in CSV.
+
+    Il file viene letto in streaming a batch di `batch_size` righe: per ogni
+    batch una SELECT con `IN (...)` sui codici e un'unica transazione con le
+    UPDATE condizionate (stesse transizioni della notifica). Dopo ogni commit
+    l'offset raggiunto va nel checkpoint, quindi un'esecuzione interrotta
+    riparte dal batch successivo. Le discrepanze finiscono nel report CSV.
+    """
+
+    def __init__(
+        self,
+        session: Session,
+        batch_size: int = 500,
+        dry_run: bool = False,
+        client: NexiXpayClient | None = None,
+        encoding: str = "utf-8-sig",
+    ) -> None:
+        self.session = session
+        self.batch_size = batch_size
+        self.dry_run = dry_run
+        self.client = client
+        self.encoding = encoding
+
+    def run(self, source: Path, report_path: Path, checkpoint_path: Path | None = None) -> ReconcileStats:
+        stat = source.stat()
+        checkpoint = Checkpoint.load(checkpoint_path) if checkpoint_path else None
+        if checkpoint and (
+            checkpoint.source != str(source.resolve())
+            or checkpoint.size != stat.st_size
+            or checkpoint.mtime != stat.st_mtime
+        ):
+            logger.warning("Checkpoint di un altro file: si riparte dall'inizio")
+            checkpoint = None
+        if checkpoint and report_path.exists():
+            # Scarta le righe di report scritte dopo l'ultimo commit.
+            os.truncate(report_path, checkpoint.report_offset)
+
+        with source.open("rb") as handle, report_path.open(
+            "a" if checkpoint else "w", newline="", encoding="utf-8"
+        ) as report_file:
+            report = csv.DictWriter(report_file, fieldnames=REPORT_FIELDS)
+            if checkpoint is None:
+                report.writeheader()
+                checkpoint = self._read_header(handle, source, stat)
+            else:
+                logger.info("Ripresa dalla riga %s", checkpoint.line)
+                handle.seek(checkpoint.offset)
+
+            stats = checkpoint.stats
+            batch: list[StatementRow] = []
+            for offset, record in _iter_records(handle):
+                checkpoint.line += 1
+                try:
+                    text = record.decode(self.encoding)
+                except UnicodeDecodeError:
+                    stats.rows += 1
+                    stats.mismatches += 1
+                    self._mismatch(report, _undecodable_row(checkpoint.line), "decode_error")
+                    continue
+                values = next(csv.reader(io.StringIO(text), delimiter=checkpoint.delimiter), [])
+                if not any(value.strip() for value in values):
+                    continue
+                row = self._row(checkpoint, values, report)
+                stats.rows += 1
+                if row is None:
+                    stats.mismatches += 1
+                else:
+                    batch.append(row)
+                if len(batch) >= self.batch_size:
+                    self._apply_batch(batch, stats, report)
+                    batch = []
+                    self._commit(checkpoint, offset, report_file, checkpoint_path)
+            if batch:
+                self._apply_batch(batch, stats, report)
+            self._commit(checkpoint, handle.tell(), report_file, checkpoint_path)
+        if checkpoint_path:
+            checkpoint_path.unlink(missing_ok=True)
+        return stats
+
+    def _read_header(self, handle: BinaryIO, source: Path, stat: os.stat_result) -> Checkpoint:
+        offset, record = next(_iter_records(handle), (0, b""))
+        try:
+            text = record.decode(self.encoding)
+        except UnicodeDecodeError as exc:
+            raise ValueError(
+                f"Intestazione non leggibile come {self.encoding}: usare --encoding"
+            ) from exc
+        delimiter = ";" if text.count(";") > text.count(",") else ","
+        header = [name.strip().lower() for name in next(csv.reader([text], delimiter=delimiter), [])]
+        checkpoint = Checkpoint(
+            source=str(source.resolve()),
+            size=stat.st_size,
+            mtime=stat.st_mtime,
+            header=header,
+            delimiter=delimiter,
+            offset=offset,
+            line=1,
+        )
+        missing = [name for name in ("cod_trans", "outcome") if self._column(checkpoint, name) is None]
+        if missing:
+            raise ValueError(f"Colonne mancanti nell'estratto conto: {', '.join(missing)}")
+        return checkpoint
+
+    @staticmethod
+    def _column(checkpoint: Checkpoint, name: str) -> int | None:
+        for alias in COLUMN_ALIASES[name]:
+            if alias in checkpoint.header:
+                return checkpoint.header.index(alias)
+        return None
+
+    def _row(
+        self, checkpoint: Checkpoint, values: list[str], report: csv.DictWriter
+    ) -> StatementRow | None:
+        def value(name: str) -> str:
+            index = self._column(checkpoint, name)
+            return values[index].strip() if index is not None and index < len(values) else ""
+
+        raw = dict(zip(checkpoint.header, values))
+        outcome = value("outcome").upper()
+        outcome = OUTCOME_ALIASES.get(outcome, outcome)
+        row = StatementRow(
+            line=checkpoint.line,
+            cod_trans=value("cod_trans"),
+            outcome=outcome,
+            amount_cents=parse_amount(value("amount")),
+            auth_code=value("auth_code"),
+            raw=raw,
+        )
+        reason = None
+        if not row.cod_trans:
+            reason = "missing_cod_trans"
+        elif outcome_target(row.outcome) is None:
+            reason = "unsupported_outcome"
+        elif self.client and "mac" in raw and not self.client.verify_outcome(_mac_params(raw)):
+            reason = "invalid_mac"
+        if reason:
+            self._mismatch(report, row, reason)
+            return None
+        return row
+
+    def _mismatch(
+        self,
+        report: csv.DictWriter,
+        row: StatementRow,
+        reason: str,
+        local_status: str | None = None,
+        local_amount: int | None = None,
+    ) -> None:
+        report.writerow(
+            {
+                "line": row.line,
+                "cod_trans": row.cod_trans,
+                "reason": reason,
+                "statement_outcome": row.outcome,
+                "statement_amount": row.amount_cents,
+                "local_status": local_status,
+                "local_amount": local_amount,
+            }
+        )
+
+    def _apply_batch(
+        self, batch: list[StatementRow], stats: ReconcileStats, report: csv.DictWriter
+    ) -> None:
+        session = self.session
+        codes = {row.cod_trans for row in batch}
+        payments = {
+            item.cod_trans: item
+            for item in session.execute(
+                select(
+                    Payment.id,
+                    Payment.cod_trans,
+                    Payment.status,
+                    Payment.amount_cents,
+                    Payment.kind,
+                    Payment.member_id,
+                ).where(Payment.cod_trans.in_(codes))
+            )
+        }
+        stats.batches += 1
+        for row in batch:
+            target = outcome_target(row.outcome)
+            payment = payments.get(row.cod_trans)
+            if payment is None:
+                # Anche i pagamenti precedenti al registro `payments`: il loro
+                # codTrans non è stato salvato da nessuna parte (in
+                # `payment_reference` c'era `member-<id>-<uuid>`), quindi si
+                # riconciliano a mano.
+                stats.mismatches += 1
+                self._mismatch(report, row, "not_found")
+                continue
+
+            stats.matched += 1
+            if row.amount_cents is not None and row.amount_cents != payment.amount_cents:
+                stats.mismatches += 1
+                self._mismatch(
+                    report, row, "amount_mismatch", payment.status, payment.amount_cents
+                )
+                continue
+            if payment.status == target:
+                stats.unchanged += 1
+                continue
+            if payment.status not in TRANSITIONS[target]:
+                # Es. `paid` in locale ma KO sull'estratto: da verificare a mano.
+                stats.mismatches += 1
+                self._mismatch(
+                    report, row, "status_conflict", payment.status, payment.amount_cents
+                )
+                continue
+            if self.dry_run or transition_payment(
+                session, payment.id, target, row.outcome, row.auth_code
+            ):
+                stats.updated += 1
+                if not self.dry_run:
+                    settle_payment(session, payment, target)
+            else:
+                stats.unchanged += 1
+
+    def _commit(
+        self,
+        checkpoint: Checkpoint,
+        offset: int,
+        report_file: io.TextIOBase,
+        checkpoint_path: Path | None,
+    ) -> None:
+        if self.dry_run:
+            self.session.rollback()
+        else:
+            self.session.commit()
+        report_file.flush()
+        checkpoint.offset = offset
+        checkpoint.report_offset = report_file.tell()
+        if checkpoint_path:
+            checkpoint.save(checkpoint_path)
+
+
+def main() -> None:
+    from .config import settings
+    from .database import SessionLocal
+
+    parser = argparse.ArgumentParser(description="Riconciliazione con l'estratto conto XPay")
+    parser.add_argument("statement", type=Path, help="CSV esportato dal back-office XPay")
+    parser.add_argument("--report", type=Path, default=Path("riconciliazione-discrepanze.csv"))
+    parser.add_argument("--checkpoint", type=Path, help="default: <statement>.checkpoint.json")
+    parser.add_argument("--batch-size", type=int, default=500)
+    parser.add_argument("--dry-run", action="store_true")
+    parser.add_argument("--restart", action="store_true", help="ignora il checkpoint esistente")
+    parser.add_argument(
+        "--encoding", default="utf-8-sig", help="codifica del CSV, es. cp1252 (default: utf-8-sig)"
+    )
+    args = parser.parse_args()
+    try:
+        codecs.lookup(args.encoding)
+    except LookupError:
+        parser.error(f"codifica sconosciuta: {args.encoding}")
+    logging.basicConfig(level=logging.INFO)
+
+    checkpoint_path = args.checkpoint or args.statement.with_name(
+        args.statement.name + ".checkpoint.json"
+    )
+    if args.restart:
+        checkpoint_path.unlink(missing_ok=True)
+    try:
+        client = NexiXpayClient.from_settings(settings)
+    except ValueError:
+        client = None
+    session = SessionLocal()
+    try:
+        reconciler = StatementReconciler(
+            session, args.batch_size, args.dry_run, client, encoding=args.encoding
+        )
+        stats = reconciler.run(
+            args.statement, args.report, None if args.dry_run else checkpoint_path
+        )
+    finally:
+        session.close()
+    print(json.dumps(asdict(stats), indent=2))
+    print(f"Discrepanze: {args.report}")
+
+
+if __name__ == "__main__":
+    main()
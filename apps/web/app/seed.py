@@ -1,137 +1,215 @@
 from __future__ import annotations
 
+import json
+import logging
+import os
+import threading
+from dataclasses import dataclass
 from datetime import date
+from pathlib import Path
+from typing import Any, Callable
 
+from sqlalchemy import Date, insert, or_, select, update
+from sqlalchemy.exc import SQLAlchemyError
 from sqlalchemy.orm import Session
 
+from .catalog import bump_catalog_version
 from .models import Event, MerchItem
 
-SAMPLE_EVENTS = [
-    {
-        "slug": "Quarto Giro d'Amaro 2026",
-        "title": "Quarto Giro d'Amaro 2026",
-        "description": "Giro lungo, giro corto e anche medio. Oltrepò Piacentino.",
-        "location": "Piozzano (PC)",
-        "date": date(2026, 5, 13),
-        "hero_quote": "A tutta.",
-        "summary": "Giornata di festa dell'Amaro.",
-    },
-]
-
-SAMPLE_MERCH = SAMPLE_MERCH = [
-    {
-        "slug": "maglia-bici-racing-aero",
-        "name": "Maglia Bici Racing/Aero",
-        "description": (
-            "Maglia bici modello Racing/Aero, ispirata ai colori Amaro, "
-            "pensata per le uscite più veloci e le granfondo."
-        ),
-        "price_cents": 7500,  # 75 euro
-        "stock": 0,
-        "image_url": "img/maglia-bici-racing-aero.jpg",
-    },
-    {
-        "slug": "maglia-bici-amateur",
-        "name": "Maglia Bici Amateur",
-        "description": (
-            "Maglia bici modello Amateur, più confortevole ma sempre con "
-            "grafica Amaro e taglio tecnico."
-        ),
-        "price_cents": 5500,  # 55 euro
-        "stock": 0,
-        "image_url": "img/maglia-bici-amateur.jpg",
-    },
-    {
-        "slug": "bib-racing-pro",
-        "name": "Bib Racing/Pro",
-        "description": (
-            "Pantaloncino con bretelle modello Racing/Pro, fondello ad alte "
-            "prestazioni per uscite e gare lunghe."
-        ),
-        "price_cents": 8500,  # 85 euro
-        "stock": 0,
-        "image_url": "img/bib-racing-pro.jpg",
-    },
-    {
-        "slug": "bib-amateur",
-        "name": "Bib Amateur",
-        "description": (
-            "Pantaloncino con bretelle modello Amateur, pensato per chi vuole "
-            "comfort e stile Amaro nelle uscite quotidiane."
-        ),
-        "price_cents": 6800,  # 68 euro
-        "stock": 0,
-        "image_url": "img/bib-amateur.jpg",
-    },
-    {
-        "slug": "gilet-smanicato",
-        "name": "Smanicato",
-        "description": (
-            "Gilet smanicato antivento leggero, perfetto per discese e mezze "
-            "stagioni, in tinta con la divisa Amaro."
-        ),
-        "price_cents": 6500,  # 65 euro
-        "stock": 0,
-        "image_url": "img/gilet-smanicato.jpg",
-    },
-    {
-        "slug": "giacca-antipioggia",
-        "name": "Antipioggia",
-        "description": (
-            "Giacca antipioggia tecnica ad alta visibilità, pensata per le "
-            "uscite sotto l'acqua e in condizioni meteo difficili."
-        ),
-        "price_cents": 12000,  # 120 euro
-        "stock": 0,
-        "image_url": "img/giacca-antipioggia.jpg",
-    },
-    {
-        "slug": "body-strada",
-        "name": "Body Strada",
-        "description": (
-            "Body strada a maniche corte, taglio aerodinamico per gare e "
-            "crono, con grafica completa Amaro."
-        ),
-        "price_cents": 14800,  # 148 euro
-        "stock": 0,
-        "image_url": "img/body-strada.jpg",
-    },
-    {
-        "slug": "maglia-running",
-        "name": "Maglia Running",
-        "description": (
-            "Maglia tecnica da running leggera e traspirante, con design Amaro "
-            "coordinato all'abbigliamento bici."
-        ),
-        "price_cents": 3500,  # 35 euro
-        "stock": 0,
-        "image_url": "img/maglia-running.jpg",
-    },
-    {
-        "slug": "maglia-sociale-roja",
-        "name": "Maglia Sociale Roja",
-        "description": (
-            "Maglia sociale bianca 'Roja' con grafica Amaro stilizzata, "
-            "pensata per l'uso quotidiano e il dopo-ride."
+logger = logging.getLogger(__name__)
+
+DEFAULT_CATALOG_PATH = Path(__file__).resolve().parent / "catalog.json"
+
+# Colonne che il file non sovrascrive sulle righe esistenti: lo stock cambia
+# con gli ordini, quindi quello del file vale solo per i prodotti nuovi. Per
+# rifornire quelli esistenti c'è `python -m app.orders <slug> --add N`.
+INSERT_ONLY_COLUMNS = {MerchItem: {"stock"}}
+
+
+@dataclass(frozen=True)
+class CatalogFile:
+    events: list[dict[str, Any]]
+    merch: list[dict[str, Any]]
+
+
+def _rows(model: type, items: Any, section: str) -> list[dict[str, Any]]:
+    if not isinstance(items, list):
+        raise ValueError(f"{section}: attesa una lista")
+    columns = model.__table__.columns
+    required = {
+        column.name
+        for column in columns
+        if not column.nullable and column.default is None and not column.primary_key
+    }
+    defaults = {
+        column.name: column.default.arg
+        for column in columns
+        if column.default is not None and column.default.is_scalar
+    }
+    editable = [column.name for column in columns if not column.primary_key]
+    dates = [name for name in editable if isinstance(columns[name].type, Date)]
+    rows: list[dict[str, Any]] = []
+    seen: set[str] = set()
+    for position, item in enumerate(items):
+        if not isinstance(item, dict):
+            raise ValueError(f"{section}[{position}]: atteso un oggetto")
+        unknown = set(item) - set(editable)
+        missing = required - set(item)
+        if unknown or missing:
+            raise ValueError(
+                f"{section}[{position}]: campi sconosciuti {sorted(unknown)}, mancanti {sorted(missing)}"
+            )
+        if item["slug"] in seen:
+            raise ValueError(f"{section}[{position}]: slug ripetuto {item['slug']!r}")
+        seen.add(item["slug"])
+        # Un solo statement vuole le stesse colonne in ogni riga: quelle
+        # mancanti prendono il default del modello.
+        row = {name: item.get(name, defaults.get(name)) for name in editable}
+        for name in dates:
+            if isinstance(row[name], str):
+                row[name] = date.fromisoformat(row[name])
+        rows.append(row)
+    return rows
+
+
+def read_catalog_file(path: Path = DEFAULT_CATALOG_PATH) -> CatalogFile:
+    """Legge e valida il file del catalogo (`events` e `merch`, chiave `slug`).
+
+    Solleva `ValueError` se il JSON o i campi non sono validi.
+    """
+    payload = json.loads(path.read_text(encoding="utf-8"))
+    if not isinstance(payload, dict):
+        raise ValueError("Il catalogo deve essere un oggetto con `events` e `merch`")
+    return CatalogFile(
+        events=_rows(Event, payload.get("events", []), "events"),
+        merch=_rows(MerchItem, payload.get("merch", []), "merch"),
+    )
+
+
+def _upsert(session: Session, model: type, rows: list[dict[str, Any]]) -> None:
+    """Inserisce o aggiorna per slug con un solo statement.
+
+    Le righe uguali al file non vengono riscritte, quindi non fanno scattare
+    i trigger della versione del catalogo.
+    """
+    if not rows:
+        return
+    table = model.__table__
+    updated = [
+        name for name in rows[0] if name != "slug" and name not in INSERT_ONLY_COLUMNS.get(model, ())
+    ]
+    dialect = session.get_bind().dialect.name
+    if dialect == "sqlite":
+        from sqlalchemy.dialects.sqlite import insert as dialect_insert
+    elif dialect == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert as dialect_insert
+    else:
+        existing = {
+            row.slug: row
+            for row in session.execute(
+                select(table).where(table.c.slug.in_([row["slug"] for row in rows]))
+            )
+        }
+        missing = [row for row in rows if row["slug"] not in existing]
+        changed = [
+            {"id": existing[row["slug"]].id, **{name: row[name] for name in updated}}
+            for row in rows
+            if row["slug"] in existing
+            and any(getattr(existing[row["slug"]], name) != row[name] for name in updated)
+        ]
+        if missing:
+            session.execute(insert(model), missing)
+        if changed:
+            session.execute(update(model), changed)
+        return
+    statement = dialect_insert(table)
+    # Core e non ORM: con migliaia di righe il bulk insert dell'ORM costa il doppio.
+    session.connection().execute(
+        statement.on_conflict_do_update(
+            index_elements=["slug"],
+            set_={name: statement.excluded[name] for name in updated},
+            where=or_(*(table.c[name].is_distinct_from(statement.excluded[name]) for name in updated)),
         ),
-        "price_cents": 1500,  # 15 euro
-        "stock": 0,
-        "image_url": "img/maglia-sociale-roja.jpg",
-    },
-]
-
-
-def seed_sample_data(session: Session) -> None:
-    for payload in SAMPLE_EVENTS:
-        existing = session.query(Event).filter_by(slug=payload["slug"]).first()
-        if existing:
-            continue
-        session.add(Event(**payload))
-
-    for payload in SAMPLE_MERCH:
-        existing = session.query(MerchItem).filter_by(slug=payload["slug"]).first()
-        if existing:
-            continue
-        session.add(MerchItem(**payload))
+        rows,
+    )
+
 
+def upsert_catalog(session: Session, catalog: CatalogFile) -> None:
+    """Allinea eventi e prodotti al file; le voci tolte dal file restano nel database."""
+    _upsert(session, Event, catalog.events)
+    _upsert(session, MerchItem, catalog.merch)
+    if session.get_bind().dialect.name != "sqlite":
+        bump_catalog_version(session)
     session.commit()
+
+
+def seed_sample_data(session: Session, path: Path = DEFAULT_CATALOG_PATH) -> None:
+    upsert_catalog(session, read_catalog_file(path))
+
+
+class CatalogFileWatcher:
+    """Thread che ricarica il catalogo quando il file cambia (mtime e dimensione).
+
+    Dopo il caricamento chiama `on_reload`; un file non valido viene
+    segnalato nel log e il catalogo in uso resta quello precedente.
+    """
+
+    def __init__(
+        self,
+        path: Path,
+        session_factory: Callable[[], Session],
+        interval: float,
+        on_reload: Callable[[], None] = lambda: None,
+    ) -> None:
+        self.path = path
+        self.session_factory = session_factory
+        self.interval = interval
+        self.on_reload = on_reload
+        self._seen: tuple[int, int] | None = None
+        self._stop = threading.Event()
+        self._thread: threading.Thread | None = None
+
+    def _stamp(self) -> tuple[int, int] | None:
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            return None
+        return stat.st_mtime_ns, stat.st_size
+
+    def mark_loaded(self) -> None:
+        """Il database riflette già il file attuale (es. dopo il seed all'avvio)."""
+        self._seen = self._stamp()
+
+    def run_once(self) -> bool:
+        stamp = self._stamp()
+        if stamp is None or stamp == self._seen:
+            return False
+        self._seen = stamp
+        try:
+            catalog = read_catalog_file(self.path)
+            with self.session_factory() as session:
+                upsert_catalog(session, catalog)
+        except (OSError, ValueError, SQLAlchemyError) as exc:
+            logger.warning("Catalogo %s non ricaricato: %s", self.path, exc)
+            return False
+        logger.info(
+            "Catalogo ricaricato da %s: %s eventi, %s prodotti",
+            self.path,
+            len(catalog.events),
+            len(catalog.merch),
+        )
+        self.on_reload()
+        return True
+
+    def _loop(self) -> None:
+        while not self._stop.wait(self.interval):
+            self.run_once()
+
+    def start(self) -> None:
+        if self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._loop, name="catalog-reload", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
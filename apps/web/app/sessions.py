@@ -0,0 +1,280 @@
+from __future__ import annotations
+
+import json
+import logging
+import secrets
+import threading
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+from typing import Any, Callable
+
+import anyio
+from sqlalchemy import delete, select
+from sqlalchemy.orm import Session
+from starlette.datastructures import MutableHeaders
+from starlette.requests import HTTPConnection
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from .models import WebSession
+
+logger = logging.getLogger(__name__)
+
+SESSION_BACKENDS = ("database", "memory", "cookie")
+SESSION_ID_MAX_LENGTH = 64
+
+SessionRecord = tuple[dict[str, Any], datetime]
+
+
+def _utcnow() -> datetime:
+    return datetime.now(timezone.utc)
+
+
+class SessionStore(ABC):
+    """Backend delle sessioni lato server: dati JSON indicizzati da un id opaco.
+
+    `blocking` indica se i metodi fanno I/O e vanno quindi chiamati fuori
+    dall'event loop.
+    """
+
+    blocking = False
+
+    @abstractmethod
+    def load(self, session_id: str) -> SessionRecord | None:
+        ...
+
+    @abstractmethod
+    def save(self, session_id: str, data: dict[str, Any], max_age: int) -> None:
+        ...
+
+    @abstractmethod
+    def delete(self, session_id: str) -> None:
+        ...
+
+    @abstractmethod
+    def purge_expired(self) -> int:
+        ...
+
+
+class MemorySessionStore(SessionStore):
+    """Sessioni in memoria con scadenza e al più `max_entries` voci (LRU).
+
+    Adatto a un solo processo: con più worker ognuno vede solo le sue sessioni.
+    """
+
+    def __init__(
+        self, max_entries: int = 10000, clock: Callable[[], datetime] = _utcnow
+    ) -> None:
+        self.max_entries = max_entries
+        self._clock = clock
+        self._entries: OrderedDict[str, tuple[str, datetime]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def load(self, session_id: str) -> SessionRecord | None:
+        with self._lock:
+            entry = self._entries.get(session_id)
+            if entry is None:
+                return None
+            payload, expires_at = entry
+            if expires_at <= self._clock():
+                del self._entries[session_id]
+                return None
+            self._entries.move_to_end(session_id)
+        return json.loads(payload), expires_at
+
+    def save(self, session_id: str, data: dict[str, Any], max_age: int) -> None:
+        entry = (json.dumps(data), self._clock() + timedelta(seconds=max_age))
+        with self._lock:
+            self._entries[session_id] = entry
+            self._entries.move_to_end(session_id)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def delete(self, session_id: str) -> None:
+        with self._lock:
+            self._entries.pop(session_id, None)
+
+    def purge_expired(self) -> int:
+        now = self._clock()
+        with self._lock:
+            expired = [key for key, (_payload, expires_at) in self._entries.items() if expires_at <= now]
+            for key in expired:
+                del self._entries[key]
+        return len(expired)
+
+
+class DatabaseSessionStore(SessionStore):
+    """Sessioni nella tabella `web_sessions`, condivise tra tutti i worker."""
+
+    blocking = True
+
+    def __init__(
+        self, session_factory: Callable[[], Session], clock: Callable[[], datetime] = _utcnow
+    ) -> None:
+        self.session_factory = session_factory
+        self._clock = clock
+
+    def load(self, session_id: str) -> SessionRecord | None:
+        with self.session_factory() as session:
+            row = session.execute(
+                select(WebSession.data, WebSession.expires_at).where(
+                    WebSession.id == session_id, WebSession.expires_at > self._clock()
+                )
+            ).first()
+        if row is None:
+            return None
+        expires_at = row.expires_at
+        if expires_at.tzinfo is None:
+            expires_at = expires_at.replace(tzinfo=timezone.utc)
+        return json.loads(row.data), expires_at
+
+    def save(self, session_id: str, data: dict[str, Any], max_age: int) -> None:
+        with self.session_factory() as session:
+            session.merge(
+                WebSession(
+                    id=session_id,
+                    data=json.dumps(data),
+                    expires_at=self._clock() + timedelta(seconds=max_age),
+                )
+            )
+            session.commit()
+
+    def delete(self, session_id: str) -> None:
+        with self.session_factory() as session:
+            session.execute(delete(WebSession).where(WebSession.id == session_id))
+            session.commit()
+
+    def purge_expired(self) -> int:
+        with self.session_factory() as session:
+            result = session.execute(
+                delete(WebSession).where(WebSession.expires_at <= self._clock())
+            )
+            session.commit()
+        return result.rowcount or 0
+
+
+def create_session_store(
+    backend: str, session_factory: Callable[[], Session], max_entries: int
+) -> SessionStore | None:
+    """Store per `SESSION_BACKEND`; `None` per il vecchio cookie firmato."""
+    backend = backend.lower()
+    if backend == "database":
+        return DatabaseSessionStore(session_factory)
+    if backend == "memory":
+        return MemorySessionStore(max_entries)
+    if backend == "cookie":
+        return None
+    raise ValueError(f"SESSION_BACKEND non valido: {backend!r} (ammessi: {', '.join(SESSION_BACKENDS)})")
+
+
+class ServerSessionMiddleware:
+    """Come `SessionMiddleware`, ma il cookie porta solo un id casuale.
+
+    I dati restano nello `store`: il cookie pesa poche decine di byte anche
+    con un pagamento in sospeso. La sessione si salva solo se è cambiata o se
+    ha superato metà della sua durata; al cambio di `member_id` (login) si
+    genera un id nuovo e una sessione svuotata viene cancellata. Le richieste
+    sotto `exclude_paths` (es. `/static/`) passano senza toccare lo store.
+    """
+
+    def __init__(
+        self,
+        app: ASGIApp,
+        store: SessionStore,
+        session_cookie: str = "session",
+        max_age: int = 14 * 24 * 3600,
+        path: str = "/",
+        same_site: str = "lax",
+        https_only: bool = False,
+        exclude_paths: tuple[str, ...] = (),
+    ) -> None:
+        self.app = app
+        self.store = store
+        self.exclude_paths = exclude_paths
+        self.session_cookie = session_cookie
+        self.max_age = max_age
+        self.cookie_flags = f"path={path}; httponly; samesite={same_site}"
+        if https_only:
+            self.cookie_flags += "; secure"
+
+    async def _call(self, func: Callable[..., Any], *args: Any) -> Any:
+        if self.store.blocking:
+            return await anyio.to_thread.run_sync(func, *args)
+        return func(*args)
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] not in ("http", "websocket") or scope["path"].startswith(self.exclude_paths):
+            await self.app(scope, receive, send)
+            return
+
+        cookie = HTTPConnection(scope).cookies.get(self.session_cookie)
+        record = None
+        if cookie and len(cookie) <= SESSION_ID_MAX_LENGTH:
+            record = await self._call(self.store.load, cookie)
+        data, expires_at = record if record else ({}, None)
+        session_id = cookie if record else None
+        initial = json.dumps(data, sort_keys=True)
+        initial_member = data.get("member_id")
+        scope["session"] = data
+
+        async def send_wrapper(message: Message) -> None:
+            if message["type"] == "http.response.start":
+                headers = MutableHeaders(scope=message)
+                current = scope["session"]
+                if not current:
+                    if session_id:
+                        await self._call(self.store.delete, session_id)
+                    if cookie:
+                        headers.append("Set-Cookie", self._cookie("null", 0))
+                else:
+                    new_id = session_id
+                    if session_id and current.get("member_id") != initial_member:
+                        await self._call(self.store.delete, session_id)
+                        new_id = None
+                    refresh = expires_at is not None and (
+                        expires_at - _utcnow() < timedelta(seconds=self.max_age / 2)
+                    )
+                    if new_id is None or refresh or json.dumps(current, sort_keys=True) != initial:
+                        new_id = new_id or secrets.token_urlsafe(32)
+                        await self._call(self.store.save, new_id, current, self.max_age)
+                        headers.append("Set-Cookie", self._cookie(new_id, self.max_age))
+            await send(message)
+
+        await self.app(scope, receive, send_wrapper)
+
+    def _cookie(self, value: str, max_age: int) -> str:
+        expires = "; expires=Thu, 01 Jan 1970 00:00:00 GMT" if not max_age else ""
+        return f"{self.session_cookie}={value}; {self.cookie_flags}; Max-Age={max_age}{expires}"
+
+
+class SessionSweeper:
+    """Thread in background che cancella le sessioni scadute."""
+
+    def __init__(self, store: SessionStore, interval: float) -> None:
+        self.store = store
+        self.interval = interval
+        self._stop = threading.Event()
+        self._thread: threading.Thread | None = None
+
+    def run_once(self) -> int:
+        try:
+            purged = self.store.purge_expired()
+        except Exception as exc:
+            logger.warning("Pulizia sessioni scadute interrotta: %s", exc)
+            return 0
+        if purged:
+            logger.info("Sessioni scadute cancellate: %s", purged)
+        return purged
+
+    def _loop(self) -> None:
+        while not self._stop.wait(self.interval):
+            self.run_once()
+
+    def start(self) -> None:
+        if self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._loop, name="session-gc", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
@@ -0,0 +1,230 @@
+from __future__ import annotations
+
+import argparse
+import hashlib
+import logging
+import os
+import shutil
+from pathlib import Path
+
+from sqlalchemy import Update, delete, event, select, update
+from sqlalchemy.engine import Connection
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from .assets import unique_tmp_path
+from .models import DocumentBlob, MemberDocument
+
+logger = logging.getLogger(__name__)
+
+BLOBS_DIRNAME = "blobs"
+
+
+def _release_statement(sha256: str) -> Update:
+    return (
+        update(DocumentBlob)
+        .where(DocumentBlob.sha256 == sha256, DocumentBlob.ref_count > 0)
+        .values(ref_count=DocumentBlob.ref_count - 1)
+    )
+
+
+@event.listens_for(MemberDocument, "after_delete")
+def _release_deleted_document(_mapper: object, connection: Connection, document: MemberDocument) -> None:
+    # Vale per ogni `session.delete`, anche in cascata dalla cancellazione del
+    # socio, nella stessa transazione. Le DELETE in blocco (`delete(MemberDocument)`)
+    # non passano dall'ORM: chi le usa chiama `BlobStore.release`.
+    if document.blob_sha256:
+        connection.execute(_release_statement(document.blob_sha256))
+
+
+def file_sha256(path: Path) -> str:
+    digest = hashlib.sha256()
+    with path.open("rb") as handle:
+        for chunk in iter(lambda: handle.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class BlobStore:
+    """Archivio dei documenti indirizzato per contenuto (SHA-256).
+
+    I file stanno in `blobs/<aa>/<bb>/<sha256>` sotto la cartella upload, così
+    nessuna directory cresce troppo; la tabella `document_blobs` tiene il
+    conteggio dei `MemberDocument` che puntano a ciascun blob. Caricare di
+    nuovo lo stesso file non occupa altro spazio.
+    """
+
+    def __init__(self, uploads_dir: Path) -> None:
+        self.uploads_dir = uploads_dir
+        self.root = uploads_dir / BLOBS_DIRNAME
+
+    def relative_path(self, sha256: str) -> str:
+        return f"{BLOBS_DIRNAME}/{sha256[:2]}/{sha256[2:4]}/{sha256}"
+
+    def path(self, sha256: str) -> Path:
+        return self.uploads_dir / self.relative_path(sha256)
+
+    def put(self, session: Session, source: Path, sha256: str, size: int) -> str:
+        """Sposta `source` nel blob `sha256` (o lo scarta se già presente) e
+        incrementa il riferimento; il commit resta al chiamante.
+
+        Il riferimento si prende prima di guardare il disco: se `collect_garbage`
+        sta eliminando lo stesso blob, l'UPDATE aspetta il suo commit e il
+        file, ormai spostato via, viene rimesso.
+        """
+        self._add_reference(session, sha256, size)
+        destination = self.path(sha256)
+        if destination.exists():
+            source.unlink(missing_ok=True)
+        else:
+            destination.parent.mkdir(parents=True, exist_ok=True)
+            os.replace(source, destination)
+        return self.relative_path(sha256)
+
+    def link(self, session: Session, source: Path, sha256: str, size: int) -> str:
+        """Come `put`, ma lascia `source` al suo posto: il blob è un hardlink
+        (o una copia, su un altro filesystem) e l'originale si può eliminare
+        dopo il commit."""
+        self._add_reference(session, sha256, size)
+        destination = self.path(sha256)
+        if not destination.exists():
+            destination.parent.mkdir(parents=True, exist_ok=True)
+            partial = unique_tmp_path(destination)
+            try:
+                os.link(source, partial)
+            except OSError:
+                shutil.copyfile(source, partial)
+            os.replace(partial, destination)
+        return self.relative_path(sha256)
+
+    def _add_reference(self, session: Session, sha256: str, size: int) -> None:
+        increment = (
+            update(DocumentBlob)
+            .where(DocumentBlob.sha256 == sha256)
+            .values(ref_count=DocumentBlob.ref_count + 1)
+        )
+        if session.execute(increment).rowcount:
+            return
+        try:
+            with session.begin_nested():
+                session.add(DocumentBlob(sha256=sha256, size=size, ref_count=1))
+        except IntegrityError:
+            # Un'altra richiesta ha creato lo stesso blob nel frattempo.
+            session.execute(increment)
+
+    def release(self, session: Session, sha256: str) -> None:
+        """Toglie un riferimento al blob; a zero lo elimina `collect_garbage`.
+
+        La cancellazione di un `MemberDocument` lo fa già da sé (vedi
+        `_release_deleted_document`).
+        """
+        session.execute(_release_statement(sha256))
+
+    def collect_garbage(self, session: Session) -> int:
+        """Elimina i blob senza riferimenti e i file orfani sul disco.
+
+        Ogni riga si cancella con una DELETE condizionata a `ref_count <= 0`,
+        in una transazione sua: un `put` concorrente che ha già preso il
+        riferimento la fa andare a vuoto e il file resta. Se la DELETE riesce
+        il file viene spostato su un nome temporaneo e cancellato solo dopo il
+        commit (o rimesso al suo posto se il commit fallisce). La pulizia dei
+        file orfani va comunque lanciata fuori dai picchi: un upload non
+        ancora committato verrebbe visto come orfano.
+        """
+        removed = 0
+        candidates = session.scalars(
+            select(DocumentBlob.sha256).where(DocumentBlob.ref_count <= 0)
+        ).all()
+        for sha256 in candidates:
+            result = session.execute(
+                delete(DocumentBlob).where(
+                    DocumentBlob.sha256 == sha256, DocumentBlob.ref_count <= 0
+                )
+            )
+            if not result.rowcount:
+                session.rollback()
+                continue
+            path = self.path(sha256)
+            doomed = unique_tmp_path(path)
+            try:
+                os.replace(path, doomed)
+            except FileNotFoundError:
+                doomed = None
+            try:
+                session.commit()
+            except Exception:
+                if doomed is not None and not path.exists():
+                    os.replace(doomed, path)
+                raise
+            if doomed is not None:
+                doomed.unlink(missing_ok=True)
+            removed += 1
+        known = set(session.scalars(select(DocumentBlob.sha256)))
+        for path in self.root.glob("*/*/*"):
+            # I .tmp sono link o cancellazioni in corso di un altro processo.
+            if path.is_file() and path.name not in known and path.suffix != ".tmp":
+                path.unlink(missing_ok=True)
+                removed += 1
+        return removed
+
+    def migrate_legacy(self, session: Session, batch_size: int = 200) -> int:
+        """Sposta i file `{member_id}_{uuid}_{nome}` nell'archivio a blob.
+
+        I vecchi file vengono cancellati solo dopo il commit del blocco: se la
+        migrazione si interrompe le righe non ancora committate puntano ancora
+        a un file esistente e una nuova esecuzione riprende da lì.
+        """
+        migrated = 0
+        last_id = 0
+        while True:
+            documents = session.scalars(
+                select(MemberDocument)
+                .where(MemberDocument.blob_sha256.is_(None), MemberDocument.id > last_id)
+                .order_by(MemberDocument.id)
+                .limit(batch_size)
+            ).all()
+            if not documents:
+                return migrated
+            linked: list[Path] = []
+            for document in documents:
+                last_id = document.id
+                legacy_path = self.uploads_dir / document.stored_filename
+                if not legacy_path.is_file():
+                    logger.warning("Documento %s: file %s mancante", document.id, legacy_path)
+                    continue
+                sha256 = file_sha256(legacy_path)
+                document.stored_filename = self.link(
+                    session, legacy_path, sha256, legacy_path.stat().st_size
+                )
+                document.blob_sha256 = sha256
+                linked.append(legacy_path)
+            session.commit()
+            for legacy_path in linked:
+                legacy_path.unlink(missing_ok=True)
+            migrated += len(linked)
+
+
+def main() -> None:
+    from .database import Base, SessionLocal, engine
+    from .main import UPLOADS_DIR
+    from .migrations import run_migrations
+
+    parser = argparse.ArgumentParser(description="Archivio documenti a blob")
+    parser.add_argument("command", choices=["migrate", "gc"])
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    Base.metadata.create_all(bind=engine)
+    run_migrations(engine)
+    store = BlobStore(UPLOADS_DIR)
+    session = SessionLocal()
+    try:
+        if args.command == "migrate":
+            print(f"Documenti migrati: {store.migrate_legacy(session)}")
+        else:
+            print(f"Blob rimossi: {store.collect_garbage(session)}")
+    finally:
+        session.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,229 @@
+from __future__ import annotations
+
+import hashlib
+import json
+import logging
+import os
+import threading
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Callable, Iterable
+
+from .gallery import DriveImage, DrivePage
+from .metrics import observe_drive_call
+
+logger = logging.getLogger(__name__)
+
+DRIVE_THUMBNAIL_URL = "https://drive.google.com/thumbnail"
+INDEX_FILENAME = "index.json"
+
+
+@dataclass
+class SyncResult:
+    downloaded: int = 0
+    skipped: int = 0
+    failed: int = 0
+    removed: int = 0
+
+
+class ThumbnailMirror:
+    """Copia locale delle miniature Drive, indirizzata per contenuto.
+
+    Ogni miniatura viene salvata come `<sha256[:2]>/<sha256>.jpg` sotto `root`
+    (una cartella servita da `/static`); `index.json` associa l'id Drive alla
+    versione (md5Checksum o modifiedTime) e al blob, così a ogni sync vengono
+    scaricati solo i file nuovi o modificati.
+    """
+
+    def __init__(
+        self,
+        root: Path,
+        static_prefix: str = "gallery-cache",
+        thumbnail_url: str = DRIVE_THUMBNAIL_URL,
+        size: str = "w800",
+        timeout: float = 10,
+    ) -> None:
+        self.root = root
+        self.static_prefix = static_prefix.strip("/")
+        self.thumbnail_url = thumbnail_url
+        self.size = size
+        self.timeout = timeout
+        self._lock = threading.Lock()
+        self._index: dict[str, dict[str, str]] = self._load_index()
+
+    @property
+    def index_path(self) -> Path:
+        return self.root / INDEX_FILENAME
+
+    def _load_index(self) -> dict[str, dict[str, str]]:
+        try:
+            data = json.loads(self.index_path.read_text(encoding="utf-8"))
+        except (OSError, ValueError):
+            return {}
+        return data if isinstance(data, dict) else {}
+
+    def _save_index(self) -> None:
+        self.root.mkdir(parents=True, exist_ok=True)
+        tmp_path = self.index_path.with_suffix(".tmp")
+        with self._lock:
+            payload = json.dumps(self._index, sort_keys=True)
+        tmp_path.write_text(payload, encoding="utf-8")
+        os.replace(tmp_path, self.index_path)
+
+    def static_path(self, file_id: str) -> str | None:
+        """Percorso relativo a `/static` della miniatura, se già in cache."""
+        with self._lock:
+            entry = self._index.get(file_id)
+        if not entry:
+            return None
+        return f"{self.static_prefix}/{entry['path']}"
+
+    def localize(
+        self, images: Iterable[DriveImage], url_for_static: Callable[[str], str]
+    ) -> list[DriveImage]:
+        localized: list[DriveImage] = []
+        for image in images:
+            path = self.static_path(image.get("id", ""))
+            localized.append({**image, "url": url_for_static(path)} if path else image)
+        return localized
+
+    def _download(self, file_id: str) -> str:
+        import requests
+
+        self.root.mkdir(parents=True, exist_ok=True)
+        tmp_path = self.root / f".{file_id}.part"
+        digest = hashlib.sha256()
+        try:
+            with observe_drive_call("thumbnail"), requests.get(
+                self.thumbnail_url,
+                params={"id": file_id, "sz": self.size},
+                timeout=self.timeout,
+                stream=True,
+            ) as response:
+                response.raise_for_status()
+                with tmp_path.open("wb") as out:
+                    for chunk in response.iter_content(chunk_size=64 * 1024):
+                        digest.update(chunk)
+                        out.write(chunk)
+            sha256 = digest.hexdigest()
+            relative = f"{sha256[:2]}/{sha256}.jpg"
+            destination = self.root / relative
+            if destination.exists():
+                tmp_path.unlink()
+            else:
+                destination.parent.mkdir(parents=True, exist_ok=True)
+                os.replace(tmp_path, destination)
+            return relative
+        finally:
+            tmp_path.unlink(missing_ok=True)
+
+    def sync(self, pages: Iterable[DrivePage], prune: bool = True) -> SyncResult:
+        result = SyncResult()
+        seen: set[str] = set()
+        for page in pages:
+            for image in page.images:
+                file_id = image.get("id")
+                if not file_id:
+                    continue
+                seen.add(file_id)
+                version = image.get("version", "")
+                with self._lock:
+                    entry = self._index.get(file_id)
+                if (
+                    entry
+                    and version
+                    and entry.get("version") == version
+                    and (self.root / entry["path"]).exists()
+                ):
+                    result.skipped += 1
+                    continue
+                try:
+                    relative = self._download(file_id)
+                except Exception as exc:
+                    logger.warning("Miniatura Drive %s non scaricata: %s", file_id, exc)
+                    result.failed += 1
+                    continue
+                with self._lock:
+                    self._index[file_id] = {"version": version, "path": relative}
+                result.downloaded += 1
+        if prune and not result.failed:
+            result.removed = self._prune(seen)
+        self._save_index()
+        return result
+
+    def _prune(self, keep_ids: set[str]) -> int:
+        with self._lock:
+            for file_id in set(self._index) - keep_ids:
+                del self._index[file_id]
+            referenced = {entry["path"] for entry in self._index.values()}
+        removed = 0
+        for blob in self.root.glob("*/*.jpg"):
+            relative = f"{blob.parent.name}/{blob.name}"
+            if relative not in referenced:
+                blob.unlink(missing_ok=True)
+                removed += 1
+        return removed
+
+
+def iter_folder_pages(
+    folder_id: str, fetch_page: Callable[[str, str | None], DrivePage]
+) -> Iterable[DrivePage]:
+    cursor: str | None = None
+    while True:
+        page = fetch_page(folder_id, cursor)
+        yield page
+        cursor = page.next_cursor
+        if not cursor:
+            return
+
+
+class ThumbnailSyncJob:
+    """Thread in background che riallinea periodicamente il mirror."""
+
+    def __init__(
+        self,
+        mirror: ThumbnailMirror,
+        folders: Callable[[], Iterable[str]],
+        fetch_page: Callable[[str, str | None], DrivePage],
+        interval: float,
+    ) -> None:
+        self.mirror = mirror
+        self.folders = folders
+        self.fetch_page = fetch_page
+        self.interval = interval
+        self._stop = threading.Event()
+        self._thread: threading.Thread | None = None
+
+    def run_once(self) -> SyncResult:
+        def pages() -> Iterable[DrivePage]:
+            for folder_id in self.folders():
+                yield from iter_folder_pages(folder_id, self.fetch_page)
+
+        try:
+            result = self.mirror.sync(pages())
+        except Exception as exc:
+            # Listing interrotto: nessun prune, si riprova al giro successivo.
+            logger.warning("Sync miniature Drive interrotto: %s", exc)
+            return SyncResult(failed=1)
+        logger.info(
+            "Sync miniature Drive: %s scaricate, %s invariate, %s errori, %s rimosse",
+            result.downloaded,
+            result.skipped,
+            result.failed,
+            result.removed,
+        )
+        return result
+
+    def _loop(self) -> None:
+        while not self._stop.is_set():
+            self.run_once()
+            self._stop.wait(self.interval)
+
+    def start(self) -> None:
+        if self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._loop, name="drive-thumbnails", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
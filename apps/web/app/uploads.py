@@ -0,0 +1,236 @@
+from __future__ import annotations
+
+import hashlib
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import BinaryIO
+from uuid import uuid4
+
+import anyio
+from starlette.requests import Request
+
+try:
+    from python_multipart.multipart import MultipartParser, parse_options_header
+except ImportError:  # pragma: no cover - python-multipart < 0.0.13
+    from multipart.multipart import MultipartParser, parse_options_header
+
+from .metrics import UPLOAD_BYTES, UPLOADS
+
+
+class UploadError(Exception):
+    """Richiesta multipart non valida."""
+
+
+class UploadTooLarge(UploadError):
+    """File o richiesta oltre i limiti configurati."""
+
+
+@dataclass
+class StreamedUpload:
+    field_name: str
+    filename: str
+    content_type: str | None
+    temp_path: Path
+    size: int = 0
+    sha256: str = ""
+    _digest: "hashlib._Hash" = field(default_factory=hashlib.sha256, repr=False)
+    _handle: BinaryIO | None = field(default=None, repr=False)
+    _pending: bytearray = field(default_factory=bytearray, repr=False)
+
+    def _flush(self) -> None:
+        # Eseguito in un worker thread: apertura, scrittura e hash fuori dal loop.
+        if self._handle is None:
+            self._handle = self.temp_path.open("wb")
+        if self._pending:
+            data = bytes(self._pending)
+            self._pending.clear()
+            self._handle.write(data)
+            self._digest.update(data)
+
+    def _close(self) -> None:
+        self._flush()
+        if self._handle is not None:
+            self._handle.close()
+            self._handle = None
+        self.sha256 = self._digest.hexdigest()
+
+    def discard(self) -> None:
+        if self._handle is not None:
+            self._handle.close()
+            self._handle = None
+        self.temp_path.unlink(missing_ok=True)
+
+
+@dataclass
+class StreamedForm:
+    fields: dict[str, str] = field(default_factory=dict)
+    files: dict[str, list[StreamedUpload]] = field(default_factory=dict)
+
+    def cleanup(self) -> None:
+        """Rimuove i file temporanei non ancora spostati nella destinazione."""
+        for uploads in self.files.values():
+            for upload in uploads:
+                upload.discard()
+
+
+class _FormBuilder:
+    def __init__(
+        self,
+        destination: Path,
+        max_file_bytes: int,
+        max_fields: int,
+        max_field_bytes: int,
+    ) -> None:
+        self.destination = destination
+        self.max_file_bytes = max_file_bytes
+        self.max_fields = max_fields
+        self.max_field_bytes = max_field_bytes
+        self.form = StreamedForm()
+        self.dirty: list[StreamedUpload] = []
+        self._header_field = bytearray()
+        self._header_value = bytearray()
+        self._headers: dict[bytes, bytes] = {}
+        self._field_name = ""
+        self._field_value = bytearray()
+        self._upload: StreamedUpload | None = None
+        self._parts = 0
+
+    def on_part_begin(self) -> None:
+        self._headers = {}
+        self._field_value = bytearray()
+        self._upload = None
+        self._parts += 1
+        if self._parts > self.max_fields:
+            raise UploadError("Troppi campi nel modulo")
+
+    def on_header_field(self, data: bytes, start: int, end: int) -> None:
+        self._header_field += data[start:end]
+
+    def on_header_value(self, data: bytes, start: int, end: int) -> None:
+        self._header_value += data[start:end]
+
+    def on_header_end(self) -> None:
+        self._headers[bytes(self._header_field).lower()] = bytes(self._header_value)
+        self._header_field = bytearray()
+        self._header_value = bytearray()
+
+    def on_headers_finished(self) -> None:
+        disposition, options = parse_options_header(self._headers.get(b"content-disposition", b""))
+        if disposition != b"form-data" or b"name" not in options:
+            raise UploadError("Parte multipart senza nome")
+        self._field_name = options[b"name"].decode("utf-8", "replace")
+        if b"filename" not in options:
+            return
+        filename = Path(options[b"filename"].decode("utf-8", "replace")).name
+        content_type = self._headers.get(b"content-type")
+        self._upload = StreamedUpload(
+            field_name=self._field_name,
+            filename=filename,
+            content_type=content_type.decode("latin-1") if content_type else None,
+            temp_path=self.destination / f".{uuid4().hex}.part",
+        )
+        self.form.files.setdefault(self._field_name, []).append(self._upload)
+
+    def on_part_data(self, data: bytes, start: int, end: int) -> None:
+        chunk = data[start:end]
+        upload = self._upload
+        if upload is None:
+            if len(self._field_value) + len(chunk) > self.max_field_bytes:
+                raise UploadTooLarge(f"Campo {self._field_name} troppo lungo")
+            self._field_value += chunk
+            return
+        upload.size += len(chunk)
+        if upload.size > self.max_file_bytes:
+            raise UploadTooLarge(f"Il file {upload.filename} supera il limite consentito")
+        upload._pending += chunk
+        if not self.dirty or self.dirty[-1] is not upload:
+            self.dirty.append(upload)
+
+    def on_part_end(self) -> None:
+        if self._upload is None:
+            self.form.fields[self._field_name] = self._field_value.decode("utf-8", "replace")
+        elif not self.dirty or self.dirty[-1] is not self._upload:
+            # Anche i file vuoti devono essere creati e chiusi.
+            self.dirty.append(self._upload)
+
+
+async def stream_multipart(
+    request: Request,
+    destination: Path,
+    max_file_bytes: int,
+    max_request_bytes: int,
+    max_fields: int = 64,
+    max_field_bytes: int = 64 * 1024,
+) -> StreamedForm:
+    """Legge un body multipart scrivendo i file direttamente in `destination`.
+
+    I file arrivano a pezzi in `.<uuid>.part` (con SHA-256 calcolato durante la
+    scrittura), quindi memoria e spool temporaneo restano costanti. I limiti
+    per file e per richiesta vengono controllati man mano che i dati arrivano;
+    in caso di errore i file parziali vengono rimossi.
+    """
+    content_type, params = parse_options_header(request.headers.get("content-type", ""))
+    boundary = params.get(b"boundary")
+    if content_type != b"multipart/form-data" or not boundary:
+        raise UploadError("Il modulo deve essere inviato come multipart/form-data")
+    declared = request.headers.get("content-length")
+    if declared and declared.isdigit() and int(declared) > max_request_bytes:
+        raise UploadTooLarge("Richiesta troppo grande")
+
+    builder = _FormBuilder(destination, max_file_bytes, max_fields, max_field_bytes)
+    parser = MultipartParser(
+        boundary,
+        {
+            "on_part_begin": builder.on_part_begin,
+            "on_part_data": builder.on_part_data,
+            "on_part_end": builder.on_part_end,
+            "on_header_field": builder.on_header_field,
+            "on_header_value": builder.on_header_value,
+            "on_header_end": builder.on_header_end,
+            "on_headers_finished": builder.on_headers_finished,
+        },
+    )
+    destination.mkdir(parents=True, exist_ok=True)
+    received = 0
+    try:
+        async for chunk in request.stream():
+            received += len(chunk)
+            if received > max_request_bytes:
+                raise UploadTooLarge("Richiesta troppo grande")
+            if chunk:
+                _feed(parser, chunk)
+            if builder.dirty:
+                dirty, builder.dirty = builder.dirty, []
+                await anyio.to_thread.run_sync(_flush_all, dirty)
+        _feed(parser, None)
+        uploads = [upload for items in builder.form.files.values() for upload in items]
+        await anyio.to_thread.run_sync(_close_all, uploads)
+    except BaseException:
+        await anyio.to_thread.run_sync(builder.form.cleanup)
+        raise
+    UPLOADS.inc(len(uploads))
+    UPLOAD_BYTES.inc(sum(upload.size for upload in uploads))
+    return builder.form
+
+
+def _feed(parser: MultipartParser, chunk: bytes | None) -> None:
+    try:
+        if chunk is None:
+            parser.finalize()
+        else:
+            parser.write(chunk)
+    except UploadError:
+        raise
+    except ValueError as exc:
+        raise UploadError("Modulo multipart non valido") from exc
+
+
+def _flush_all(uploads: list[StreamedUpload]) -> None:
+    for upload in uploads:
+        upload._flush()
+
+
+def _close_all(uploads: list[StreamedUpload]) -> None:
+    for upload in uploads:
+        upload._close()
+
@@ -0,0 +1,133 @@
+"""Carico misto con un backend Drive lento: galleria, area soci e pagine.
+
+Avvia `DriveStub` con `--delay` secondi di latenza e lancia `--requests`
+richieste con `--concurrency` in volo, a rotazione tra:
+
+- `gallery`: `/api/galleria/{id}?cursor=N` con cursori sempre nuovi, quindi
+  ogni richiesta attende Drive;
+- `member`: `/area-tesserati` con un socio loggato (lettura dal database);
+- `page`: `/merch` (snapshot del catalogo in memoria).
+
+Mostra p50/p95/p99 per tipo di richiesta: con il percorso sincrono le
+chiamate lente a Drive occupano il threadpool e rallentano anche le altre.
+
+    python -m bench.bench_async_routes
+    python -m bench.bench_async_routes --requests 2000 --concurrency 200 --delay 0.5
+
+Richiede `httpx` (solo per i benchmark).
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import json
+import tempfile
+import time
+from pathlib import Path
+
+from .common import configure_environment, summarize
+from .drive_stub import DriveStub
+
+FOLDER_ID = "bench-gallery"
+ROUTES = ("gallery", "member", "page")
+
+
+async def run(requests: int, concurrency: int) -> dict[str, object]:
+    import httpx
+
+    from app import main as web
+    from app.database import SessionLocal
+    from app.models import Member
+
+    latencies: dict[str, list[float]] = {route: [] for route in ROUTES}
+    errors = dict.fromkeys(ROUTES, 0)
+
+    async with web.app.router.lifespan_context(web.app):
+        with SessionLocal() as session:
+            member = Member(
+                name="Socio Bench",
+                first_name="Socio",
+                last_name="Bench",
+                email="bench@example.test",
+                membership_type="Socio ordinario",
+                password_hash=web._hash_password("bench"),
+            )
+            session.add(member)
+            session.commit()
+
+        transport = httpx.ASGITransport(app=web.app)
+        async with httpx.AsyncClient(
+            transport=transport, base_url="http://testserver"
+        ) as anonymous, httpx.AsyncClient(
+            transport=transport, base_url="http://testserver"
+        ) as logged_in:
+            await logged_in.post(
+                "/area-tesserati/login", data={"email": "bench@example.test", "password": "bench"}
+            )
+            requests_by_route = {
+                "gallery": lambda index: anonymous.get(
+                    f"/api/galleria/{FOLDER_ID}", params={"cursor": str(index + 1)}
+                ),
+                "member": lambda index: logged_in.get("/area-tesserati"),
+                "page": lambda index: anonymous.get("/merch"),
+            }
+            counter = iter(range(requests))
+
+            async def worker() -> None:
+                for index in counter:
+                    route = ROUTES[index % len(ROUTES)]
+                    started = time.perf_counter()
+                    try:
+                        response = await requests_by_route[route](index)
+                        ok = response.status_code == 200
+                    except Exception:
+                        ok = False
+                    if ok:
+                        latencies[route].append(time.perf_counter() - started)
+                    else:
+                        errors[route] += 1
+
+            started = time.perf_counter()
+            await asyncio.gather(*(worker() for _ in range(concurrency)))
+            elapsed = time.perf_counter() - started
+
+    result: dict[str, object] = {
+        "overall": summarize(
+            [value for values in latencies.values() for value in values],
+            sum(errors.values()),
+            elapsed,
+        )
+    }
+    for route in ROUTES:
+        summary = summarize(latencies[route], errors[route], elapsed)
+        result[route] = {key: summary[key] for key in ("requests", "errors", "p50_ms", "p95_ms", "p99_ms")}
+    return result
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--requests", type=int, default=900)
+    parser.add_argument("--concurrency", type=int, default=120)
+    parser.add_argument("--delay", type=float, default=0.3, help="latenza di Drive in secondi")
+    args = parser.parse_args()
+
+    stub = DriveStub(photos=10, delay=args.delay).start()
+    try:
+        with tempfile.TemporaryDirectory(prefix="bench-async-") as tmp:
+            configure_environment(
+                Path(tmp),
+                GOOGLE_DRIVE_API_KEY="stub",
+                GOOGLE_DRIVE_API_URL=stub.url,
+                GOOGLE_DRIVE_THUMBNAIL_URL=stub.thumbnail_url,
+                GOOGLE_DRIVE_GALLERY_FOLDER_ID=FOLDER_ID,
+                PAGE_CACHE_MAX_BYTES="0",
+            )
+            result = asyncio.run(run(args.requests, args.concurrency))
+            result["drive_delay_s"] = args.delay
+            print(json.dumps(result, indent=2))
+    finally:
+        stub.stop()
+
+
+if __name__ == "__main__":
+    main()
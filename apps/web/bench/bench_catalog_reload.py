@@ -0,0 +1,97 @@
+"""Caricamento del catalogo da file: upsert iniziale, ricarica invariata e con modifiche.
+
+Genera un catalogo con `--items` eventi e altrettanti prodotti e misura,
+con `CatalogFileWatcher.run_once` come fa il thread in produzione:
+
+- `initial`: primo caricamento (solo INSERT);
+- `unchanged`: file riscritto identico (nessuna riga modificata, la
+  versione del catalogo non cambia);
+- `changed`: il `--changed` per cento dei prodotti cambia prezzo;
+- `snapshot`: rilettura dello snapshot in `CatalogCache` dopo la ricarica.
+
+    python -m bench.bench_catalog_reload
+    python -m bench.bench_catalog_reload --items 20000 --changed 50
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import tempfile
+import time
+from pathlib import Path
+
+from .common import configure_environment
+
+
+def _catalog(items: int, price_offset: int, changed: int) -> dict[str, object]:
+    return {
+        "events": [
+            {"slug": f"uscita-{index}", "title": f"Uscita {index}", "date": "2026-05-13"}
+            for index in range(items)
+        ],
+        "merch": [
+            {
+                "slug": f"articolo-{index}",
+                "name": f"Articolo {index}",
+                "price_cents": 1000 + index + (price_offset if index * 100 < items * changed else 0),
+                "stock": 10,
+            }
+            for index in range(items)
+        ],
+    }
+
+
+def run(items: int, changed: int, workdir: Path) -> dict[str, object]:
+    from app.bootstrap import prepare_database
+    from app.catalog import CatalogCache, read_catalog_version
+    from app.database import SessionLocal, engine
+    from app.seed import CatalogFileWatcher
+
+    path = workdir / "catalog.json"
+    path.write_text(json.dumps({"events": [], "merch": []}), encoding="utf-8")
+    prepare_database(engine, SessionLocal, path)
+    cache = CatalogCache(SessionLocal, check_interval=0)
+    cache.get()
+    watcher = CatalogFileWatcher(path, SessionLocal, interval=0, on_reload=cache.invalidate)
+    watcher.mark_loaded()
+
+    def version() -> int:
+        with SessionLocal() as session:
+            return read_catalog_version(session)
+
+    result: dict[str, object] = {"items": items}
+    for label, payload in (
+        ("initial", _catalog(items, 0, changed)),
+        ("unchanged", _catalog(items, 0, changed)),
+        ("changed", _catalog(items, 500, changed)),
+    ):
+        path.write_text(json.dumps(payload), encoding="utf-8")
+        before = version()
+        started = time.perf_counter()
+        reloaded = watcher.run_once()
+        elapsed = time.perf_counter() - started
+        started = time.perf_counter()
+        snapshot = cache.get()
+        result[label] = {
+            "reloaded": reloaded,
+            "reload_ms": round(elapsed * 1000, 1),
+            "snapshot_ms": round((time.perf_counter() - started) * 1000, 1),
+            "version_bumped": version() != before,
+            "merch": len(snapshot.merch),
+        }
+    return result
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--items", type=int, default=5000)
+    parser.add_argument("--changed", type=int, default=10, help="percentuale di prodotti modificati")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory(prefix="bench-catalog-") as tmp:
+        configure_environment(Path(tmp), CATALOG_RELOAD_INTERVAL="0")
+        print(json.dumps(run(args.items, args.changed, Path(tmp)), indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,164 @@
+"""Benchmark di checkout merch concorrenti sullo stesso prodotto.
+
+Imposta lo stock di un articolo, lancia `--requests` checkout in parallelo
+(quantità 1-3) e verifica che non ci siano aggiornamenti persi: pezzi
+prenotati + stock residuo = stock iniziale, mai stock negativo. Poi fa
+fallire metà dei pagamenti, fa scadere il resto e controlla che lo stock
+torni al valore iniziale. `--naive` ripete la prova con il vecchio schema
+leggi-controlla-scrivi per confronto:
+
+    python -m bench.bench_checkout_stock
+    python -m bench.bench_checkout_stock --stock 500 --requests 2000 --concurrency 64 --naive
+
+Richiede `httpx` (solo per i benchmark).
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import json
+import random
+import sys
+import tempfile
+import threading
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+
+from .common import configure_environment, run_concurrently
+
+SLUG = "maglia-bici-racing-aero"
+
+
+async def run(stock: int, requests: int, concurrency: int) -> dict[str, object]:
+    import httpx
+    from sqlalchemy import func, select, update
+
+    from app.database import SessionLocal
+    from app.main import app
+    from app.models import MerchItem, Order, Payment
+    from app.orders import release_expired
+    from app.payments import apply_outcome
+
+    rng = random.Random(7)
+    quantities = [rng.randint(1, 3) for _ in range(requests)]
+    outcomes = {"reserved": 0, "sold_out": 0}
+
+    async with app.router.lifespan_context(app):
+        with SessionLocal() as session:
+            session.execute(update(MerchItem).where(MerchItem.slug == SLUG).values(stock=stock))
+            session.commit()
+
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://testserver") as client:
+
+            async def call(index: int) -> bool:
+                response = await client.post(
+                    f"/merch/{SLUG}/checkout", data={"quantity": str(quantities[index])}
+                )
+                if response.status_code == 200:
+                    outcomes["reserved"] += 1
+                elif response.status_code == 409:
+                    outcomes["sold_out"] += 1
+                else:
+                    return False
+                return True
+
+            summary = await run_concurrently(call, requests, concurrency)
+
+        with SessionLocal() as session:
+            remaining = session.scalar(select(MerchItem.stock).where(MerchItem.slug == SLUG))
+            reserved = session.scalar(select(func.coalesce(func.sum(Order.quantity), 0))) or 0
+            orders = session.scalar(select(func.count()).select_from(Order))
+            codes = session.scalars(
+                select(Payment.cod_trans).where(Payment.kind == "merch").order_by(Payment.id)
+            ).all()
+            for cod_trans in codes[::2]:
+                apply_outcome(session, cod_trans, "KO")
+            after_failures = session.scalar(select(MerchItem.stock).where(MerchItem.slug == SLUG))
+            release_expired(session, now=datetime.now(timezone.utc) + timedelta(days=1))
+            after_sweep = session.scalar(select(MerchItem.stock).where(MerchItem.slug == SLUG))
+
+    return {
+        "stock": stock,
+        **outcomes,
+        "orders": orders,
+        "reserved_units": reserved,
+        "remaining_stock": remaining,
+        "lost_updates": stock - remaining - reserved,
+        "stock_after_failed_payments": after_failures,
+        "stock_after_sweep": after_sweep,
+        "checkouts_per_s": summary["rps"],
+        "latency": {key: summary[key] for key in ("errors", "p50_ms", "p95_ms", "p99_ms")},
+    }
+
+
+def run_naive(stock: int, requests: int, concurrency: int) -> dict[str, object]:
+    """Vecchio schema: legge lo stock, controlla in Python, riscrive il valore."""
+    from sqlalchemy import select, update
+
+    from app.database import SessionLocal
+    from app.models import MerchItem
+
+    with SessionLocal() as session:
+        session.execute(update(MerchItem).where(MerchItem.slug == SLUG).values(stock=stock))
+        session.commit()
+    rng = random.Random(7)
+    quantities = iter([rng.randint(1, 3) for _ in range(requests)])
+    sold = 0
+    lock = threading.Lock()
+
+    def worker() -> None:
+        nonlocal sold
+        with SessionLocal() as session:
+            for quantity in quantities:
+                current = session.scalar(select(MerchItem.stock).where(MerchItem.slug == SLUG))
+                if current < quantity:
+                    session.rollback()
+                    continue
+                session.execute(
+                    update(MerchItem)
+                    .where(MerchItem.slug == SLUG)
+                    .values(stock=current - quantity)
+                )
+                session.commit()
+                with lock:
+                    sold += quantity
+
+    threads = [threading.Thread(target=worker) for _ in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    with SessionLocal() as session:
+        remaining = session.scalar(select(MerchItem.stock).where(MerchItem.slug == SLUG))
+    return {
+        "stock": stock,
+        "sold_units": sold,
+        "remaining_stock": remaining,
+        "oversold_units": sold - (stock - remaining),
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--stock", type=int, default=200)
+    parser.add_argument("--requests", type=int, default=1000)
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--naive", action="store_true", help="confronta con leggi-controlla-scrivi")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory(prefix="bench-checkout-") as tmp:
+        configure_environment(Path(tmp), MERCH_RESERVATION_SWEEP_INTERVAL="0")
+        result: dict[str, object] = {
+            "atomic": asyncio.run(run(args.stock, args.requests, args.concurrency))
+        }
+        if args.naive:
+            result["naive"] = run_naive(args.stock, args.requests, args.concurrency)
+    print(json.dumps(result, indent=2))
+    atomic = result["atomic"]
+    if atomic["lost_updates"] or atomic["stock_after_sweep"] != args.stock:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
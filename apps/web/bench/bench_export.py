@@ -0,0 +1,79 @@
+"""Export dei soci in streaming: primo byte, durata e memoria per formato.
+
+Popola un database con `--members` soci e un documento ciascuno (blob da
+64 KiB condivisi, come in `bench_suite`) e consuma i generatori di
+`app.export` come fa `StreamingResponse`, scartando i byte. Per ogni
+formato riporta il tempo al primo blocco, la durata totale, i MB/s e il
+picco di memoria Python allocata (tracemalloc, che rallenta un po' la run):
+il picco non deve crescere con il numero di soci.
+
+    python -m bench.bench_export
+    python -m bench.bench_export --members 50000 --formats csv,xlsx
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+from typing import Any
+
+from .common import configure_environment
+
+
+def measure(export_format: str) -> dict[str, Any]:
+    from app.database import SessionLocal
+    from app.export import export_members
+    from app.main import UPLOADS_DIR
+
+    tracemalloc.start()
+    started = time.perf_counter()
+    first_chunk: float | None = None
+    written = chunks = 0
+    for chunk in export_members(export_format, SessionLocal, UPLOADS_DIR):
+        if first_chunk is None:
+            first_chunk = time.perf_counter() - started
+        written += len(chunk)
+        chunks += 1
+    elapsed = time.perf_counter() - started
+    _current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {
+        "first_chunk_ms": round((first_chunk or 0) * 1000, 2),
+        "total_s": round(elapsed, 3),
+        "bytes": written,
+        "chunks": chunks,
+        "mb_s": round(written / elapsed / 1e6, 1) if elapsed else 0.0,
+        "peak_kib": round(peak / 1024),
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--members", type=int, default=20000)
+    parser.add_argument("--formats", default="csv,xlsx,zip")
+    parser.add_argument("--workdir", type=Path, help="database persistente tra le run")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory(prefix="bench-export-") as tmp:
+        workdir = args.workdir or Path(tmp)
+        configure_environment(workdir)
+
+        from app.bootstrap import prepare_database
+        from app.database import SessionLocal, engine
+        from app.main import CATALOG_PATH
+
+        from .bench_suite import _seed
+
+        prepare_database(engine, SessionLocal, CATALOG_PATH)
+        _seed(0, 0, args.members)
+        result = {"members": args.members}
+        for export_format in args.formats.split(","):
+            result[export_format] = measure(export_format)
+        print(json.dumps(result, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,145 @@
+"""Benchmark della ricerca per email usata da `POST /area-tesserati/login`.
+
+Popola un database temporaneo con `--members` soci (default 100k, con un
+documento ciascuno) e misura la query del login e il caricamento dei
+documenti dell'area riservata con e senza gli indici della migrazione 4:
+
+    python -m bench.bench_login_lookup
+    python -m bench.bench_login_lookup --members 20000 --lookups 2000
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import random
+import tempfile
+import time
+from pathlib import Path
+
+from .common import configure_environment, summarize
+
+INDEXES = {
+    "ix_members_email_id": "members (email, id)",
+    "ix_member_documents_member_id": "member_documents (member_id)",
+}
+
+
+def _populate(engine, members: int) -> None:
+    from sqlalchemy import insert
+
+    from app.models import Member, MemberDocument
+
+    batch = 5000
+    with engine.begin() as conn:
+        for offset in range(0, members, batch):
+            ids = range(offset + 1, min(offset + batch, members) + 1)
+            conn.execute(
+                insert(Member),
+                [
+                    {
+                        "id": member_id,
+                        "name": f"Socio {member_id}",
+                        "first_name": "Socio",
+                        "last_name": str(member_id),
+                        "email": f"socio{member_id}@example.com",
+                        "membership_type": "Socio ordinario",
+                        "password_hash": "x",
+                    }
+                    for member_id in ids
+                ],
+            )
+            conn.execute(
+                insert(MemberDocument),
+                [
+                    {
+                        "member_id": member_id,
+                        "original_name": "documento.pdf",
+                        "stored_filename": f"blobs/00/00/{member_id:064d}",
+                    }
+                    for member_id in ids
+                ],
+            )
+
+
+def _measure(session_factory, members: int, lookups: int) -> dict[str, object]:
+    from app.models import Member, MemberDocument
+
+    rng = random.Random(42)
+    latencies: list[float] = []
+    session = session_factory()
+    try:
+        started = time.perf_counter()
+        for _ in range(lookups):
+            member_id = rng.randint(1, members)
+            begin = time.perf_counter()
+            member = (
+                session.query(Member)
+                .filter(Member.email == f"socio{member_id}@example.com")
+                .order_by(Member.id.desc())
+                .first()
+            )
+            session.query(MemberDocument).filter(MemberDocument.member_id == member.id).all()
+            latencies.append(time.perf_counter() - begin)
+            session.expunge_all()
+        return summarize(latencies, 0, time.perf_counter() - started)
+    finally:
+        session.close()
+
+
+def _query_plan(engine) -> list[str]:
+    from sqlalchemy import text
+
+    with engine.connect() as conn:
+        rows = conn.execute(
+            text(
+                "EXPLAIN QUERY PLAN SELECT * FROM members WHERE email = :email "
+                "ORDER BY id DESC LIMIT 1"
+            ),
+            {"email": "socio1@example.com"},
+        )
+        return [row[-1] for row in rows]
+
+
+def run(members: int, lookups: int) -> dict[str, object]:
+    from sqlalchemy import text
+
+    from app import models  # noqa: F401 - registra le tabelle su Base
+    from app.database import Base, SessionLocal, engine
+    from app.migrations import run_migrations
+
+    Base.metadata.create_all(bind=engine)
+    run_migrations(engine)
+    _populate(engine, members)
+
+    results: dict[str, object] = {"members": members}
+    with engine.begin() as conn:
+        for name in INDEXES:
+            conn.execute(text(f"DROP INDEX IF EXISTS {name}"))
+    results["without_indexes"] = {
+        "plan": _query_plan(engine),
+        **_measure(SessionLocal, members, max(lookups // 10, 50)),
+    }
+    with engine.begin() as conn:
+        for name, target in INDEXES.items():
+            conn.execute(text(f"CREATE INDEX {name} ON {target}"))
+        conn.execute(text("ANALYZE"))
+    results["with_indexes"] = {
+        "plan": _query_plan(engine),
+        **_measure(SessionLocal, members, lookups),
+    }
+    return results
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--members", type=int, default=100_000)
+    parser.add_argument("--lookups", type=int, default=5000)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory(prefix="bench-login-") as tmp:
+        configure_environment(Path(tmp))
+        print(json.dumps(run(args.members, args.lookups), indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,71 @@
+"""Benchmark delle pagine anonime con e senza la cache delle pagine renderizzate.
+
+Misura le richieste al secondo di `/`, `/merch`, `/merch/{slug}`,
+`/eventi/{slug}` e `/associazione` prima con la cache disattivata e poi
+attiva, nello stesso processo:
+
+    python -m bench.bench_pages
+    python -m bench.bench_pages --requests 3000 --concurrency 16
+
+Richiede `httpx` (solo per i benchmark).
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import json
+import tempfile
+from pathlib import Path
+from urllib.parse import quote
+
+from .common import configure_environment, run_concurrently
+
+
+async def run(requests: int, concurrency: int) -> dict[str, object]:
+    import httpx
+
+    from app.main import app, catalog_cache, page_cache
+
+    results: dict[str, dict[str, object]] = {}
+    async with app.router.lifespan_context(app):
+        catalog = catalog_cache.get()
+        pages = ["/", "/merch", "/associazione"]
+        pages += [f"/merch/{item.slug}" for item in catalog.merch[:1]]
+        pages += [f"/eventi/{quote(event.slug)}" for event in catalog.events[:1]]
+        max_bytes = page_cache.max_bytes
+
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://testserver") as client:
+            for label, limit in (("uncached", 0), ("cached", max_bytes or 8 * 1024 * 1024)):
+                page_cache.max_bytes = limit
+                page_cache.clear()
+                for path in pages:
+
+                    async def fetch(_index: int, path: str = path) -> bool:
+                        response = await client.get(path)
+                        return response.status_code == 200
+
+                    summary = await run_concurrently(fetch, requests, concurrency)
+                    results.setdefault(path, {})[label] = {
+                        key: summary[key] for key in ("rps", "p50_ms", "p95_ms", "errors")
+                    }
+        page_cache.max_bytes = max_bytes
+
+    for path, result in results.items():
+        result["speedup"] = round(result["cached"]["rps"] / max(result["uncached"]["rps"], 0.1), 2)
+    return results
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--requests", type=int, default=1000)
+    parser.add_argument("--concurrency", type=int, default=8)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory(prefix="bench-pages-") as tmp:
+        configure_environment(Path(tmp))
+        print(json.dumps(asyncio.run(run(args.requests, args.concurrency)), indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,141 @@
+"""Verifica di concorrenza per i `codTrans` Nexi e il registro `payments`.
+
+Lancia migliaia di `prepare_payment` in parallelo (thread e processi, questi
+ultimi con nodi diversi come più worker uvicorn) e controlla che non ci siano
+duplicati, che i codici di ogni nodo siano crescenti e lunghi al massimo 30
+caratteri. Con `--persist` registra anche ogni pagamento nel database tramite
+`create_payment`, così il vincolo UNIQUE viene messo alla prova davvero:
+
+    python -m bench.bench_payment_codes
+    python -m bench.bench_payment_codes --threads 64 --per-thread 500 --processes 4 --persist
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from pathlib import Path
+
+from .common import configure_environment
+
+
+def _client(node_id: str | None = None):
+    from app.nexi import NexiXpayClient
+
+    return NexiXpayClient(
+        merchant_id="ALIAS_BENCH",
+        api_key="bench-secret",
+        endpoint="https://int-ecommerce.nexi.it/ecomm/ecomm/DispatcherServlet",
+        success_url="http://testserver/nexi/success",
+        failure_url="http://testserver/nexi/failure",
+        node_id=node_id,
+    )
+
+
+def _prepare_many(client, count: int, persist: bool) -> list[str]:
+    codes: list[str] = []
+    session = None
+    if persist:
+        from app.database import SessionLocal
+        from app.payments import create_payment
+
+        session = SessionLocal()
+    try:
+        for _ in range(count):
+            if session is not None:
+                payment = create_payment(session, client.new_cod_trans, "merch", 1500)
+                session.commit()
+                order_id = payment.cod_trans
+            else:
+                order_id = client.new_cod_trans()
+            context = client.prepare_payment(1500, order_id, "bench")
+            codes.append(context.payload["codTrans"])
+    finally:
+        if session is not None:
+            session.close()
+    return codes
+
+
+def _run_node(node_id: str | None, threads: int, per_thread: int, persist: bool) -> list[list[str]]:
+    client = _client(node_id)
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        return list(pool.map(lambda _i: _prepare_many(client, per_thread, persist), range(threads)))
+
+
+def _check(batches: list[list[str]]) -> dict[str, object]:
+    codes = [code for batch in batches for code in batch]
+    # Ogni thread riceve codici crescenti dal generatore condiviso del suo nodo.
+    ordered = all(batch == sorted(batch) and len(set(batch)) == len(batch) for batch in batches)
+    return {
+        "codes": len(codes),
+        "unique": len(set(codes)),
+        "duplicates": len(codes) - len(set(codes)),
+        "monotonic_per_thread": ordered,
+        "max_length": max((len(code) for code in codes), default=0),
+        "sample": codes[:3],
+    }
+
+
+def run(threads: int, per_thread: int, processes: int, persist: bool) -> dict[str, object]:
+    if persist:
+        from app import models  # noqa: F401 - registra le tabelle su Base
+        from app.database import Base, engine
+
+        Base.metadata.create_all(bind=engine)
+
+    started = time.perf_counter()
+    if processes > 1:
+        # Nodi espliciti: con PID diversi il nodo derivato potrebbe collidere.
+        nodes = [f"N{index:02d}" for index in range(processes)]
+        with ProcessPoolExecutor(max_workers=processes) as pool:
+            futures = [
+                pool.submit(_run_node, node, threads, per_thread, persist) for node in nodes
+            ]
+            batches = [batch for future in futures for batch in future.result()]
+    else:
+        batches = _run_node(None, threads, per_thread, persist)
+    elapsed = time.perf_counter() - started
+
+    result = _check(batches)
+    result.update(
+        threads=threads,
+        processes=processes,
+        persisted=persist,
+        elapsed_s=round(elapsed, 3),
+        per_second=round(result["codes"] / elapsed, 1) if elapsed else 0.0,
+    )
+    if persist:
+        from sqlalchemy import func, select
+
+        from app.database import SessionLocal
+        from app.models import Payment
+
+        with SessionLocal() as session:
+            result["rows"] = session.scalar(select(func.count()).select_from(Payment))
+            result["distinct_rows"] = session.scalar(
+                select(func.count(func.distinct(Payment.cod_trans)))
+            )
+    return result
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--threads", type=int, default=32)
+    parser.add_argument("--per-thread", type=int, default=250)
+    parser.add_argument("--processes", type=int, default=1)
+    parser.add_argument("--persist", action="store_true")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory(prefix="bench-payments-") as tmp:
+        configure_environment(Path(tmp))
+        result = run(args.threads, args.per_thread, args.processes, args.persist)
+    print(json.dumps(result, indent=2))
+    if result["duplicates"] or not result["monotonic_per_thread"]:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,111 @@
+"""Benchmark di registrazioni concorrenti su `POST /tesseramento`.
+
+Confronta il profilo SQLite di produzione (WAL, busy_timeout, ...) con le
+impostazioni legacy di SQLite:
+
+    python -m bench.bench_registrations --compare
+    python -m bench.bench_registrations --profile tuned --requests 1000 --concurrency 64
+
+Richiede `httpx` (solo per i benchmark).
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import tempfile
+from pathlib import Path
+
+from .common import configure_environment, run_concurrently
+
+PROFILES: dict[str, dict[str, str]] = {
+    "tuned": {},
+    "legacy": {
+        "SQLITE_JOURNAL_MODE": "delete",
+        "SQLITE_SYNCHRONOUS": "full",
+        "SQLITE_BUSY_TIMEOUT_MS": "0",
+        "SQLITE_CACHE_SIZE_KIB": "2000",
+        "SQLITE_MMAP_SIZE": "0",
+        "SQLITE_TEMP_STORE": "default",
+        "DB_POOL_SIZE": "5",
+        "DB_MAX_OVERFLOW": "10",
+    },
+}
+
+FORM = {
+    "first_name": "Maria",
+    "last_name": "Rossi",
+    "email": "maria@example.com",
+    "birth_date": "1990-04-12",
+    "birth_place": "Piacenza",
+    "residence": "Via Roma 1, Piozzano",
+    "codice_fiscale": "RSSMRA90D52G535X",
+    "document_type": "Carta d'identità",
+    "document_number": "CA00000AA",
+    "tessera_sanitaria": "80380000000000000000",
+    "medical_certificate": "Idoneità agonistica",
+    "medical_certificate_expiry": "2027-04-12",
+    "membership_type": "Socio ordinario",
+}
+
+
+async def run(requests: int, concurrency: int, document_kib: int) -> dict[str, object]:
+    import httpx
+
+    from app.main import app
+
+    document = os.urandom(document_kib * 1024)
+    async with app.router.lifespan_context(app):
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://testserver") as client:
+
+            async def register(index: int) -> bool:
+                files = [
+                    ("documents", (f"certificato-{index}.pdf", document, "application/pdf")),
+                    ("documents", ("tessera.jpg", index.to_bytes(4, "big") * 256, "image/jpeg")),
+                ]
+                data = {**FORM, "email": f"socio{index}@example.com"}
+                response = await client.post("/tesseramento", data=data, files=files)
+                return response.status_code == 303
+
+            return await run_concurrently(register, requests, concurrency)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Benchmark registrazioni concorrenti")
+    parser.add_argument("--profile", choices=sorted(PROFILES), default="tuned")
+    parser.add_argument("--requests", type=int, default=500)
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--document-kib", type=int, default=200)
+    parser.add_argument("--compare", action="store_true", help="esegue tutti i profili")
+    args = parser.parse_args()
+
+    if args.compare:
+        results = {}
+        for profile in PROFILES:
+            output = subprocess.run(
+                [
+                    sys.executable, "-m", "bench.bench_registrations",
+                    "--profile", profile,
+                    "--requests", str(args.requests),
+                    "--concurrency", str(args.concurrency),
+                    "--document-kib", str(args.document_kib),
+                ],
+                check=True, capture_output=True, text=True,
+            ).stdout
+            results[profile] = json.loads(output.strip().splitlines()[-1])
+        print(json.dumps(results, indent=2))
+        return
+
+    with tempfile.TemporaryDirectory(prefix="amaro-bench-") as workdir:
+        configure_environment(Path(workdir), **PROFILES[args.profile])
+        result = asyncio.run(run(args.requests, args.concurrency, args.document_kib))
+    result["profile"] = args.profile
+    print(json.dumps(result))
+
+
+if __name__ == "__main__":
+    main()
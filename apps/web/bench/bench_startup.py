@@ -0,0 +1,112 @@
+"""Tempo di avvio a freddo: import di `app.main`, startup e prima richiesta.
+
+Ogni misura gira in un processo Python nuovo, come un'istanza appena
+svegliata da un hosting scale-to-zero:
+
+- `cold`: database vuoto, quindi creazione dello schema e seed;
+- `warm`: database già pronto da un avvio precedente.
+
+Per ogni fase riporta la mediana e il massimo su `--runs` avvii:
+
+    python -m bench.bench_startup
+    python -m bench.bench_startup --runs 10 --path /merch
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import json
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+from .common import configure_environment
+
+PHASES = ("process_ms", "import_ms", "startup_ms", "first_request_ms", "total_ms")
+
+
+async def _first_request(app, path: str) -> tuple[float, float, int]:
+    import httpx
+
+    started = time.perf_counter()
+    async with app.router.lifespan_context(app):
+        ready = time.perf_counter()
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://testserver") as client:
+            response = await client.get(path)
+        done = time.perf_counter()
+    return ready - started, done - ready, response.status_code
+
+
+def child(workdir: Path, path: str, launched: float) -> None:
+    began = time.time()
+    started = time.perf_counter()
+    configure_environment(workdir)
+    from app.main import app
+
+    imported = time.perf_counter()
+    startup, first_request, status_code = asyncio.run(_first_request(app, path))
+    print(
+        json.dumps(
+            {
+                "process_ms": round((began - launched) * 1000, 1),
+                "import_ms": round((imported - started) * 1000, 1),
+                "startup_ms": round(startup * 1000, 1),
+                "first_request_ms": round(first_request * 1000, 1),
+                "status": status_code,
+            }
+        )
+    )
+
+
+def _launch(workdir: Path, path: str) -> dict[str, float]:
+    launched = time.time()
+    output = subprocess.run(
+        [
+            sys.executable, "-m", "bench.bench_startup",
+            "--child", str(workdir), "--path", path, "--launched", repr(launched),
+        ],
+        check=True, capture_output=True, text=True,
+    ).stdout
+    timings = json.loads(output.strip().splitlines()[-1])
+    timings["total_ms"] = round((time.time() - launched) * 1000, 1)
+    if timings.pop("status") != 200:
+        raise SystemExit(f"{path} non ha risposto 200 durante l'avvio")
+    return timings
+
+
+def _summary(runs: list[dict[str, float]]) -> dict[str, dict[str, float]]:
+    return {
+        phase: {
+            "median": round(statistics.median(run[phase] for run in runs), 1),
+            "max": max(run[phase] for run in runs),
+        }
+        for phase in PHASES
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--path", default="/", help="route della prima richiesta")
+    parser.add_argument("--child", type=Path, help=argparse.SUPPRESS)
+    parser.add_argument("--launched", type=float, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        child(args.child, args.path, args.launched)
+        return
+
+    with tempfile.TemporaryDirectory(prefix="bench-startup-") as tmp:
+        cold = [_launch(Path(tmp) / f"cold-{index}", args.path) for index in range(args.runs)]
+        warm_dir = Path(tmp) / "warm"
+        _launch(warm_dir, args.path)
+        warm = [_launch(warm_dir, args.path) for _ in range(args.runs)]
+    print(json.dumps({"path": args.path, "cold": _summary(cold), "warm": _summary(warm)}, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,317 @@
+"""Suite di benchmark in-process delle route principali, con confronto tra run.
+
+Popola un database sintetico (`--events` eventi, `--merch` prodotti,
+`--members` soci con un documento ciascuno), avvia lo stub di Drive e
+pilota `app` con `httpx.ASGITransport`, senza rete. Per ogni scenario
+misura richieste al secondo e p50/p95/p99:
+
+- `GET /`, `GET /merch`, `GET /merch/{slug}` (slug a caso), `GET /galleria`;
+- `POST /tesseramento` con due allegati (`--document-kib`);
+- `POST /area-tesserati/login` con soci a caso;
+- `GET /tesseramento/documenti/{id}` da soci loggati.
+
+Nexi è configurato con credenziali finte: nessuno scenario lo contatta.
+Con `--output` il risultato va in un file JSON; con `--baseline` lo si
+confronta con una run precedente e si esce con codice 1 se throughput o
+p95 peggiorano oltre `--max-regression`, o se ci sono errori:
+
+    python -m bench.bench_suite --output bench-results.json
+    python -m bench.bench_suite --baseline bench-results.json --max-regression 0.2
+    python -m bench.bench_suite --workdir .bench --routes login,document
+
+Con `--workdir` il database resta su disco e viene popolato una volta sola.
+
+Richiede `httpx` (solo per i benchmark).
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import hashlib
+import json
+import os
+import platform
+import random
+import sys
+import tempfile
+from datetime import date, datetime, timedelta, timezone
+from http.cookiejar import CookieJar, DefaultCookiePolicy
+from pathlib import Path
+from typing import Any, Awaitable, Callable
+
+from .bench_registrations import FORM
+from .common import configure_environment, run_concurrently
+from .drive_stub import DriveStub
+
+EVENTS_FOLDER_ID = "bench-events"
+GALLERY_FOLDER_ID = "bench-gallery"
+PASSWORD = "bench"
+BLOBS = 16
+BLOB_BYTES = 64 * 1024
+LOGGED_IN_MEMBERS = 64
+BATCH = 5000
+
+SCENARIOS = {
+    "home": "GET /",
+    "merch": "GET /merch",
+    "merch_detail": "GET /merch/{slug}",
+    "gallery": "GET /galleria",
+    "registration": "POST /tesseramento",
+    "login": "POST /area-tesserati/login",
+    "document": "GET /tesseramento/documenti/{document_id}",
+}
+GATED_METRICS = (("rps", -1), ("p95_ms", 1))
+
+
+def _rows(total: int, make: Callable[[int], dict[str, Any]]):
+    for offset in range(0, total, BATCH):
+        yield [make(row_id) for row_id in range(offset + 1, min(offset + BATCH, total) + 1)]
+
+
+def _seed(events: int, merch: int, members: int) -> None:
+    """Popola il database, se non lo è già da una run precedente."""
+    from sqlalchemy import func, insert, select
+
+    from app.database import engine
+    from app.main import _hash_password, blob_store
+    from app.models import DocumentBlob, Event, Member, MemberDocument, MerchItem
+
+    with engine.begin() as conn:
+        existing = conn.scalar(select(func.count()).select_from(Member))
+        if existing:
+            if existing < members:
+                raise SystemExit(f"La workdir ha solo {existing} soci: cancellarla per ripopolarla.")
+            return
+
+        # Pochi blob reali condivisi da tutti i documenti, come dopo la deduplica.
+        blobs = []
+        for index in range(BLOBS):
+            payload = hashlib.sha256(str(index).encode()).digest() * (BLOB_BYTES // 32)
+            sha256 = hashlib.sha256(payload).hexdigest()
+            path = blob_store.path(sha256)
+            path.parent.mkdir(parents=True, exist_ok=True)
+            path.write_bytes(payload)
+            blobs.append(sha256)
+        conn.execute(
+            insert(DocumentBlob),
+            [
+                {"sha256": sha256, "size": BLOB_BYTES, "ref_count": len(range(index, members, BLOBS))}
+                for index, sha256 in enumerate(blobs)
+            ],
+        )
+
+        today = date.today()
+        offset = 100000
+        for rows in _rows(events, lambda row: {
+            "id": offset + row,
+            "title": f"Uscita {row}",
+            "slug": f"bench-uscita-{row}",
+            "description": "Giro sociale sui colli. " * 8,
+            "location": "Piozzano",
+            "summary": "Ritrovo in piazza alle 8.",
+            "date": today + timedelta(days=row % 365),
+            "teaser": "Giro sociale",
+        }):
+            conn.execute(insert(Event), rows)
+        for rows in _rows(merch, lambda row: {
+            "id": offset + row,
+            "name": f"Articolo {row:05d}",
+            "slug": f"bench-articolo-{row}",
+            "description": "Capo tecnico in edizione limitata. " * 4,
+            "price_cents": 1000 + row % 5000,
+            "stock": 1000,
+            "image_url": "img/maglia-sociale-roja.jpg",
+        }):
+            conn.execute(insert(MerchItem), rows)
+
+        password_hash = _hash_password(PASSWORD)
+        uploaded_at = datetime.now(timezone.utc)
+        for rows in _rows(members, lambda row: {
+            "id": row,
+            "name": f"Socio {row}",
+            "first_name": "Socio",
+            "last_name": str(row),
+            "email": f"socio{row}@example.com",
+            "membership_type": "Socio ordinario",
+            "payment_status": "paid",
+            "password_hash": password_hash,
+        }):
+            conn.execute(insert(Member), rows)
+            conn.execute(
+                insert(MemberDocument),
+                [
+                    {
+                        "id": row["id"],
+                        "member_id": row["id"],
+                        "original_name": "certificato.pdf",
+                        "stored_filename": blob_store.relative_path(blobs[row["id"] % BLOBS]),
+                        "blob_sha256": blobs[row["id"] % BLOBS],
+                        "content_type": "application/pdf",
+                        "uploaded_at": uploaded_at,
+                    }
+                    for row in rows
+                ],
+            )
+
+
+def _stateless_client(transport: Any) -> Any:
+    """Client che non conserva i cookie: ogni richiesta è un visitatore nuovo."""
+    import httpx
+
+    return httpx.AsyncClient(
+        transport=transport,
+        base_url="http://testserver",
+        cookies=CookieJar(policy=DefaultCookiePolicy(allowed_domains=[])),
+    )
+
+
+async def run(args: argparse.Namespace) -> dict[str, Any]:
+    import httpx
+
+    from app.main import app, catalog_cache
+
+    rng = random.Random(42)
+    document = os.urandom(args.document_kib * 1024)
+    results: dict[str, Any] = {}
+
+    async with app.router.lifespan_context(app):
+        await asyncio.to_thread(_seed, args.events, args.merch, args.members)
+        catalog_cache.invalidate()
+        catalog = await catalog_cache.aget()
+        slugs = [item.slug for item in catalog.merch]
+        members = args.members
+
+        transport = httpx.ASGITransport(app=app)
+        async with _stateless_client(transport) as client:
+
+            async def login(member_id: int) -> httpx.Response:
+                return await client.post(
+                    "/area-tesserati/login",
+                    data={"email": f"socio{member_id}@example.com", "password": PASSWORD},
+                )
+
+            # Soci già loggati per i download: il documento ha lo stesso id del socio.
+            logged_in = []
+            for member_id in rng.sample(range(1, members + 1), min(members, LOGGED_IN_MEMBERS)):
+                cookies = (await login(member_id)).cookies
+                logged_in.append((member_id, "; ".join(f"{k}={v}" for k, v in cookies.items())))
+
+            async def expect(response: Awaitable[httpx.Response], code: int = 200) -> bool:
+                return (await response).status_code == code
+
+            def registration(index: int) -> Awaitable[bool]:
+                files = [
+                    ("documents", (f"certificato-{index}.pdf", document, "application/pdf")),
+                    ("documents", ("tessera.jpg", index.to_bytes(4, "big") * 256, "image/jpeg")),
+                ]
+                data = {**FORM, "email": f"nuovo{index}@example.com"}
+                return expect(client.post("/tesseramento", data=data, files=files), 303)
+
+            def download(index: int) -> Awaitable[bool]:
+                member_id, cookie = logged_in[index % len(logged_in)]
+                return expect(
+                    client.get(f"/tesseramento/documenti/{member_id}", headers={"Cookie": cookie})
+                )
+
+            calls: dict[str, Callable[[int], Awaitable[bool]]] = {
+                "home": lambda index: expect(client.get("/")),
+                "merch": lambda index: expect(client.get("/merch")),
+                "merch_detail": lambda index: expect(client.get(f"/merch/{rng.choice(slugs)}")),
+                "gallery": lambda index: expect(client.get("/galleria")),
+                "registration": registration,
+                "login": lambda index: expect(login(rng.randint(1, members)), 303),
+                "document": download,
+            }
+            for name in args.routes:
+                await run_concurrently(calls[name], args.warmup, args.concurrency)
+                summary = await run_concurrently(calls[name], args.requests, args.concurrency)
+                results[name] = {"route": SCENARIOS[name], **summary}
+
+    return {
+        "meta": {
+            "created_at": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "requests": args.requests,
+            "concurrency": args.concurrency,
+            "document_kib": args.document_kib,
+            "drive_delay_s": args.drive_delay,
+            "events": len(catalog.events),
+            "merch": len(catalog.merch),
+            "members": members,
+        },
+        "routes": results,
+    }
+
+
+def compare(current: dict[str, Any], baseline: dict[str, Any], max_regression: float) -> list[str]:
+    """Scenari peggiorati oltre la soglia rispetto a `baseline` (o con errori)."""
+    failures = []
+    for name, result in current["routes"].items():
+        if result["errors"]:
+            failures.append(f"{name}: {result['errors']} errori su {result['requests']} richieste")
+        previous = baseline.get("routes", {}).get(name)
+        if previous is None:
+            continue
+        for metric, direction in GATED_METRICS:
+            before, after = previous[metric], result[metric]
+            if not before:
+                continue
+            change = (after - before) / before * direction
+            result.setdefault("change", {})[metric] = round((after - before) / before, 3)
+            if change > max_regression:
+                failures.append(f"{name}: {metric} {before} -> {after} ({change:+.0%} peggio)")
+    return failures
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--routes", default=",".join(SCENARIOS), help="scenari separati da virgola")
+    parser.add_argument("--events", type=int, default=2000)
+    parser.add_argument("--merch", type=int, default=2000)
+    parser.add_argument("--members", type=int, default=100000)
+    parser.add_argument("--requests", type=int, default=1000)
+    parser.add_argument("--warmup", type=int, default=50)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--document-kib", type=int, default=200)
+    parser.add_argument("--drive-delay", type=float, default=0.0, help="latenza di Drive in secondi")
+    parser.add_argument("--workdir", type=Path, help="cartella persistente per database e upload")
+    parser.add_argument("--output", type=Path, help="scrive il risultato JSON in questo file")
+    parser.add_argument("--baseline", type=Path, help="risultato JSON di una run precedente")
+    parser.add_argument("--max-regression", type=float, default=0.15)
+    args = parser.parse_args()
+    args.routes = [name.strip() for name in args.routes.split(",") if name.strip()]
+    unknown = sorted(set(args.routes) - set(SCENARIOS))
+    if unknown:
+        parser.error(f"scenari sconosciuti: {', '.join(unknown)} (ammessi: {', '.join(SCENARIOS)})")
+
+    stub = DriveStub(photos=40, delay=args.drive_delay).start()
+    try:
+        with tempfile.TemporaryDirectory(prefix="bench-suite-") as tmp:
+            configure_environment(
+                args.workdir.resolve() if args.workdir else Path(tmp),
+                GOOGLE_DRIVE_API_KEY="stub",
+                GOOGLE_DRIVE_API_URL=stub.url,
+                GOOGLE_DRIVE_THUMBNAIL_URL=stub.thumbnail_url,
+                GOOGLE_DRIVE_EVENTS_FOLDER_ID=EVENTS_FOLDER_ID,
+                GOOGLE_DRIVE_GALLERY_FOLDER_ID=GALLERY_FOLDER_ID,
+            )
+            result = asyncio.run(run(args))
+    finally:
+        stub.stop()
+
+    failures = []
+    if args.baseline:
+        failures = compare(result, json.loads(args.baseline.read_text(encoding="utf-8")), args.max_regression)
+        result["regressions"] = failures
+    output = json.dumps(result, indent=2)
+    if args.output:
+        args.output.write_text(output + "\n", encoding="utf-8")
+    print(output)
+    if failures:
+        print("\n".join(["Regressioni:", *failures]), file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
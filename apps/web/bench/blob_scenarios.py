@@ -0,0 +1,158 @@
+"""Controlli dell'archivio documenti a blob: riferimenti, cancellazione e gc.
+
+Su un database temporaneo carica due volte lo stesso file (un solo blob, due
+riferimenti), cancella un documento e poi il socio che ha l'altro, e
+verifica che `collect_garbage` tenga il blob finché è referenziato e lo
+elimini dopo l'ultimo riferimento, anche quando un nuovo upload dello stesso
+file arriva tra la SELECT dei candidati e la DELETE. Poi interrompe `migrate_legacy` al commit
+e controlla che i vecchi file restino leggibili e che una seconda esecuzione
+completi la migrazione. Termina con codice 1 se un controllo fallisce:
+
+    python -m bench.blob_scenarios
+"""
+from __future__ import annotations
+
+import json
+import sys
+import tempfile
+from pathlib import Path
+from typing import Any
+
+from .common import configure_environment
+
+
+def _scenarios(workdir: Path) -> dict[str, Any]:
+    from app.bootstrap import prepare_database
+    from app.database import SessionLocal, engine
+    from app.main import CATALOG_PATH
+    from app.models import DocumentBlob, Member, MemberDocument
+    from app.storage import BlobStore, file_sha256
+
+    prepare_database(engine, SessionLocal, CATALOG_PATH)
+    store = BlobStore(workdir / "uploads")
+    checks: dict[str, bool] = {}
+
+    def upload(session: Any, member: Member, payload: bytes) -> MemberDocument:
+        source = workdir / "upload.tmp"
+        source.write_bytes(payload)
+        sha256 = file_sha256(source)
+        stored = store.put(session, source, sha256, len(payload))
+        document = MemberDocument(
+            member=member, original_name="certificato.pdf", stored_filename=stored, blob_sha256=sha256
+        )
+        session.add(document)
+        return document
+
+    def ref_count(session: Any, sha256: str) -> int | None:
+        blob = session.get(DocumentBlob, sha256)
+        session.expire_all()
+        return None if blob is None else blob.ref_count
+
+    with SessionLocal() as session:
+        members = [
+            Member(
+                name=f"Socio {index}",
+                first_name="Socio",
+                last_name=str(index),
+                email=f"socio{index}@example.com",
+                membership_type="Socio ordinario",
+            )
+            for index in range(2)
+        ]
+        session.add_all(members)
+        payload = b"%PDF-1.4 certificato " * 1000
+        first = upload(session, members[0], payload)
+        upload(session, members[1], payload)
+        session.commit()
+        sha256 = first.blob_sha256
+        blob_path = store.path(sha256)
+        checks["dedup_two_references"] = ref_count(session, sha256) == 2 and blob_path.is_file()
+
+        session.delete(session.get(MemberDocument, first.id))
+        session.commit()
+        checks["delete_document_releases"] = ref_count(session, sha256) == 1
+        store.collect_garbage(session)
+        checks["gc_keeps_referenced_blob"] = blob_path.is_file()
+
+        session.delete(session.get(Member, members[1].id))
+        session.commit()
+        checks["delete_member_releases"] = ref_count(session, sha256) == 0
+        removed = store.collect_garbage(session)
+        checks["gc_removes_unreferenced_blob"] = (
+            removed == 1 and not blob_path.exists() and ref_count(session, sha256) is None
+        )
+
+        # Un upload che prende il riferimento mentre il gc ha già scelto il blob.
+        upload(session, members[0], payload)
+        session.commit()
+        session.delete(session.get(Member, members[0].id).documents[0])
+        session.commit()
+        execute = session.execute
+
+        def racing_execute(statement: Any, *args: Any, **kwargs: Any) -> Any:
+            if getattr(statement, "is_delete", False):
+                with SessionLocal() as other:
+                    upload(other, other.get(Member, members[0].id), payload)
+                    other.commit()
+            return execute(statement, *args, **kwargs)
+
+        session.execute = racing_execute  # type: ignore[method-assign]
+        try:
+            removed = store.collect_garbage(session)
+        finally:
+            del session.execute
+        checks["gc_keeps_blob_referenced_concurrently"] = (
+            removed == 0 and blob_path.is_file() and ref_count(session, sha256) == 1
+        )
+
+        legacy = []
+        for index in range(3):
+            name = f"{members[0].id}_legacy{index}_certificato.pdf"
+            (store.uploads_dir / name).write_bytes(f"vecchio documento {index}".encode())
+            document = MemberDocument(
+                member_id=members[0].id, original_name="certificato.pdf", stored_filename=name
+            )
+            session.add(document)
+            legacy.append(document)
+        session.commit()
+        legacy_ids = [document.id for document in legacy]
+
+        def crash() -> None:
+            raise RuntimeError("commit interrotto")
+
+        session.commit = crash  # type: ignore[method-assign]
+        try:
+            store.migrate_legacy(session)
+        except RuntimeError:
+            pass
+        del session.commit
+        session.rollback()
+        documents = [session.get(MemberDocument, document_id) for document_id in legacy_ids]
+        checks["interrupted_migration_keeps_legacy_files"] = all(
+            document.blob_sha256 is None and (store.uploads_dir / document.stored_filename).is_file()
+            for document in documents
+        )
+        migrated = store.migrate_legacy(session)
+        session.expire_all()
+        documents = [session.get(MemberDocument, document_id) for document_id in legacy_ids]
+        checks["rerun_completes_migration"] = migrated == 3 and all(
+            document.blob_sha256 and store.path(document.blob_sha256).is_file()
+            for document in documents
+        )
+        checks["legacy_files_removed_after_commit"] = not any(
+            store.uploads_dir.glob(f"{members[0].id}_legacy*")
+        )
+    return {"checks": checks}
+
+
+def main() -> None:
+    with tempfile.TemporaryDirectory(prefix="bench-blobs-") as tmp:
+        configure_environment(Path(tmp))
+        result = _scenarios(Path(tmp))
+    print(json.dumps(result, indent=2))
+    if not all(result["checks"].values()):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,78 @@
+"""Utility condivise dai benchmark in-process (nessuna rete)."""
+from __future__ import annotations
+
+import asyncio
+import os
+import statistics
+import time
+from pathlib import Path
+from typing import Any, Awaitable, Callable
+
+
+def configure_environment(workdir: Path, **overrides: str) -> None:
+    """Imposta le variabili d'ambiente prima di importare `app`."""
+    workdir.mkdir(parents=True, exist_ok=True)
+    defaults = {
+        "DATABASE_URL": f"sqlite:///{workdir / 'bench.db'}",
+        "UPLOAD_PATH": str(workdir / "uploads"),
+        "NEXI_MERCHANT_ID": "ALIAS_BENCH",
+        "NEXI_API_KEY": "bench-secret",
+        "NEXI_ENDPOINT": "https://int-ecommerce.nexi.it/ecomm/ecomm/DispatcherServlet",
+        "NEXI_SUCCESS_URL": "http://testserver/nexi/success",
+        "NEXI_FAILURE_URL": "http://testserver/nexi/failure",
+        "GOOGLE_DRIVE_THUMBNAIL_SYNC_INTERVAL": "0",
+        "PUBLIC_BASE_URL": "http://testserver/",
+    }
+    defaults.update(overrides)
+    for key, value in defaults.items():
+        os.environ.setdefault(key, value)
+
+
+def summarize(latencies: list[float], errors: int, elapsed: float) -> dict[str, Any]:
+    ordered = sorted(latencies)
+
+    def pct(p: float) -> float:
+        if not ordered:
+            return 0.0
+        index = min(len(ordered) - 1, max(0, round(p / 100 * len(ordered)) - 1))
+        return round(ordered[index] * 1000, 2)
+
+    return {
+        "requests": len(latencies) + errors,
+        "errors": errors,
+        "elapsed_s": round(elapsed, 3),
+        "rps": round(len(latencies) / elapsed, 1) if elapsed else 0.0,
+        "mean_ms": round(statistics.fmean(ordered) * 1000, 2) if ordered else 0.0,
+        "p50_ms": pct(50),
+        "p95_ms": pct(95),
+        "p99_ms": pct(99),
+    }
+
+
+async def run_concurrently(
+    call: Callable[[int], Awaitable[bool]], total: int, concurrency: int
+) -> dict[str, Any]:
+    """Esegue `call(i)` `total` volte con al massimo `concurrency` in volo.
+
+    `call` restituisce True se la risposta è quella attesa.
+    """
+    latencies: list[float] = []
+    errors = 0
+    counter = iter(range(total))
+
+    async def worker() -> None:
+        nonlocal errors
+        for index in counter:
+            started = time.perf_counter()
+            try:
+                ok = await call(index)
+            except Exception:
+                ok = False
+            if ok:
+                latencies.append(time.perf_counter() - started)
+            else:
+                errors += 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return summarize(latencies, errors, time.perf_counter() - started)
@@ -0,0 +1,259 @@
+"""Stub locale dell'endpoint `files` di Google Drive.
+
+Uso:
+
+    python -m bench.drive_stub --port 8765 --photos 40 --delay 0.5
+    GOOGLE_DRIVE_API_URL=http://127.0.0.1:8765/drive/v3/files \\
+    GOOGLE_DRIVE_THUMBNAIL_URL=http://127.0.0.1:8765/thumbnail \\
+    GOOGLE_DRIVE_API_KEY=stub poetry run uvicorn app.main:app
+
+`GET /_stats` restituisce il numero di chiamate per cartella, utile per
+verificare hit, scadenza e refresh della cache della galleria.
+
+`scenarios` avvia lo stub in-process e verifica `GalleryCache` con il vero
+`DriveClient` e un orologio finto: miss a freddo, hit, TTL per cartella,
+pagina scaduta servita mentre si aggiorna in background, errori di Drive
+(anche su cursori inventati, con la mappa dei retry limitata),
+fetch concorrenti unificati e paginazione fino all'ultima foto. Termina con
+codice 1 se uno dei controlli fallisce:
+
+    python -m bench.drive_stub scenarios
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import contextlib
+import json
+import logging
+import re
+import sys
+import threading
+import time
+from collections import Counter
+from dataclasses import asdict
+from typing import Any
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+FOLDER_RE = re.compile(r"'([^']+)' in parents")
+
+
+class DriveStub:
+    def __init__(
+        self, host: str = "127.0.0.1", port: int = 0, photos: int = 40, delay: float = 0.0
+    ) -> None:
+        self.photos = photos
+        self.delay = delay
+        self.fail = False
+        self.calls: Counter[str] = Counter()
+        self._lock = threading.Lock()
+        self.server = ThreadingHTTPServer((host, port), self._handler())
+        self.server.daemon_threads = True
+        self._thread: threading.Thread | None = None
+
+    @property
+    def url(self) -> str:
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}/drive/v3/files"
+
+    @property
+    def thumbnail_url(self) -> str:
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}/thumbnail"
+
+    def files_for(self, folder_id: str) -> list[dict[str, str]]:
+        return [
+            {
+                "id": f"{folder_id}-{index:05d}",
+                "name": f"Foto {index}",
+                "webViewLink": f"https://drive.google.com/file/d/{folder_id}-{index:05d}/view",
+                "modifiedTime": "2026-05-13T10:00:00.000Z",
+            }
+            for index in range(self.photos)
+        ]
+
+    def _handler(self) -> type[BaseHTTPRequestHandler]:
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, format: str, *args: object) -> None:
+                pass
+
+            def _send_json(self, status: int, payload: object) -> None:
+                body = json.dumps(payload).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_GET(self) -> None:
+                parsed = urlparse(self.path)
+                if parsed.path == "/_stats":
+                    with stub._lock:
+                        self._send_json(200, dict(stub.calls))
+                    return
+                if parsed.path == "/thumbnail":
+                    file_id = parse_qs(parsed.query).get("id", [""])[0]
+                    with stub._lock:
+                        stub.calls["thumbnail"] += 1
+                    body = b"\xff\xd8\xff\xe0" + file_id.encode("utf-8") + b"\xff\xd9"
+                    self.send_response(200)
+                    self.send_header("Content-Type", "image/jpeg")
+                    self.send_header("Content-Length", str(len(body)))
+                    self.end_headers()
+                    self.wfile.write(body)
+                    return
+                if parsed.path != "/drive/v3/files":
+                    self._send_json(404, {"error": "not found"})
+                    return
+                params = parse_qs(parsed.query)
+                match = FOLDER_RE.search(params.get("q", [""])[0])
+                folder_id = match.group(1) if match else ""
+                with stub._lock:
+                    stub.calls[folder_id] += 1
+                if stub.delay:
+                    time.sleep(stub.delay)
+                if stub.fail:
+                    self._send_json(503, {"error": "backend error"})
+                    return
+                page_size = int(params.get("pageSize", ["100"])[0])
+                offset = int(params.get("pageToken", ["0"])[0])
+                files = stub.files_for(folder_id)
+                payload: dict[str, object] = {"files": files[offset : offset + page_size]}
+                if offset + page_size < len(files):
+                    payload["nextPageToken"] = str(offset + page_size)
+                self._send_json(200, payload)
+
+        return Handler
+
+    def start(self) -> "DriveStub":
+        self._thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self.server.shutdown()
+        self.server.server_close()
+
+
+async def _scenarios(stub: DriveStub) -> dict[str, Any]:
+    from app.gallery import DriveClient, GalleryCache, GalleryUnavailable
+
+    now = [0.0]
+    client = DriveClient("stub", api_url=stub.url, page_size=10)
+    cache = GalleryCache(
+        client.list_page, default_ttl=60, error_ttl=30, cold_wait=5, clock=lambda: now[0]
+    )
+    folders = [("eventi", 60.0), ("galleria", 240.0)]
+    checks: dict[str, bool] = {}
+
+    async def settle() -> None:
+        # Lascia completare i refresh in background.
+        while cache._inflight:
+            await asyncio.sleep(0.01)
+
+    try:
+        pages = await cache.get_many(folders)
+        checks["cold_miss_fetches_each_folder_once"] = (
+            stub.calls["eventi"] == 1
+            and stub.calls["galleria"] == 1
+            and len(pages["eventi"].images) == 10
+        )
+
+        await cache.get_many(folders)
+        checks["fresh_hit_skips_drive"] = stub.calls["eventi"] == 1 and cache.stats.hits == 2
+
+        now[0] = 120
+        stale = await cache.get_many(folders)
+        checks["expired_page_served_immediately"] = stale["eventi"] == pages["eventi"]
+        await settle()
+        checks["per_folder_ttl"] = stub.calls["eventi"] == 2 and stub.calls["galleria"] == 1
+        await cache.get_many(folders)
+        checks["background_refresh_fills_cache"] = (
+            stub.calls["eventi"] == 2 and cache.stats.refreshes == 3
+        )
+
+        stub.fail = True
+        now[0] = 240
+        served = await cache.get_many(folders)
+        await settle()
+        checks["drive_error_keeps_stale_page"] = (
+            served["eventi"] == pages["eventi"] and cache.stats.errors == len(folders)
+        )
+        now[0] = 250
+        await cache.get_many(folders)
+        await settle()
+        checks["retry_waits_error_ttl"] = stub.calls["eventi"] == 3
+        try:
+            await cache.get_page("eventi", "10")
+            checks["uncached_page_error_not_cached"] = False
+        except GalleryUnavailable:
+            checks["uncached_page_error_not_cached"] = ("eventi", "10") not in cache._entries
+        # Cursori inventati dal client: la mappa dei retry non cresce oltre max_entries.
+        bounded = GalleryCache(client.list_page, error_ttl=30, max_entries=8, clock=lambda: now[0])
+        for index in range(20):
+            with contextlib.suppress(GalleryUnavailable):
+                await bounded.get_page("eventi", f"casuale-{index}")
+        checks["retry_map_bounded"] = len(bounded._retry_after) == 8
+        now[0] = 300
+        with contextlib.suppress(GalleryUnavailable):
+            await bounded.get_page("eventi", "casuale-19")
+        bounded.close()
+        checks["expired_retry_refetches"] = len(bounded._retry_after) == 8 and (
+            bounded._retry_after[("eventi", "casuale-19")] == 330
+        )
+        stub.fail = False
+
+        now[0] = 1000
+        before = stub.calls["nuova"]
+        await asyncio.gather(*(cache.get_page("nuova") for _ in range(20)))
+        checks["concurrent_misses_share_one_fetch"] = stub.calls["nuova"] - before == 1
+
+        photos, cursor = 0, None
+        while True:
+            page = await cache.get_page("archivio", cursor)
+            photos += len(page.images)
+            cursor = page.next_cursor
+            if cursor is None:
+                break
+        checks["pagination_reaches_whole_archive"] = photos == stub.photos
+    finally:
+        cache.close()
+        await client.aclose()
+    return {"checks": checks, "calls": dict(stub.calls), "stats": asdict(cache.stats)}
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--photos", type=int, default=40)
+    parser.add_argument("--delay", type=float, default=0.0)
+    commands = parser.add_subparsers(dest="command")
+    commands.add_parser("scenarios")
+    args = parser.parse_args()
+
+    if args.command == "scenarios":
+        # Gli errori di Drive sono provocati apposta: non servono nel log.
+        logging.getLogger("app.gallery").setLevel(logging.ERROR)
+        stub = DriveStub(args.host, 0, photos=args.photos, delay=args.delay).start()
+        try:
+            result = asyncio.run(_scenarios(stub))
+        finally:
+            stub.stop()
+        print(json.dumps(result, indent=2))
+        if not all(result["checks"].values()):
+            sys.exit(1)
+        return
+    stub = DriveStub(args.host, args.port, photos=args.photos, delay=args.delay)
+    print(f"Drive stub in ascolto su {stub.url}")
+    try:
+        stub.server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
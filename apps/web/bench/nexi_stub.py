@@ -0,0 +1,202 @@
+"""Dispatcher Nexi finto per la notifica server-to-server `POST /nexi/notifica`.
+
+Firma gli esiti con la stessa chiave dell'app e li invia come farebbe XPay,
+anche ripetuti, fuori ordine o a raffica:
+
+    python -m bench.nexi_stub scenarios
+    python -m bench.nexi_stub scenarios --burst-payments 200 --burst-retries 5
+    NEXI_API_KEY=... python -m bench.nexi_stub send \\
+        --url http://127.0.0.1:8000/nexi/notifica --cod-trans PS... --amount 5000 --repeat 3
+
+`scenarios` lavora in-process (httpx + ASGITransport) su un database
+temporaneo e termina con codice 1 se uno dei controlli fallisce.
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import hashlib
+import json
+import os
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Any
+
+from .common import configure_environment, run_concurrently
+
+MAC_FIELDS = ("codTrans", "esito", "importo", "divisa", "data", "orario", "codAut")
+
+
+class FakeNexi:
+    def __init__(self, api_key: str, alias: str = "ALIAS_BENCH", currency: str = "EUR") -> None:
+        self.api_key = api_key
+        self.alias = alias
+        self.currency = currency
+
+    def outcome(
+        self, cod_trans: str, amount_cents: int, esito: str = "OK", cod_aut: str = ""
+    ) -> dict[str, str]:
+        now = datetime.now(timezone.utc)
+        params = {
+            "alias": self.alias,
+            "codTrans": cod_trans,
+            "esito": esito,
+            "importo": str(amount_cents),
+            "divisa": self.currency,
+            "data": now.strftime("%Y%m%d"),
+            "orario": now.strftime("%H%M%S"),
+            "codAut": cod_aut or ("A" + cod_trans[-5:] if esito == "OK" else ""),
+            "brand": "VISA",
+        }
+        mac_str = "".join(f"{name}={params[name]}" for name in MAC_FIELDS)
+        params["mac"] = hashlib.sha1((mac_str + self.api_key).encode("utf-8")).hexdigest()
+        return params
+
+    async def send(self, client: Any, url: str, params: dict[str, str]) -> int:
+        response = await client.post(url, data=params)
+        return response.status_code
+
+
+async def _scenarios(burst_payments: int, burst_retries: int, concurrency: int) -> dict[str, Any]:
+    import httpx
+
+    from app.config import settings
+    from app.database import SessionLocal
+    from app.main import app
+    from app.models import Member, Payment
+    from app.payments import create_payment
+
+    nexi = FakeNexi(settings.nexipay_api_key or "")
+    url = "/nexi/notifica"
+    checks: dict[str, bool] = {}
+
+    async with app.router.lifespan_context(app):
+        from app.main import _require_nexi_client
+
+        nexi_client = _require_nexi_client()
+
+        def new_payment(kind: str = "merch", amount: int = 2500) -> tuple[str, int]:
+            with SessionLocal() as session:
+                member_id = None
+                if kind == "membership":
+                    member = Member(
+                        name="Socio Bench",
+                        first_name="Socio",
+                        last_name="Bench",
+                        email="bench@example.com",
+                        membership_type="Socio ordinario",
+                    )
+                    session.add(member)
+                    session.flush()
+                    member_id = member.id
+                payment = create_payment(
+                    session, nexi_client.new_cod_trans, kind, amount, member_id=member_id
+                )
+                session.commit()
+                return payment.cod_trans, payment.id
+
+        def state(cod_trans: str) -> tuple[str, str | None]:
+            with SessionLocal() as session:
+                payment = session.query(Payment).filter_by(cod_trans=cod_trans).one()
+                member = session.get(Member, payment.member_id) if payment.member_id else None
+                return payment.status, member.payment_status if member else None
+
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://testserver") as client:
+            code, _ = new_payment("membership", 5000)
+            first = nexi.outcome(code, 5000)
+            statuses = [await nexi.send(client, url, first) for _ in range(3)]
+            checks["duplicate_ok"] = statuses == [200, 200, 200] and state(code) == ("paid", "paid")
+
+            code, _ = new_payment()
+            await nexi.send(client, url, nexi.outcome(code, 2500, "OK"))
+            await nexi.send(client, url, nexi.outcome(code, 2500, "KO"))
+            checks["ko_after_ok_keeps_paid"] = state(code)[0] == "paid"
+
+            code, _ = new_payment()
+            await nexi.send(client, url, nexi.outcome(code, 2500, "KO"))
+            failed = state(code)[0]
+            await nexi.send(client, url, nexi.outcome(code, 2500, "OK"))
+            checks["ok_after_ko_pays"] = failed == "failed" and state(code)[0] == "paid"
+
+            code, _ = new_payment()
+            forged = {**nexi.outcome(code, 2500), "mac": "0" * 40}
+            checks["bad_mac_rejected"] = (
+                await nexi.send(client, url, forged) == 403 and state(code)[0] == "pending"
+            )
+
+            code, _ = new_payment()
+            checks["amount_mismatch_rejected"] = (
+                await nexi.send(client, url, nexi.outcome(code, 1)) == 409
+                and state(code)[0] == "pending"
+            )
+            checks["unknown_code_404"] = (
+                await nexi.send(client, url, nexi.outcome("PS0000000000000000000000000", 100)) == 404
+            )
+
+            # Raffica: ogni pagamento riceve `burst_retries` OK e un KO, mescolati.
+            codes = [new_payment("membership", 5000)[0] for _ in range(burst_payments)]
+            messages = []
+            for index in range(burst_retries):
+                for code in codes:
+                    esito = "KO" if index == burst_retries // 2 else "OK"
+                    messages.append(nexi.outcome(code, 5000, esito))
+
+            async def call(index: int) -> bool:
+                return await nexi.send(client, url, messages[index]) == 200
+
+            burst = await run_concurrently(call, len(messages), concurrency)
+            final = [state(code) for code in codes]
+            # Il KO può arrivare prima di un OK: in ogni caso alla fine tutto è pagato.
+            checks["burst_all_paid"] = all(item == ("paid", "paid") for item in final)
+            checks["burst_no_errors"] = burst["errors"] == 0
+
+    return {"checks": checks, "burst": {"payments": burst_payments, **burst}}
+
+
+def _send(url: str, cod_trans: str, amount: int, esito: str, repeat: int) -> list[int]:
+    import httpx
+
+    nexi = FakeNexi(os.environ.get("NEXI_API_KEY", ""), os.environ.get("NEXI_MERCHANT_ID", "ALIAS"))
+    params = nexi.outcome(cod_trans, amount, esito)
+    statuses = []
+    with httpx.Client(timeout=10) as client:
+        for _ in range(repeat):
+            statuses.append(client.post(url, data=params).status_code)
+            time.sleep(0.1)
+    return statuses
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    commands = parser.add_subparsers(dest="command", required=True)
+    scenarios = commands.add_parser("scenarios")
+    scenarios.add_argument("--burst-payments", type=int, default=100)
+    scenarios.add_argument("--burst-retries", type=int, default=4)
+    scenarios.add_argument("--concurrency", type=int, default=32)
+    send = commands.add_parser("send")
+    send.add_argument("--url", required=True)
+    send.add_argument("--cod-trans", required=True)
+    send.add_argument("--amount", type=int, required=True)
+    send.add_argument("--esito", default="OK")
+    send.add_argument("--repeat", type=int, default=1)
+    args = parser.parse_args()
+
+    if args.command == "send":
+        print(_send(args.url, args.cod_trans, args.amount, args.esito, args.repeat))
+        return
+    with tempfile.TemporaryDirectory(prefix="bench-nexi-") as tmp:
+        configure_environment(Path(tmp))
+        result = asyncio.run(
+            _scenarios(args.burst_payments, args.burst_retries, args.concurrency)
+        )
+    print(json.dumps(result, indent=2))
+    if not all(result["checks"].values()):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()